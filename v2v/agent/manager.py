@@ -1,22 +1,28 @@
 import traceback
+import datetime
+import eventlet
 import eventlet.event
 import subprocess
 import os
 import tempfile
+import threading
 import time
 import re
 import json
-import six
 import sys
-import math
 import v2v.conf
 from oslo_log import log as logging
+from oslo_utils import timeutils
 import oslo_messaging as messaging
 from v2v.db import api as db_api
 from v2v.db.models import VMware, Openstack
 from v2v.db.models import Task as Task_db
 from v2v import manager
-from v2v.common import utils
+from v2v.agent.progress import COPY_STATS_FIELDS, V2VLogTracker
+from v2v.agent.scheduler import AdmissionScheduler, Ticket, estimate_footprint
+from v2v.common.exception import TaskLeaseLost
+from v2v.common.sources import source_keys
+from v2v.cloud.openstack import OpenStack
 
 
 LOG = logging.getLogger(__name__)
@@ -24,6 +30,9 @@ CONF = v2v.conf.CONF
 
 VIRT_V2V = '/usr/bin/virt-v2v'
 
+# Minimum interval in seconds between two writes of the copy progress
+COPY_STATS_INTERVAL = 5
+
 DEVNULL = subprocess.DEVNULL
 
 LOG_DIR = '/var/log/v2v'
@@ -65,54 +74,212 @@ class V2VManager(manager.Manager):
 
     def __init__(self, *args, **kwargs):
         super(V2VManager, self).__init__(service_name='v2v-agent', *args, **kwargs)
-        self.v2v_task = V2VTaskManager()
+        self.v2v_task = V2VTaskManager(self.host)
         self.additional_endpoints.append(self.v2v_task)
         LOG.info(f'Agent is start at {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}')
 
+    def init_host(self):
+        self.v2v_task.start()
+
+    def cleanup_host(self):
+        self.v2v_task.stop()
+
 
 class V2VTaskManager(object):
+    """Run the tasks of the queue stored in the task table
+
+    The queued tasks are the tasks in init state which no agent holds. The
+    dispatcher claims the oldest ones which fit into the agent with an
+    atomic UPDATE of their lease, and the heartbeat renews the leases of
+    the running tasks. A task whose agent stopped renewing its lease is
+    requeued by any agent, so the queue survives the restart of the agents
+    and several agents can drain the same queue. The agent claims the
+    tasks placed on it by the API and the tasks placed on no agent, and
+    reports its free capacity with every heartbeat.
+    """
     target = messaging.Target(namespace='v2v', version='1.0')
 
-    def __init__(self):
+    def __init__(self, host=None):
         super(V2VTaskManager, self).__init__()
-        if CONF.max_concurrent_tasks != 0:
-            self._task_semaphore = eventlet.semaphore.Semaphore(
-                CONF.max_concurrent_tasks)
-        else:
-            self._task_semaphore = utils.UnlimitedSemaphore()
+        self.host = host or CONF.host
+        self._scheduler = AdmissionScheduler(WORK_DIR)
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._threads = []
+        # task id -> V2VTask, the running conversions
+        self._tasks = {}
+        # task id -> when its lease was last claimed or renewed
+        self._renewed_at = {}
+
+    def start(self):
+        # The leases held before a restart are not renewed by anybody
+        expired = db_api.task_expire_leases(self.host)
+        if expired:
+            LOG.info(f'Expired the leases of {expired} tasks held before restart')
+        self.report()
+        self._threads = [eventlet.spawn(self._dispatch_loop),
+                         eventlet.spawn(self._heartbeat_loop)]
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        for t in self._threads:
+            t.kill()
 
     def task(self, ctxt, *args, **kwargs):
-        """Do actual v2v task
+        """Wake up the dispatcher once a task is queued
 
         :param ctxt: request context
         :param args: the arguments
         """
-        task_id = kwargs.get('task_id')
+        LOG.info(f'task={kwargs.get("task_id")} is queued')
+        self._wakeup.set()
+
+    def _dispatch_loop(self):
+        while not self._stopped:
+            self._wakeup.clear()
+            try:
+                db_api.task_reclaim_expired(CONF.task_max_attempts)
+                db_api.task_unplace_lost(
+                    timeutils.utcnow() - datetime.timedelta(seconds=CONF.agent_down_time))
+                self.dispatch()
+            except Exception as ex:
+                LOG.exception(f'dispatch tasks failed with {str(ex)}')
+            self._wakeup.wait(CONF.admission_recheck_interval)
+
+    def _claimable(self):
+        """The queued tasks the agent may claim, oldest first
+
+        The queue is read task_claim_batch tasks at a time, so the tasks
+        of the busy sources at the head of the queue do not hide the tasks
+        of the other sources behind them. The scan stops as soon as the
+        agent is full, the rest of the queue can not be admitted anyway.
+        """
+        after_id = None
+        while not self._scheduler.full():
+            tasks = db_api.task_get_claimable(CONF.task_claim_batch, self.host, after_id=after_id)
+            for task in tasks:
+                if self._scheduler.full():
+                    return
+                yield task
+            if len(tasks) < CONF.task_claim_batch:
+                return
+            after_id = tasks[-1].get('id')
+
+    def dispatch(self):
+        """Claim and start the queued tasks which fit into the agent
+
+        The queue is scanned until the agent is full or every queued task
+        was offered to the scheduler.
+
+        :returns: The number of started tasks
+        """
+        started = 0
+        # The clouds of the tasks of this scan
+        clouds = {}
+        for task in self._claimable():
+            task_id = task.get('uuid')
+            try:
+                src_server = json.loads(task.get('src_server'))
+                if task.get('src_cloud') not in clouds:
+                    clouds[task.get('src_cloud')] = db_api.get_by_uuid(VMware, task.get('src_cloud'))
+                src_cloud = clouds[task.get('src_cloud')]
+                ticket = Ticket(task_id, estimate_footprint(src_server), source_keys(src_cloud))
+            except Exception as ex:
+                LOG.exception(f'task={task_id} can not be scheduled with error={str(ex)}')
+                db_api.task_update_by_uuid(task_id, state=STATUS.FAILED, reason=str(ex)[:255])
+                continue
+            reason = self._scheduler.try_admit(ticket)
+            if reason is not None:
+                if reason != task.get('reason'):
+                    LOG.info(f'task={task_id} is not admitted: {reason}')
+                    db_api.task_update_by_uuid(task_id, reason=reason)
+                continue
+            if not db_api.task_claim(task_id, self.host, CONF.task_lease_seconds):
+                # Claimed by another agent in the meantime
+                self._scheduler.release(ticket)
+                continue
+            self._renewed_at[task_id] = time.time()
+            eventlet.spawn_n(self._run, task, src_server, ticket)
+            started += 1
+        return started
+
+    def _heartbeat_loop(self):
+        interval = CONF.task_lease_seconds / 3.0
+        while not self._stopped:
+            eventlet.sleep(interval)
+            running = self._scheduler.running()
+            renewed_at = time.time()
+            try:
+                held = db_api.task_renew_leases(running, self.host, CONF.task_lease_seconds)
+            except Exception as ex:
+                LOG.exception(f'renew the task leases failed with {str(ex)}')
+                # Give up the tasks whose lease expires before the next
+                # try, another agent may claim them by then
+                expiring = [t for t in running
+                            if self._renewed_at.get(t, 0) + CONF.task_lease_seconds <=
+                            time.time() + interval]
+                self._abort(expiring)
+                continue
+            for task_id in held:
+                self._renewed_at[task_id] = renewed_at
+            self._abort(set(running) - set(held))
+            try:
+                self.report()
+            except Exception as ex:
+                LOG.exception(f'report the agent capacity failed with {str(ex)}')
+
+    def _abort(self, task_ids):
+        """Stop the conversions of the tasks whose lease is lost
+
+        Another agent claims the task again, so the conversion is killed
+        and the task is no more written by this agent.
+        """
+        for task_id in sorted(task_ids):
+            v2vtask = self._tasks.get(task_id)
+            if v2vtask is None or v2vtask.lease_lost:
+                continue
+            LOG.error(f'the lease of task={task_id} is lost, abort its conversion')
+            v2vtask.abort()
+
+    def report(self):
+        """Publish the capacity of the agent for the placement of the tasks"""
+        capacity = self._scheduler.capacity()
+        db_api.agent_heartbeat(self.host,
+                               throughput=db_api.task_sum_throughput(self.host),
+                               affinity=','.join(CONF.agent_affinity),
+                               **capacity)
+
+    def _run(self, task, src_server, ticket):
+        task_id = task.get('uuid')
         LOG.info(f'Beginning with task={task_id}')
         start_time = time.time()
         try:
-            with self._task_semaphore:
-                wait_time = time.time()
-                LOG.info(f'Waiting {wait_time-start_time}s and now to start task={task_id}')
-                task = db_api.get_by_uuid(Task_db, task_id)
-                if task.get('state') == STATUS.INIT:
-                    pass
-                # In retry
-                elif task.get('state') in (STATUS.ABORTED, STATUS.FAILED):
-                    LOG.info(f'task with id={task_id} has state={task.get("state")} and now retry')
-                    db_api.task_update_state_by_uuid(task_id, STATUS.INIT)
-                else:
-                    return
-                v2vtask = V2VTask(task_id,
-                                  task.get('src_cloud'),
-                                  json.loads(task.get('src_server')),
-                                  task.get('dest_cloud'),
-                                  json.loads(task.get('dest_server')))
-                v2vtask.run()
+            v2vtask = V2VTask(task_id,
+                              task.get('src_cloud'),
+                              src_server,
+                              task.get('dest_cloud'),
+                              json.loads(task.get('dest_server')),
+                              owner=self.host,
+                              # The claim counted this attempt
+                              attempt=(task.get('attempts') or 0) + 1)
+            self._tasks[task_id] = v2vtask
+            v2vtask.run()
+        except TaskLeaseLost as ex:
+            # The task belongs to the agent which claims it next
+            LOG.error(f'task={task_id}, end with error={str(ex)}')
         except Exception as ex:
             traceback.print_exc()
             LOG.exception(f'task={task_id}, end with error={str(ex)}')
+            # Do not let a broken task go back to the queue
+            if db_api.get_by_uuid(Task_db, task_id).get('state') in (STATUS.INIT, STATUS.RUNNING):
+                db_api.task_update_state_by_uuid(task_id, STATUS.FAILED)
         finally:
+            self._tasks.pop(task_id, None)
+            self._renewed_at.pop(task_id, None)
+            db_api.task_release_lease(task_id, self.host)
+            self._scheduler.release(ticket)
+            self._wakeup.set()
             end_time = time.time()
             LOG.info(f'Ending with task={task_id}, and it cost {end_time-start_time}s')
 
@@ -143,8 +310,27 @@ class V2VTask(object):
     PROGRESS_COPY_DISK = 'Copying disk'
     PROGRESS_CREATE_M = 'Creating output metadata'
     PROGRESS_FINISH = 'Finishing off'
-
-    def __init__(self, task_id, src_cloud, src_server, dest_cloud, dest_server):
+    PROGRESS_PERCENT = (
+        (PROGRESS_OPEN_SOURCE, 10),
+        (PROGRESS_OPEN_OVERLAY, 15),
+        (PROGRESS_MAPPING, 30),
+        (PROGRESS_CLOSE_OVERLAY, 40),
+        (PROGRESS_INIT_TARGET, 60),
+        (PROGRESS_COPY_DISK, 70),
+        (PROGRESS_CREATE_M, 78),
+        (PROGRESS_FINISH, 88),
+    )
+    COPY_PERCENT_START = 70
+    COPY_PERCENT_END = 78
+
+    def __init__(self, task_id, src_cloud, src_server, dest_cloud, dest_server,
+                 owner=None, attempt=None):
+        """
+        :param owner: The agent holding the lease of the task, the task is
+                only written while it holds the lease. None for a task
+                without a lease.
+        :param attempt: The number of the claim of the task
+        """
         super(V2VTask, self).__init__()
         self.server_name = CONF.server_name
         self.task_id = task_id
@@ -155,25 +341,111 @@ class V2VTask(object):
         self.vmware_password_file = None
         self.v2v_log = None
         self.v2v_log_exist = False
-        self.image_ids = {}
-        self.image_names = {}
-        self.image_sizes = {}
-        self.volume_ids = {}
+        self.tracker = None
         self.failed = False
         self.task_percent = 0
+        self.copy_stats = {}
+        self.copy_stats_at = 0
+        self.owner = owner
+        self.attempt = attempt
+        self.lease_lost = False
+        self._proc = None
+
+    @property
+    def image_ids(self):
+        return self.tracker.image_ids
+
+    @property
+    def image_names(self):
+        return self.tracker.image_names
+
+    @property
+    def image_sizes(self):
+        return self.tracker.image_sizes
+
+    @property
+    def volume_ids(self):
+        return self.tracker.volume_ids
 
     @property
     def task(self):
         return db_api.get_by_uuid(Task_db, self.task_id)
 
+    def abort(self):
+        """Stop the conversion once the lease of the task is lost"""
+        self.lease_lost = True
+        if self._proc is not None and self.is_running():
+            self.kill()
+
+    def hold_lease(self):
+        """Renew the lease of the task before a step which must not be run
+        by two agents, such as creating the volumes or the server
+
+        :returns: False once the lease is lost
+        """
+        if self.lease_lost:
+            return False
+        if self.owner is None:
+            return True
+        try:
+            held = db_api.task_renew_leases([self.task_id], self.owner, CONF.task_lease_seconds)
+        except Exception as ex:
+            self.log(f'renew the lease of the task failed with {str(ex)}', l='error')
+            return False
+        if not held:
+            self.log('the lease of the task is lost', l='error')
+            self.lease_lost = True
+        return not self.lease_lost
+
+    def _update_task(self, **values):
+        """Write the task while the agent holds its lease
+
+        :returns: False once the lease is lost
+        """
+        if self.lease_lost:
+            # The task is no more ours to write
+            return False
+        if self.owner is None:
+            db_api.task_update_by_uuid(self.task_id, **values)
+            return True
+        if not db_api.task_update_by_owner(self.task_id, self.owner, **values):
+            self.log('the lease of the task is lost, it is no more written', l='error')
+            self.lease_lost = True
+            return False
+        return True
+
     def write_task(self, state=None, percent=None):
+        values = {}
         if state is not None:
-            db_api.task_update_state_by_uuid(self.task_id, state)
+            values['state'] = state
+        if percent is not None:
+            values['percent'] = percent
+        if not values or not self._update_task(**values):
+            return
         if percent is not None:
             self.task_percent = percent
-            db_api.task_update_percent_by_uuid(self.task_id, percent)
             self.log(f"v2v migrate percent is {percent}%")
 
+    def write_copy_stats(self):
+        if self.lease_lost:
+            return
+        stats = self.tracker.copy_stats()
+        now = time.time()
+        # Write at once when another disk is copied or the copy is done,
+        # otherwise at most once per COPY_STATS_INTERVAL
+        if stats['current_disk'] == self.copy_stats.get('current_disk') and \
+                stats['eta'] != 0 and now - self.copy_stats_at < COPY_STATS_INTERVAL:
+            return
+        if stats == self.copy_stats:
+            return
+        self.copy_stats = stats
+        self.copy_stats_at = now
+        if not self._update_task(**stats):
+            return
+        self.log(f"v2v copy disk {stats['current_disk']}/{stats['disk_count']} "
+                 f"percent is {stats['disk_percent']}%, throughput is {stats['throughput']}MB/s, "
+                 f"eta is {stats['eta']}s", l='debug')
+
     def log(self, msg, l='info'):
         m = f'[task id: {self.task_id}] ' + msg
         if l == 'info':
@@ -193,6 +465,8 @@ class V2VTask(object):
                  f' source vm info:{self.src_server}, target cloud info:{self.dest_cloud},'
                  f' target vm info:{self.dest_server}')
         self.write_task(state=STATUS.RUNNING)
+        # Forget the copy progress of a previous try
+        db_api.task_update_by_uuid(self.task_id, **dict.fromkeys(COPY_STATS_FIELDS))
         src_cloud_url = self.sure_uri(self.src_cloud.get('user'), self.src_cloud.get('ip'), self.src_cloud.get('uri'))
         password_files = []
         uid = self.get_uid()
@@ -203,6 +477,7 @@ class V2VTask(object):
         work_dir = self.get_work_dir()
         log_tag = f"{self.task_id}-{self.src_server.get('name')}-{time.strftime('%Y%m%dT%H%M%S')}"
         self.v2v_log = os.path.join(log_dir, 'v2v-migrate-%s.log' % log_tag)
+        self.tracker = V2VLogTracker(self.v2v_log, self.PROGRESS_PERCENT, log=self.log)
 
         # Prepare virt-v2v shell
         src_server_name = self.src_server.get('name')
@@ -298,8 +573,13 @@ class V2VTask(object):
 
         # v2v migrate
         try:
+            if self.lease_lost:
+                raise TaskLeaseLost(self.task_id)
             self.log(f'run v2v migrate begin with cmd: {v2v_args}, env: {v2v_env}')
             self.start(self.v2v_log, v2v_args, v2v_env)
+            if self.lease_lost:
+                # Lost while virt-v2v was started
+                self.kill()
             self.write_task(percent=5)
         except Exception as ex:
             self.log(f'run v2v migrate start error with {str(ex)}', l='error')
@@ -316,12 +596,15 @@ class V2VTask(object):
             # > 0 -- subprocess exits abnormally, and the returncode corresponds to the error code
             # < 0 -- subprocess was killed by the signal
             self.log(f"virt-v2v terminated with return code {self.return_code}")
-            if self.return_code != 0:
+            if self.lease_lost:
+                self.log('v2v migrate aborted as the lease of the task is lost', l='error')
+                self.failed = True
+            elif self.return_code != 0:
                 self.log('v2v migrate failed in progress with return code != 0', l='error')
                 self.write_task(state=STATUS.FAILED)
                 self.failed = True
             else:
-                self.parse_log()
+                self.finish_log()
                 self.log(f'get the image={self.image_ids}, get the volume={self.volume_ids}')
                 self.log("v2v migrated has finished, begin to create target server.")
         except Exception as ex:
@@ -329,6 +612,8 @@ class V2VTask(object):
             self.log(f'run v2v migrate in progress error with {str(ex)}', l='error')
             self.write_task(state=STATUS.FAILED)
             raise
+        finally:
+            self.tracker.close()
         # Create Openstack Instance
         try:
             if not self.failed:
@@ -351,6 +636,8 @@ class V2VTask(object):
                 os.remove(f)
             except OSError as ex:
                 self.log(f'when removing password file: {f} has error: {str(ex)}', l='error')
+        if self.lease_lost:
+            raise TaskLeaseLost(self.task_id)
         if self.failed:
             self.write_task(state=STATUS.FAILED)
 
@@ -433,173 +720,242 @@ class V2VTask(object):
         """
         pass
 
+    @staticmethod
+    def get_openstack_auth(v2v_env):
+        """ The auth of the destination cloud, the same as virt-v2v uses """
+        return {
+            'auth_url': v2v_env.get('OS_AUTH_URL'),
+            'username': v2v_env.get('OS_USERNAME'),
+            'password': v2v_env.get('OS_PASSWORD'),
+            'project_name': v2v_env.get('OS_PROJECT_NAME'),
+            'project_domain_name': v2v_env.get('OS_PROJECT_DOMAIN_NAME'),
+            'user_domain_name': v2v_env.get('OS_USER_DOMAIN_NAME'),
+            'region_name': v2v_env.get('OS_REGION_NAME')
+        }
+
     # Create an instance
     def handle_finish(self, v2v_env):
         """Handle finish after successfull conversion
         """
         # Instance name
         vm_name = self.dest_server.get('name') or self.src_server.get('name')
-        if CONF.use_openstack_cli:
-            # Init keystone
-            if self.run_openstack(['token', 'issue'], v2v_env) is None:
-                self.log('check openstack cli failed')
+        try:
+            openstack = OpenStack(self.get_openstack_auth(v2v_env))
+            # Init keystone, the token is reused by all the following requests
+            openstack.session.get_token()
+        except Exception as ex:
+            self.log(f'check openstack connection failed with {str(ex)}', l='error')
+            return False
+
+        if CONF.openstack_type == 'glance':
+            images = []
+            image_names = []
+            image_sizes = []
+            # Build image list
+            for k in sorted(self.image_ids.keys()):
+                images.append(self.image_ids[k])
+            for m in sorted(self.image_names.keys()):
+                image_names.append(self.image_names[m])
+            for n in sorted(self.image_sizes.keys()):
+                image_sizes.append(self.image_sizes[n])
+            if len(images) == 0:
+                self.log('No images found!')
+                return False
+            # Ask glance for the sizes virt-v2v did not print
+            try:
+                for i in range(len(image_sizes), len(images)):
+                    image_sizes.append(V2VLogTracker.format_size(openstack.glance.get_image(images[i]).size))
+            except Exception as ex:
+                self.log(f'Failed to get the size of image={images[i]} with {str(ex)}', l='error')
                 return False
 
-            if CONF.openstack_type == 'glance':
-                images = []
-                image_names = []
-                image_sizes = []
-                # Build image list
-                for k in sorted(self.image_ids.keys()):
-                    images.append(self.image_ids[k])
-                for m in sorted(self.image_names.keys()):
-                    image_names.append(self.image_names[m])
-                for n in sorted(self.image_sizes.keys()):
-                    image_sizes.append(self.image_sizes[n])
-                if len(images) == 0:
-                    self.log('No images found!')
-                    return False
-
-                image_volumes = []
-                image_creating_volumes = []
-                # after image 0 disk convert to volume
-                for i in range(1, len(images)):
-                    image_cmd = [
-                        'volume', 'create',
-                        '--format', 'json',
-                        '--type', '%s' % self.dest_server.get('volume_type'),
-                        '--image', '%s' % str(images[i]),
-                        '--size', '%s' % str(image_sizes[i]),
-                                   '%s' % str(image_names[i])
-                    ]
-                    image_volume = self.run_openstack(image_cmd, v2v_env)
-                    if image_volume is None:
-                        self.log('Failed to convert image to volume', l='error')
-                        return False
-                    image_volume = json.loads(image_volume)
-                    image_creating_volumes.append(image_volume)
-
-                for vol in image_creating_volumes:
-                    self.log(f'Transfering volume: {vol}')
-                    retries = CONF.block_device_allocate_retries
-                    image_volume_state_cmd = [
-                        'volume', 'show',
-                        '--format', 'json',
-                        '%s' % str(vol['id'])
-                    ]
-                    for attempt in range(1, retries + 1):
-                        image_volume_json_state = self.run_openstack(image_volume_state_cmd, v2v_env)
-                        image_volume_state = json.loads(image_volume_json_state)
-                        if image_volume_state['status'] == 'available':
-                            image_volumes.append(image_volume_state)
-                            break
-                        elif image_volume_state['status'] in ['creating', 'downloading']:
-                            time.sleep(CONF.block_device_allocate_retries_interval)
-                        else:
-                            break
-                    image_volume_json_state = self.run_openstack(image_volume_state_cmd, v2v_env)
-                    image_volume_state = json.loads(image_volume_json_state)
-                    if image_volume_state['status'] != 'available':
-                        self.log(f'after a long wait volume={str(vol["id"])} status is {image_volume_state["status"]} not available')
-                        return False
-
-                # Create Instance from image
-                os_command = [
-                    'server', 'create',
-                    '--format', 'json',
-                    '--flavor', self.dest_server.get('flavor'),
-                ]
-                os_command.extend(['--image', images[0]])
-                for i in range(len(image_volumes)):
-                    os_command.extend([
-                        '--block-device-mapping',
-                        '%s=%s' % (self._get_disk_name(i + 2), image_volumes[i]['id'])
-                    ])
-
-                os_command.extend(['--nic', 'net-id=%s' % self.dest_server.get('network')])
-                os_command.append(vm_name)
-            elif CONF.openstack_type == 'openstack':
-                # openstack_type is volume
-                volumes = []
-
-                # Build volume list
-                for k in sorted(self.volume_ids.keys()):
-                    if self.volume_ids[k] not in volumes:
-                        volumes.append(self.volume_ids[k])
-                if len(volumes) == 0:
-                    self.log('No volumes found!', l='error')
-                    return False
-                # if len(volumes) != len(self.volume_ids):
-                #     self.log(f'Source volume map: {self.volume_ids}', l='error')
-                #     self.log(f'Assume volume list: {volumes}', l='error')
-                #     return False
-
-                os_command = [
-                    'server', 'create',
-                    '--format', 'json',
-                    '--flavor', self.dest_server.get('flavor'),
-                ]
-
-                os_command.extend(['--volume', volumes[0]])
-                for i in range(1, len(volumes)):
-                    os_command.extend([
-                        '--block-device-mapping',
-                        '%s=%s' % (self._get_disk_name(i + 1), volumes[i]),
-                    ])
-
-                v4_fixed_ip = self.dest_server.get('v4_fixed_ip')
-                if v4_fixed_ip:
-                    os_command.extend(['--nic', 'net-id=%s,v4-fixed-ip=%s' % (self.dest_server.get('network'), v4_fixed_ip)])
-                else:
-                    os_command.extend(['--nic', 'net-id=%s' % self.dest_server.get('network')])
-                os_command.append(vm_name)
-            elif CONF.openstack_type == 'local':
-                # TODO deal with local type
+            # after image 0 disk convert to volume, all the volumes are
+            # created at the same time
+            def _create_volume(i):
+                try:
+                    return openstack.cinder.create_volume(
+                        image_sizes[i],
+                        name=image_names[i],
+                        volume_type=self.dest_server.get('volume_type'),
+                        image_id=images[i],
+                        metadata=self.volume_metadata)
+                except Exception as ex:
+                    self.log(f'Failed to convert image={images[i]} to volume with {str(ex)}', l='error')
+                    return None
+
+            # Another agent may own the task once the conversion is done
+            if not self.hold_lease():
                 return False
-            # Let's get rolling...
-            vm = self.run_openstack(os_command, v2v_env)
-            if vm is None:
-                self.log(f'Create openstack instance with name={vm_name} failed', l='error')
-                self.write_task(state=STATUS.FAILED)
+            image_creating_volumes = []
+            if len(images) > 1:
+                pool = eventlet.GreenPool(len(images) - 1)
+                image_creating_volumes = list(pool.imap(_create_volume, range(1, len(images))))
+            if None in image_creating_volumes:
+                self.delete_volumes(openstack)
                 return False
-            else:
-                vm = json.loads(vm)
-                vm_id = str(vm.get('id'))
-                self.log(f'Create openstack instance with id={vm_id} success.')
-                self.write_task(state=STATUS.SUCCEED)
-                self.write_task(percent=100)
-                return True
+            image_volumes = self.wait_for_volumes(openstack, [v.id for v in image_creating_volumes])
+            if image_volumes is None:
+                self.delete_volumes(openstack)
+                return False
+
+            # Create Instance from image
+            image = images[0]
+            block_device_mapping_v2 = []
+            for i in range(len(image_volumes)):
+                block_device_mapping_v2.append(
+                    self._get_volume_mapping(self._get_disk_name(i + 2), image_volumes[i].id))
+            nics = [{'net-id': self.dest_server.get('network')}]
+        elif CONF.openstack_type == 'openstack':
+            # openstack_type is volume
+            volumes = []
+
+            # Build volume list
+            for k in sorted(self.volume_ids.keys()):
+                if self.volume_ids[k] not in volumes:
+                    volumes.append(self.volume_ids[k])
+            if len(volumes) == 0:
+                self.log('No volumes found!', l='error')
+                return False
+            # if len(volumes) != len(self.volume_ids):
+            #     self.log(f'Source volume map: {self.volume_ids}', l='error')
+            #     self.log(f'Assume volume list: {volumes}', l='error')
+            #     return False
+
+            # Boot from the volume of the first disk
+            image = None
+            block_device_mapping_v2 = [self._get_volume_mapping(None, volumes[0], boot_index=0)]
+            for i in range(1, len(volumes)):
+                block_device_mapping_v2.append(
+                    self._get_volume_mapping(self._get_disk_name(i + 1), volumes[i]))
+
+            nic = {'net-id': self.dest_server.get('network')}
+            v4_fixed_ip = self.dest_server.get('v4_fixed_ip')
+            if v4_fixed_ip:
+                nic['v4-fixed-ip'] = v4_fixed_ip
+            nics = [nic]
         else:
-            # TODO use request do this
+            # TODO deal with local type
+            return False
+        # Let's get rolling...
+        if not self.hold_lease():
+            if CONF.openstack_type == 'glance':
+                # The attempt which owns the task creates its own volumes
+                self.delete_volumes(openstack)
+            return False
+        try:
+            self.log(f'create openstack instance with name={vm_name}, image={image}, '
+                     f'block devices={block_device_mapping_v2}, nics={nics}')
+            vm = openstack.nova.boot(vm_name, image, self.dest_server.get('flavor'),
+                                     block_device_mapping_v2=block_device_mapping_v2,
+                                     nics=nics)
+        except Exception as ex:
+            self.log(f'Create openstack instance with name={vm_name} failed with {str(ex)}', l='error')
+            self.write_task(state=STATUS.FAILED)
             return False
+        self.log(f'Create openstack instance with id={vm.id} success.')
+        self.write_task(state=STATUS.SUCCEED)
+        self.write_task(percent=100)
+        return True
+
+    @property
+    def volume_metadata(self):
+        """ The metadata tagging the volumes created for this attempt of the
+        task, the volumes of another attempt are left to their agent
+        """
+        metadata = {'v2v_task': self.task_id}
+        if self.attempt is not None:
+            metadata['v2v_attempt'] = str(self.attempt)
+        return metadata
 
-    # run openstack command
-    def run_openstack(self, cmd, v2v_env):
-        """Run the openstack commands with necessary arguments. When @destination
-        is True the command is run in destination project. Otherwise it is run
-        in current project.
+    @staticmethod
+    def _poll_intervals():
+        """ The sleeps between the polls of the volumes
 
-        :param cmd: run openstack command
-        :param v2v_env: v2v migrate current environment
-        :return: run openstack results
+        There are block_device_allocate_retries of them, so the volumes are
+        polled that many times plus a final check. The interval starts at one
+        second and doubles up to ``block_device_allocate_retries_interval``.
         """
-        command = ['openstack']
-        command.extend(cmd)
-        self.log(f'run openstack with cmd={command}')
+        max_interval = CONF.block_device_allocate_retries_interval
+        interval = min(1, max_interval)
+        for attempt in range(CONF.block_device_allocate_retries):
+            yield interval
+            interval = min(interval * 2, max_interval)
 
-        try:
-            return subprocess.check_output(command,
-                                           stderr=subprocess.STDOUT,
-                                           env=v2v_env)
-        except subprocess.CalledProcessError as e:
-            # Note: Do NOT use logging.exception() here as it leaks passwords
-            # into the log!
-            self.log(f'Command exited with non-zero return code {e.returncode}, output: \n{e.output}\n')
-            return None
-        except Exception as e:
-            # Note: because of eventlet.monkey_patch() can not get subprocess.CalledProcessError, so workaround
-            self.log(f'Command exited with non-zero return code {e.returncode}, output: \n{e.output}\n')
-            return None
+    def wait_for_volumes(self, openstack, volume_ids):
+        """Wait until all the volumes are available
+
+        All the volumes are polled together with one list request per round,
+        so the wait lasts as long as the slowest volume.
+
+        :returns: the available volumes in the order of volume_ids, or None
+        """
+        if not volume_ids:
+            return []
+        self.log(f'Transfering volumes: {volume_ids}')
+        pending = set(volume_ids)
+        volumes = {}
+        intervals = self._poll_intervals()
+        while True:
+            search_opts = {'metadata': self.volume_metadata}
+            for vol in openstack.cinder.list_volumes(search_opts=search_opts):
+                if vol.id not in pending:
+                    continue
+                if vol.status == 'available':
+                    pending.discard(vol.id)
+                    volumes[vol.id] = vol
+                elif vol.status not in ('creating', 'downloading'):
+                    self.log(f'volume={vol.id} status is {vol.status} not available', l='error')
+                    return None
+            if not pending:
+                return [volumes[i] for i in volume_ids]
+            interval = next(intervals, None)
+            if interval is None:
+                self.log(f'after a long wait volumes={sorted(pending)} are not available', l='error')
+                return None
+            time.sleep(interval)
+
+    def delete_volumes(self, openstack):
+        """Delete the volumes created for the task once it failed
+
+        Cinder refuses to delete the volumes which are still created from
+        their images, they are polled like in wait_for_volumes until they can
+        be deleted.
+        """
+        search_opts = {'metadata': self.volume_metadata}
+        intervals = self._poll_intervals()
+        while True:
+            busy = []
+            try:
+                for vol in openstack.cinder.list_volumes(search_opts=search_opts):
+                    if vol.status in ('creating', 'downloading'):
+                        busy.append(vol.id)
+                    elif vol.status != 'deleting':
+                        self.log(f'delete volume={vol.id}')
+                        openstack.cinder.delete_volume(vol.id)
+            except Exception as ex:
+                self.log(f'Failed to delete the volumes of the task with {str(ex)}', l='error')
+                return
+            if not busy:
+                return
+            interval = next(intervals, None)
+            if interval is None:
+                self.log(f'after a long wait volumes={busy} are left undeleted', l='error')
+                return
+            time.sleep(interval)
+
+    @staticmethod
+    def _get_volume_mapping(device_name, volume_id, boot_index=None):
+        mapping = {
+            'uuid': volume_id,
+            'source_type': 'volume',
+            'destination_type': 'volume',
+            'delete_on_termination': False
+        }
+        if device_name is not None:
+            mapping['device_name'] = device_name
+        if boot_index is not None:
+            mapping['boot_index'] = boot_index
+        return mapping
 
     # Get disk name
     @staticmethod
@@ -614,13 +970,6 @@ class V2VTask(object):
         enumid = (lambda i: chr(ord('a') + i))
         return 'vd%s%s' % ('' if one == 0 else enumid(one - 1), enumid(two))
 
-    def check_cmd_output(self, cmd):
-        try:
-            return subprocess.check_output(cmd, shell=True)
-        except subprocess.CalledProcessError as e:
-            self.log(f'Command exited with non-zero return code {e.returncode}, output: \n{e.output}\n', l='exception')
-            return json.dumps(0)
-
     def progress(self):
         if not self.v2v_log_exist:
             for i in range(10):
@@ -628,98 +977,25 @@ class V2VTask(object):
                     self.v2v_log_exist = True
                     break
                 time.sleep(1)
-        if self.task_percent < 10:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_OPEN_SOURCE}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=10)
-        elif 10 <= self.task_percent < 15:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_OPEN_OVERLAY}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=15)
-        elif 15 <= self.task_percent < 30:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_MAPPING}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=30)
-        elif 30 <= self.task_percent < 40:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_CLOSE_OVERLAY}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=40)
-        elif 40 <= self.task_percent < 60:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_INIT_TARGET}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=60)
-        elif 60 <= self.task_percent < 70:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_COPY_DISK}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=70)
-        elif 70 <= self.task_percent < 78:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_CREATE_M}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=78)
-        elif 78 <= self.task_percent < 88:
-            cmd = f'cat {self.v2v_log} | grep "{self.PROGRESS_FINISH}" | wc -l'
-            if json.loads(self.check_cmd_output(cmd)) > 0:
-                self.write_task(percent=88)
-
-    def parse_log(self):
+        percent = self.tracker.poll()
+        if self.tracker.copying:
+            # Spread the copy, which takes most of the time, over its range
+            percent = max(percent, self.COPY_PERCENT_START + int(
+                (self.COPY_PERCENT_END - self.COPY_PERCENT_START) * self.tracker.copy_fraction))
+        if percent > self.task_percent:
+            self.write_task(percent=percent)
+        if self.tracker.disk_count:
+            self.write_copy_stats()
+
+    def finish_log(self):
         if not self.v2v_log_exist:
             self.failed = True
             self.log(f'not {self.v2v_log} exists failed to create openstack server.', l='error')
             return
-        with open(self.v2v_log) as f:
-            line = f.readline()
-            while line:
-                self.parse_log_line(line)
-                line = f.readline()
-
-    @staticmethod
-    def format_size(num):
-        """
-        Returns the human-readable version if a file size
-        Unified conversion of units to GB
-        :param num:
-        :return:
-        """
-        if not isinstance(num, (six.integer_types, float)):
-            return 0
-        convert_to_GB = 1024.0 ** 3
-        num /= convert_to_GB
-        return int(math.ceil(num))
-
-    def parse_log_line(self, line):
-        image_id = re.compile(r'\|\s*id\s*\|\s*(?P<uuid>[a-fA-F0-9-]+)\s*\|')
-        image_name = re.compile(r'\|\s*name\s*\|\s*(?P<name>.*)\s*\|')
-        image_size = re.compile(r'\|\s*size\s*\|\s*(?P<size>\d+)\s*\|')
-        volume_id = re.compile(r'openstack .*volume show -f json (?P<uuid>[a-fA-F0-9-]+)')
-        # Openstack image UUID
-        match = image_id.search(line)
-        if match:
-            i_uuid = match.group('uuid')
-            ids = self.image_ids
-            ids[len(ids) + 1] = i_uuid
-            self.log(f'Adding openstack image id: {i_uuid}')
-        # Openstack image name
-        match = image_name.search(line)
-        if match:
-            i_name = match.group('name')
-            names = self.image_names
-            names[len(names) + 1] = i_name
-            self.log(f'Adding openstack image name {i_name}')
-        # Openstack image size
-        match = image_size.search(line)
-        if match:
-            image_size = match.group('size')
-            image_size_gb = self.format_size(int(image_size))
-            sizes = self.image_sizes
-            sizes[len(sizes) + 1] = image_size_gb
-            self.log(f'Adding openstack image size {image_size}')
-        # Openstack volume UUID
-        match = volume_id.search(line)
-        if match:
-            v_id = match.group('uuid')
-            ids = self.volume_ids
-            ids[len(ids) + 1] = v_id
-            self.log(f'Adding openstack volume {v_id}')
+        # The ids are extracted while tailing, only the tail of the log is left
+        self.tracker.finish()
+        if self.tracker.disk_count:
+            self.write_copy_stats()
 
 
 class save_and_reraise_exception(object):
@@ -0,0 +1,309 @@
+import collections
+import math
+import re
+
+import six
+
+from oslo_log import log as logging
+
+from v2v.common.outputparser import DiskProgress, ImportProgress
+from v2v.common.outputparser import OutputParser, OutputParserError
+from v2v.common.time import monotonic_time
+from v2v.common.units import MiB
+
+LOG = logging.getLogger(__name__)
+
+# Upper bound of bytes read from the log on a single poll
+READ_CHUNK_SIZE = 1024 * 1024
+# Longest incomplete line kept between two polls
+MAX_PARTIAL_LINE = 64 * 1024
+# Time window in seconds of the rolling copy throughput
+THROUGHPUT_WINDOW = 60
+COPY_STATS_FIELDS = ('current_disk', 'disk_count', 'disk_percent', 'copied_bytes',
+                     'total_bytes', 'throughput', 'eta')
+
+
+class V2VLogTracker(object):
+    """Follow a virt-v2v log file incrementally
+
+    The tracker keeps the offset of the log file between polls, so every
+    poll only reads the bytes appended since the previous one and the cost
+    of a poll does not depend on the size of the log. The openstack image
+    and volume ids printed by virt-v2v are extracted on the fly, so they are
+    known as soon as virt-v2v exits. The "Copying disk" messages and the
+    progress of each copy are followed as well, to report the copied bytes,
+    the throughput and the remaining time of the copy.
+
+    :param path: The virt-v2v log file
+    :param markers: A sequence of (marker, percent) which map the progress
+            messages of virt-v2v to the percent of the task
+    :param log: The callable used to log the extracted ids
+    """
+    # | id               | 0b9a8f0e-5d0c-4bb6-9f3c-5c3b7e3d3b43 |
+    # | name             | test-sda                             |
+    # | size             | 21474836480                          |
+    IMAGE_ID_RE = re.compile(br'\|\s*id\s*\|\s*(?P<uuid>[a-fA-F0-9-]+)\s*\|')
+    IMAGE_NAME_RE = re.compile(br'\|\s*name\s*\|\s*(?P<name>.*)\s*\|')
+    IMAGE_SIZE_RE = re.compile(br'\|\s*size\s*\|\s*(?P<size>\d+)\s*\|')
+    VOLUME_ID_RE = re.compile(br'openstack .*volume show -f json (?P<uuid>[a-fA-F0-9-]+)')
+    # ov_virtual_size = 21474836480 (20.00G)
+    VIRTUAL_SIZE_RE = re.compile(br'ov_virtual_size = (?P<size>\d+)')
+
+    def __init__(self, path, markers, log=LOG.info):
+        self.path = path
+        self.percent = 0
+        self.image_ids = {}
+        self.image_names = {}
+        self.image_sizes = {}
+        self.volume_ids = {}
+        self.disk_sizes = []
+        self.current_disk = 0
+        self.disk_count = 0
+        self.disk_percent = 0
+        self.copy_started_at = None
+        self.copy_finished_at = None
+        self._log = log
+        self._parser = OutputParser()
+        self._samples = collections.deque()
+        self._file = None
+        self._offset = 0
+        self._partial = b''
+        # Whether the rest of an over-long line is being skipped
+        self._truncated = False
+        self._marker_percent = {m.encode('utf-8'): p for m, p in markers}
+        # All the markers are matched in one pass through one alternation
+        self._marker_re = re.compile(b'|'.join(
+            re.escape(m) for m in self._marker_percent))
+
+    def _open(self):
+        if self._file is None:
+            try:
+                self._file = open(self.path, 'rb')
+            except (IOError, OSError):
+                return False
+            self._file.seek(self._offset)
+        return True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def poll(self):
+        """Read the bytes appended to the log since the last poll
+
+        :returns: The highest percent reached so far
+        """
+        if not self._open():
+            return self.percent
+        while True:
+            data = self._file.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            self._offset += len(data)
+            self._feed(data)
+            if len(data) < READ_CHUNK_SIZE:
+                break
+        if self.copying:
+            self._add_sample()
+        return self.percent
+
+    def finish(self):
+        """Read the rest of the log once virt-v2v has exited"""
+        self.poll()
+        if self._partial:
+            self._parse(self._partial)
+            self._partial = b''
+        self.close()
+        return self.percent
+
+    def _feed(self, data):
+        if self._truncated:
+            # Drop the rest of the over-long line, up to its end
+            eols = [i for i in (data.find(b'\n'), data.find(b'\r')) if i >= 0]
+            if not eols:
+                return
+            data = data[min(eols):]
+            self._truncated = False
+        data = self._partial + data
+        # Only complete lines are parsed, the tail is kept for the next poll.
+        # virt-v2v rewrites its progress bars with '\r', so both '\n' and
+        # '\r' terminate a line.
+        end = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+        self._partial = data[end:]
+        if len(self._partial) > MAX_PARTIAL_LINE:
+            # The markers start the lines, so the head of an over-long line
+            # is kept and the rest of it is dropped
+            self._partial = self._partial[:MAX_PARTIAL_LINE]
+            self._truncated = True
+        if end:
+            self._parse(data[:end])
+
+    def _parse(self, block):
+        for match in self._marker_re.finditer(block):
+            percent = self._marker_percent[match.group(0)]
+            if percent > self.percent:
+                self.percent = percent
+        # Cheap literal checks make sure the regexes only run on the few
+        # lines which may carry an id, a disk size or a copy progress
+        if (self._parser.copying or b'|' in block or b'volume show' in block
+                or b'Copying disk' in block or b'ov_virtual_size' in block):
+            for line in block.splitlines():
+                self._parse_line(line)
+
+    def _parse_line(self, line):
+        if self._parser.copying or b'Copying disk' in line:
+            self._parse_copy(line)
+        if b'ov_virtual_size' in line:
+            match = self.VIRTUAL_SIZE_RE.search(line)
+            if match:
+                self.disk_sizes.append(int(match.group('size')))
+        if b'|' in line:
+            # Openstack image UUID
+            if b'id' in line:
+                match = self.IMAGE_ID_RE.search(line)
+                if match:
+                    i_uuid = match.group('uuid').decode('utf-8')
+                    ids = self.image_ids
+                    ids[len(ids) + 1] = i_uuid
+                    self._log(f'Adding openstack image id: {i_uuid}')
+            # Openstack image name
+            if b'name' in line:
+                match = self.IMAGE_NAME_RE.search(line)
+                if match:
+                    i_name = match.group('name').decode('utf-8', 'replace')
+                    names = self.image_names
+                    names[len(names) + 1] = i_name
+                    self._log(f'Adding openstack image name {i_name}')
+            # Openstack image size
+            if b'size' in line:
+                match = self.IMAGE_SIZE_RE.search(line)
+                if match:
+                    image_size = int(match.group('size'))
+                    sizes = self.image_sizes
+                    sizes[len(sizes) + 1] = self.format_size(image_size)
+                    self._log(f'Adding openstack image size {image_size}')
+        # Openstack volume UUID
+        if b'volume show' in line:
+            match = self.VOLUME_ID_RE.search(line)
+            if match:
+                v_id = match.group('uuid').decode('utf-8')
+                ids = self.volume_ids
+                ids[len(ids) + 1] = v_id
+                self._log(f'Adding openstack volume {v_id}')
+
+    def _parse_copy(self, line):
+        try:
+            event = self._parser.feed(line)
+        except OutputParserError:
+            # "Copying disk" is also printed by the traces of the shell
+            return
+        if isinstance(event, ImportProgress):
+            if self.copy_started_at is None:
+                self.copy_started_at = monotonic_time()
+            self.current_disk = event.current_disk
+            self.disk_count = event.disk_count
+            self.disk_percent = 0
+            self._log(f'copying disk {event.current_disk}/{event.disk_count}')
+        elif isinstance(event, DiskProgress):
+            self.disk_percent = event.progress
+            if event.progress == 100 and self.current_disk == self.disk_count:
+                self.copy_finished_at = monotonic_time()
+                self._add_sample()
+
+    @property
+    def copying(self):
+        return self.copy_started_at is not None and self.copy_finished_at is None
+
+    @property
+    def copy_fraction(self):
+        """The part of the whole copy which is done, between 0 and 1"""
+        if not self.disk_count:
+            return 0.0
+        if self.total_bytes:
+            return float(self.copied_bytes) / self.total_bytes
+        # Without the disk sizes every disk takes the same portion
+        completed = (self.current_disk - 1) * 100 + self.disk_percent
+        return completed / (self.disk_count * 100.0)
+
+    @property
+    def total_bytes(self):
+        if not self.disk_count or len(self.disk_sizes) != self.disk_count:
+            return None
+        return sum(self.disk_sizes)
+
+    @property
+    def copied_bytes(self):
+        if self.total_bytes is None:
+            return None
+        copied = sum(self.disk_sizes[:self.current_disk - 1])
+        copied += self.disk_sizes[self.current_disk - 1] * self.disk_percent // 100
+        return copied
+
+    def _add_sample(self):
+        now = monotonic_time()
+        samples = self._samples
+        samples.append((now, self.copy_fraction))
+        while len(samples) > 2 and now - samples[0][0] > THROUGHPUT_WINDOW:
+            samples.popleft()
+
+    @property
+    def throughput(self):
+        """The rolling copy throughput in MB/s"""
+        if self.total_bytes is None:
+            return None
+        if self.copy_finished_at is not None:
+            # Once the copy is done, report the average of the whole copy
+            elapsed = self.copy_finished_at - self.copy_started_at
+            if elapsed <= 0:
+                return None
+            return round(self.total_bytes / elapsed / MiB, 2)
+        rate = self._rate()
+        if rate is None:
+            return None
+        return round(rate * self.total_bytes / MiB, 2)
+
+    @property
+    def eta(self):
+        """The remaining seconds of the copy"""
+        if self.copy_finished_at is not None:
+            return 0
+        rate = self._rate()
+        if not rate:
+            return None
+        return int((1 - self.copy_fraction) / rate)
+
+    def _rate(self):
+        # The fraction of the copy done per second over the window
+        if len(self._samples) < 2:
+            return None
+        (t0, f0), (t1, f1) = self._samples[0], self._samples[-1]
+        if t1 <= t0:
+            return None
+        return (f1 - f0) / (t1 - t0)
+
+    def copy_stats(self):
+        """Returns the progress of the copy of the disks"""
+        return {
+            'current_disk': self.current_disk,
+            'disk_count': self.disk_count,
+            'disk_percent': self.disk_percent,
+            'copied_bytes': self.copied_bytes,
+            'total_bytes': self.total_bytes,
+            'throughput': self.throughput,
+            'eta': self.eta,
+        }
+
+    @staticmethod
+    def format_size(num):
+        """
+        Returns the human-readable version if a file size
+        Unified conversion of units to GB
+        :param num:
+        :return:
+        """
+        if not isinstance(num, (six.integer_types, float)):
+            return 0
+        convert_to_GB = 1024.0 ** 3
+        num /= convert_to_GB
+        return int(math.ceil(num))
@@ -0,0 +1,187 @@
+import collections
+import os
+import threading
+
+from oslo_log import log as logging
+
+import v2v.conf
+from v2v.common import utils
+from v2v.common.sources import source_limit
+from v2v.common.units import GiB, KiB, MiB
+
+LOG = logging.getLogger(__name__)
+CONF = v2v.conf.CONF
+
+# The resources a task needs while it is converted. disk is the space in
+# the work dir, cache the space in the libguestfs cache dir, memory is in
+# bytes and bandwidth in MB/s.
+Footprint = collections.namedtuple('Footprint',
+                                   ['disk', 'cache', 'memory', 'cpu', 'bandwidth'])
+
+
+def estimate_footprint(src_server):
+    """Estimate the resources needed to convert a source server
+
+    :param src_server: The source server of the task, its size is given by
+            ``diskGB`` when the client knows it
+    """
+    try:
+        disk_size = float(src_server.get('diskGB')) * GiB
+    except (TypeError, ValueError):
+        disk_size = CONF.default_task_disk_gb * GiB
+    disk = cache = 0
+    if CONF.openstack_type == 'local':
+        # The disks are written to the work dir
+        disk = disk_size
+    elif CONF.openstack_type == 'glance':
+        # The disks are written to a temporary file before the upload
+        cache = disk_size
+    # The overlays of the source disks and the appliance
+    cache += CONF.task_cache_gb * GiB
+    return Footprint(disk=int(disk),
+                     cache=int(cache),
+                     memory=CONF.task_memory_mb * MiB,
+                     cpu=CONF.task_cpus,
+                     bandwidth=CONF.task_bandwidth_mbps)
+
+
+class Ticket(object):
+    """A task asking the scheduler to be admitted"""
+
+    def __init__(self, task_id, footprint, sources=()):
+        self.task_id = task_id
+        self.footprint = footprint
+        self.sources = tuple(sources)
+        self.reason = None
+
+    def __repr__(self):
+        return f'<Ticket task={self.task_id} footprint={self.footprint}>'
+
+
+class AdmissionScheduler(object):
+    """Admit the tasks of an agent according to its resources
+
+    A task is admitted only when its footprint fits into what is left of the
+    agent: the free space of the work dir and of the libguestfs cache dir,
+    the memory and the cpus for the appliances, the network bandwidth and
+    the ``max_concurrent_tasks`` slots. On top of that, the tasks reading
+    from the same vCenter or ESXi host are limited by the per source limits.
+    The dispatcher offers the queued tasks oldest first, so the oldest task
+    which fits is admitted first and the tasks of a busy source do not hold
+    back the tasks of the other sources.
+
+    A task is always admitted on an idle agent, so a task bigger than the
+    whole agent does not wait forever.
+    """
+
+    def __init__(self, work_dir, cache_dir=None):
+        self.work_dir = work_dir
+        self.cache_dir = cache_dir or CONF.libguestfs_cache_dir
+        self._lock = threading.Lock()
+        self._running = collections.OrderedDict()
+
+    @staticmethod
+    def _free_space(path):
+        try:
+            st = os.statvfs(path)
+        except OSError:
+            return None
+        return st.f_bavail * st.f_frsize
+
+    def _reserved(self, field):
+        return sum(getattr(t.footprint, field) for t in self._running.values())
+
+    def _source_running(self, source):
+        return sum(1 for t in self._running.values() if source in t.sources)
+
+    def _reject_reason(self, ticket):
+        """Returns why the task can not be admitted now, None if it can"""
+        if not self._running:
+            return None
+        fp = ticket.footprint
+        if CONF.max_concurrent_tasks and len(self._running) >= CONF.max_concurrent_tasks:
+            return f'waiting for a free slot, {len(self._running)} tasks are running'
+        for kind, name in ticket.sources:
+            limit = source_limit(kind, name)
+            if limit and self._source_running((kind, name)) >= limit:
+                return f'waiting for a free slot of {kind} {name}, {limit} tasks are running'
+
+        # The space consumed by the running tasks is not known, so all
+        # their footprint is taken as still to be written
+        reserved_disk = CONF.reserved_disk_gb * GiB
+        if fp.disk:
+            free = self._free_space(self.work_dir)
+            if free is not None and fp.disk + self._reserved('disk') + reserved_disk > free:
+                return (f'waiting for {fp.disk // GiB}GB of free space in {self.work_dir}, '
+                        f'{free // GiB}GB are free')
+        if fp.cache:
+            free = self._free_space(self.cache_dir)
+            if free is not None and fp.cache + self._reserved('cache') + reserved_disk > free:
+                return (f'waiting for {fp.cache // GiB}GB of free space in {self.cache_dir}, '
+                        f'{free // GiB}GB are free')
+
+        meminfo = utils.readMemInfo()
+        capacity = meminfo['MemTotal'] * KiB - CONF.reserved_host_memory_mb * MiB
+        if fp.memory + self._reserved('memory') > capacity or \
+                fp.memory > meminfo.get('MemAvailable', meminfo['MemFree']) * KiB:
+            return f'waiting for {fp.memory // MiB}MB of memory'
+
+        cpus = os.cpu_count() or 1
+        if fp.cpu + self._reserved('cpu') > cpus:
+            return f'waiting for {fp.cpu} cpus, {self._reserved("cpu")} of {cpus} are used'
+
+        if CONF.agent_bandwidth_mbps and fp.bandwidth and \
+                fp.bandwidth + self._reserved('bandwidth') > CONF.agent_bandwidth_mbps:
+            return f'waiting for {fp.bandwidth}MB/s of network bandwidth'
+        return None
+
+    def full(self):
+        """Whether no more task can be admitted whatever its footprint"""
+        with self._lock:
+            return bool(CONF.max_concurrent_tasks) and \
+                len(self._running) >= CONF.max_concurrent_tasks
+
+    def try_admit(self, ticket):
+        """Admit the task if it fits now, without waiting
+
+        :param ticket: The ticket of the task
+        :returns: None once the task is admitted, otherwise the reason why
+                it does not fit
+        """
+        with self._lock:
+            reason = self._reject_reason(ticket)
+            if reason is None:
+                self._running[ticket.task_id] = ticket
+                ticket.reason = None
+            else:
+                ticket.reason = reason
+            return reason
+
+    def release(self, ticket):
+        with self._lock:
+            self._running.pop(ticket.task_id, None)
+
+    def capacity(self):
+        """Returns what is left of the agent for more tasks"""
+        with self._lock:
+            running = len(self._running)
+            reserved_disk = self._reserved('disk') + CONF.reserved_disk_gb * GiB
+            reserved_cache = self._reserved('cache') + CONF.reserved_disk_gb * GiB
+            reserved_memory = self._reserved('memory')
+        free_disk = self._free_space(self.work_dir)
+        free_cache = self._free_space(self.cache_dir)
+        meminfo = utils.readMemInfo()
+        free_memory = meminfo['MemTotal'] * KiB - CONF.reserved_host_memory_mb * MiB - reserved_memory
+        return {
+            'running': running,
+            'free_slots': (max(CONF.max_concurrent_tasks - running, 0)
+                           if CONF.max_concurrent_tasks else None),
+            'free_disk_gb': None if free_disk is None else max(free_disk - reserved_disk, 0) // GiB,
+            'free_cache_gb': None if free_cache is None else max(free_cache - reserved_cache, 0) // GiB,
+            'free_memory_mb': max(free_memory, 0) // MiB,
+        }
+
+    def running(self):
+        """Returns the ids of the admitted tasks"""
+        with self._lock:
+            return list(self._running)
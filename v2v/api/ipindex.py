@@ -0,0 +1,89 @@
+"""
+Free addresses of the allocation pools of a subnet.
+
+The pools and the used addresses are turned into sorted integer intervals,
+the used addresses are subtracted from the pools interval by interval, so
+the free addresses are counted and the first of them listed without walking
+the whole pools, which matters for the /16 provider networks.
+"""
+
+import bisect
+
+import netaddr
+
+
+def _value(address):
+    return netaddr.IPAddress(address, flags=netaddr.INET_PTON).value
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(i) for i in merged]
+
+
+class IPIndex(object):
+    """The free addresses of the allocation pools of a subnet
+
+    :param allocation_pools: The allocation pools of the subnet, as returned
+            by neutron
+    :param used_ip_addresses: The addresses in use in the subnet
+    """
+
+    def __init__(self, allocation_pools, used_ip_addresses=()):
+        self.version = 4
+        pools = []
+        for pool in allocation_pools:
+            start = netaddr.IPAddress(pool.get('start'), flags=netaddr.INET_PTON)
+            end = netaddr.IPAddress(pool.get('end'), flags=netaddr.INET_PTON)
+            self.version = start.version
+            pools.append((start.value, end.value))
+        self.pools = _merge(pools)
+        used = set()
+        for address in used_ip_addresses:
+            try:
+                used.add(_value(address))
+            except (netaddr.AddrFormatError, TypeError, ValueError):
+                continue
+        self.used = sorted(used)
+        self.free = self._subtract()
+
+    def _subtract(self):
+        """The pools minus the used addresses, as sorted intervals"""
+        free = []
+        for start, end in self.pools:
+            i = bisect.bisect_left(self.used, start)
+            j = bisect.bisect_right(self.used, end)
+            cursor = start
+            for address in self.used[i:j]:
+                if address > cursor:
+                    free.append((cursor, address - 1))
+                cursor = address + 1
+            if cursor <= end:
+                free.append((cursor, end))
+        return free
+
+    @property
+    def pool_len(self):
+        """The number of addresses of the pools"""
+        return sum(end - start + 1 for start, end in self.pools)
+
+    @property
+    def free_len(self):
+        """The number of free addresses of the pools"""
+        return sum(end - start + 1 for start, end in self.free)
+
+    def first_free(self, limit):
+        """Returns the first limit free addresses as strings"""
+        addresses = []
+        for start, end in self.free:
+            for value in range(start, min(end, start + limit - len(addresses) - 1) + 1):
+                addresses.append(str(netaddr.IPAddress(value, self.version)))
+            if len(addresses) >= limit:
+                break
+        return addresses
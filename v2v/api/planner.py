@@ -0,0 +1,76 @@
+"""
+Migration wave planner.
+
+The duration of a conversion is predicted from the committed size of the
+source server and the throughput the previous tasks of the same source
+reached. The servers are then scheduled longest processing time first on
+the slots of the agents, so the huge servers start first and the small
+ones fill the gaps, which keeps the makespan of the wave short.
+"""
+
+import collections
+import heapq
+
+from v2v.common.sources import source_limit
+from v2v.common.units import GiB, MiB
+
+
+Job = collections.namedtuple('Job', ['key', 'size', 'throughput', 'duration', 'sources'])
+
+
+def predict_duration(size, throughput, overhead):
+    """Seconds to convert size bytes at throughput MB/s
+
+    :param overhead: The seconds a conversion takes besides the copy
+    """
+    return overhead + size / (throughput * MiB)
+
+
+def plan_wave(jobs, slots):
+    """Schedule the jobs longest processing time first
+
+    A job starts as soon as a slot is free and the per source limits of its
+    sources allow it, the longest job which can start is started first.
+
+    :param jobs: The jobs to schedule
+    :param slots: The number of tasks the agents run at the same time
+    :returns: A list of (job, start, finish) ordered by start, and the
+            makespan of the wave in seconds
+    """
+    slots = max(slots, 1)
+    pending = sorted(jobs, key=lambda j: j.duration, reverse=True)
+    limits = {s: source_limit(*s) for j in jobs for s in j.sources}
+    sources_running = collections.Counter()
+    running = []
+    plan = []
+    now = 0.0
+    seq = 0
+    while pending:
+        for job in list(pending):
+            if len(running) >= slots:
+                break
+            if any(limits[s] and sources_running[s] >= limits[s] for s in job.sources):
+                continue
+            pending.remove(job)
+            finish = now + job.duration
+            plan.append((job, now, finish))
+            sources_running.update(job.sources)
+            # seq keeps the heap from comparing the jobs
+            heapq.heappush(running, (finish, seq, job))
+            seq += 1
+        if not pending:
+            break
+        # Move to the end of the next task, releasing all the tasks ending
+        # at the same time
+        now, _, job = heapq.heappop(running)
+        sources_running.subtract(job.sources)
+        while running and running[0][0] == now:
+            _, _, job = heapq.heappop(running)
+            sources_running.subtract(job.sources)
+    makespan = max([finish for _, _, finish in plan] or [0.0])
+    return plan, makespan
+
+
+def size_of(disk_gb):
+    """The bytes of a size given in GB as a string or a number"""
+    return int(float(disk_gb) * GiB)
@@ -51,6 +51,11 @@ src_server = {
             'type': 'string',
             'description': '要转换的虚拟机名字',
             'example': 'src_test'
+        },
+        'diskGB': {
+            'type': ['string', 'number'],
+            'description': '要转换的虚拟机磁盘大小(GB), 用于估算转换所需资源',
+            'example': '40.00'
         }
     },
     'required': ['name']
@@ -108,6 +113,53 @@ create_task_schema = {
     'required': ['src_cloud', 'src_server', 'dest_cloud', 'dest_server']
 }
 
+create_tasks_schema = {
+    'type': 'object',
+    'properties': {
+        'tasks': {
+            'type': 'array',
+            'description': '要新增的迁移task, 每个task与新增单个task的参数相同, 逐个校验',
+            'items': {'type': 'object'},
+            'minItems': 1,
+            'maxItems': 1000
+        }
+    },
+    'additionalProperties': False,
+    'required': ['tasks']
+}
+
+plan_wave_schema = {
+    'type': 'object',
+    'properties': {
+        'servers': {
+            'type': 'array',
+            'description': '要迁移的虚拟机',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'src_cloud': {
+                        'type': 'string',
+                        'description': '源云的注册uuid',
+                        'example': '65d793f2-0dd7-403f-847e-1c1f2aa10f7f'
+                    },
+                    'src_server': src_server
+                },
+                'additionalProperties': False,
+                'required': ['src_cloud', 'src_server']
+            },
+            'minItems': 1
+        },
+        'slots': {
+            'type': 'integer',
+            'description': '同时执行的task数量, 默认为所有在线agent的task数量之和',
+            'minimum': 1,
+            'example': 4
+        }
+    },
+    'additionalProperties': False,
+    'required': ['servers']
+}
+
 create_license_schema = {
     'type': 'object',
     'properties': {
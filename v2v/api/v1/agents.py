@@ -0,0 +1,19 @@
+from flask_restx import Namespace, Resource
+from v2v.common.utils import resp_message
+from v2v.api.v1.api import v2v_api
+
+ns_agents = Namespace('agents', description="Endpoint to list agents")
+
+
+@ns_agents.route('', methods=['GET'])
+class Agents(Resource):
+    """list agents"""
+
+    def get(self):
+        """
+        获取agent列表及其上报的剩余容量
+
+        :return:
+        """
+        agents = v2v_api.list_agents()
+        return resp_message(agents)
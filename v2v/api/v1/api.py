@@ -1,11 +1,14 @@
+import collections
+import eventlet
 import json
 import uuid
 import types
 import functools
-import netaddr
+import itertools
+import jsonschema
 from oslo_log import log as logging
 from dateutil import tz
-from datetime import datetime
+from datetime import datetime, timedelta
 from pyVmomi import vim
 import oslo_messaging as messaging
 from oslo_context import context
@@ -13,14 +16,23 @@ import v2v.conf
 from v2v import rpc
 from v2v.db import api as db_api
 from v2v.db.models import Openstack, VMware, Task, License
-from v2v.cloud.openstack import OpenStack
-from v2v.cloud.vsphere import vSphere
+from v2v.cloud.openstack import get_openstack, invalidate_openstack
+from v2v.cloud.vsphere import vSphere, VM_PROPERTIES
+from v2v.cloud import inventory
+from v2v.cloud.catalog import CATALOGS, Catalog, etag_of
+from v2v.api import planner
+from v2v.api.ipindex import IPIndex
+from v2v.api.schema.cloud_schema import create_task_schema
 from v2v.common import utils
 from v2v.common.encryption import decrypt
+from v2v.common.sources import source_keys, source_name
 
 LOG = logging.getLogger(__name__)
 CONF = v2v.conf.CONF
 
+# The free addresses of a subnet returned with the networks
+MAX_AVAILABLE_IPS = 300
+
 
 def logger_decorator(func):
     @functools.wraps(func)
@@ -30,6 +42,49 @@ def logger_decorator(func):
     return wrapper
 
 
+def _scaled(prop, divisor, fmt):
+    """A field made from a size property, None when the vCenter does not
+    report the property, e.g. for an inaccessible virtual machine
+    """
+    def _field(s):
+        value = s.get(prop)
+        if value is None:
+            return None
+        return fmt % (value / divisor)
+    return _field
+
+
+# The fields of the servers listing, with the properties of the virtual
+# machine each field needs and how the field is made from them
+SERVER_FIELDS = collections.OrderedDict([
+    ("name", (["name"], lambda s: s.get("name"))),
+    ("template", (["config.template"], lambda s: s.get("config.template"))),
+    ("os", (["guest.guestFullName"], lambda s: s.get("guest.guestFullName"))),
+    ("hostName", (["guest.hostName"], lambda s: s.get("guest.hostName"))),
+    ("ipAddress", (["guest.ipAddress"], lambda s: s.get("guest.ipAddress"))),
+    ("numCpu", (["config.hardware.numCPU"], lambda s: s.get("config.hardware.numCPU"))),
+    ("memoryGB", (["config.hardware.memoryMB"], _scaled("config.hardware.memoryMB", 1024, "%s"))),
+    ("diskGB", (["summary.storage.committed"], _scaled("summary.storage.committed", 1024 ** 3, "%.2f"))),
+    ("diskNum", (["summary.config.numVirtualDisks"],
+                 lambda s: s.get("summary.config.numVirtualDisks"))),
+    ("driver", ([], lambda s: None)),
+    ("toolsStatus", (["guest.toolsStatus"], lambda s: s.get("guest.toolsStatus"))),
+    ("toolsRunningStatus", (["guest.toolsRunningStatus"], lambda s: s.get("guest.toolsRunningStatus"))),
+    ("powerState", (["runtime.powerState"], lambda s: s.get("runtime.powerState"))),
+])
+
+
+def server_properties(fields):
+    """The properties of the virtual machines needed by the fields"""
+    # name and config.template are always needed to filter out templates
+    properties = ["name", "config.template"]
+    for field in fields:
+        for prop in SERVER_FIELDS[field][0]:
+            if prop not in properties:
+                properties.append(prop)
+    return properties
+
+
 class LogMeta(type):
     def __new__(cls, name, bases, attrs):
         for k, v in attrs.items():
@@ -38,29 +93,67 @@ class LogMeta(type):
         return type.__new__(cls, name, bases, attrs)
 
 
+class TaskPage(list):
+    """A page of the tasks
+
+    total is the count of the tasks matching the filters, next_marker the
+    marker of the next page, None on the last page.
+    """
+
+    def __init__(self, tasks, total, next_marker=None):
+        super(TaskPage, self).__init__(tasks)
+        self.total = total
+        self.next_marker = next_marker
+
+
+_LICENSE = {}
+
+
+def decrypt_license(data):
+    """Returns the content of an encrypted license
+
+    The last decrypted license is kept, so it is decrypted again only once
+    the license changes.
+    """
+    cached = _LICENSE.get('license')
+    if cached is None or cached[0] != data:
+        cached = (data, json.loads(decrypt(data)))
+        _LICENSE['license'] = cached
+    return cached[1]
+
+
+def license_capacity():
+    """Returns how many more tasks may be created
+
+    :returns: The count of the tasks the license still allows, with the
+            message to raise once it is exhausted
+    :raises Exception: when the license is illegal or has expired
+    """
+    license = db_api.license_get_latest()
+    filters = {'state': ['succeed', 'running']}
+    task_count = db_api.task_count_by_filter(filters)
+
+    if license is None:
+        return CONF.allowed_server_number - task_count, 'Exceeded maximum quantity limit'
+    license = decrypt_license(license.license)
+    uuid = license.get('uuid')
+    if uuid != utils.get_host_uuid():
+        raise Exception('License is illegal')
+
+    expired_at = license.get('expired_at')
+    if expired_at != '-1' and expired_at < str(datetime.utcnow()):
+        raise Exception('License has expired')
+
+    server_num = int(license.get('server'))
+    return server_num - task_count, 'Exceeded the maximum license limit'
+
+
 def check_server_numbers(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        licenses = db_api.get_all(License, to_dict=False)
-        filters = {'state': ['succeed', 'running']}
-        tasks = db_api.task_get_all_by_filter(filters)
-
-        if not licenses and len(tasks) >= CONF.allowed_server_number:
-            raise Exception('Exceeded maximum quantity limit')
-        license = licenses[0]
-        license = json.loads(decrypt(license.license))
-        uuid = license.get('uuid')
-        if uuid != utils.get_host_uuid():
-            raise Exception('License is illegal')
-
-        server_num = int(license.get('server'))
-        if server_num <= len(tasks):
-            raise Exception('Exceeded the maximum license limit')
-
-        expired_at = license.get('expired_at')
-        if expired_at != '-1' and expired_at < str(datetime.utcnow()):
-            raise Exception('License has expired')
-
+        capacity, message = license_capacity()
+        if capacity < 1:
+            raise Exception(message)
         return func(*args, **kwargs)
 
     return wrapper
@@ -85,7 +178,7 @@ def check_license_invalid(func):
 class API(object, metaclass=LogMeta):
 
     def __init__(self):
-        pass
+        self._rpc_client = None
 
     def _detail_license(self, license):
         l = json.loads(decrypt(license.get('license')))
@@ -131,7 +224,24 @@ class API(object, metaclass=LogMeta):
     def delete_task_by_uuid(self, uuid):
         return db_api.delete_by_uuid(Task, uuid)
 
-    def list_tasks(self):
+    def list_tasks(self, limit=None, marker=None, sort_key=None, sort_dir='desc', **filters):
+        """List the tasks, a page of them when limit is given
+
+        :param filters: state, a list of states, src_cloud, dest_cloud and
+                name, a substring of the name of the tasks
+        :returns: The tasks, with the count of the tasks matching the
+                filters and the marker of the next page
+        """
+        tasks, total, next_marker = db_api.task_get_page(
+            filters, limit=limit, marker=marker, sort_key=sort_key, sort_dir=sort_dir)
+        return TaskPage(self._task_details(tasks), total, next_marker)
+
+    def _task_details(self, tasks):
+        """Add the clouds to the tasks, the clouds of all the tasks are
+        fetched at once instead of one query per task
+        """
+        src_clouds = db_api.get_by_uuids(VMware, [t['src_cloud'] for t in tasks])
+        dest_clouds = db_api.get_by_uuids(Openstack, [t['dest_cloud'] for t in tasks])
 
         def _detail(task):
             if task is None:
@@ -140,24 +250,82 @@ class API(object, metaclass=LogMeta):
                 task[i] = json.loads(task[i])
             if task['dest_server'].get('name') is None:
                 task['dest_server']['name'] = task['src_server'].get('name')
-            task['src_cloud'] = self.list_vmware_by_uuid(task['src_cloud'])
-            task['dest_cloud'] = self.list_openstack_by_uuid(task['dest_cloud'])
+            # Each task gets its own copy, as the clouds are shared
+            task['src_cloud'] = dict(src_clouds[task['src_cloud']])
+            task['dest_cloud'] = dict(dest_clouds[task['dest_cloud']])
             return task
 
-        tasks = db_api.get_all(Task)
         return [_detail(t) for t in tasks]
 
-    @check_server_numbers
-    def create_task(self, **kwargs):
+    @staticmethod
+    def _task_name(task):
+        """The name of the converted server, the source name by default"""
+        for i in ('dest_server', 'src_server'):
+            name = (task.get(i) or {}).get('name')
+            if name:
+                return name[:255]
+        return None
+
+    def _new_task(self, agent=None, **kwargs):
+        kwargs['name'] = self._task_name(kwargs)
         for i in ('src_server', 'dest_server'):
             kwargs[i] = json.dumps(kwargs[i])
         kwargs['state'] = 'init'
         kwargs['percent'] = 0
         kwargs['uuid'] = str(uuid.uuid4())
-        task = db_api.create(Task(**kwargs))
-        self.async_task(task.uuid)
+        kwargs['agent'] = agent
+        return Task(**kwargs)
+
+    @check_server_numbers
+    def create_task(self, **kwargs):
+        task = self._new_task(agent=self._place_task(kwargs.get('src_cloud')), **kwargs)
+        task = db_api.create(task)
+        self.async_task(task.uuid, task.agent)
         return {'task_id': task.uuid}
 
+    def create_tasks(self, tasks):
+        """Create a wave of tasks at once
+
+        Each task is validated on its own, the license is checked once for
+        all of them, the valid tasks are inserted in one transaction and
+        each agent is woken up once.
+
+        :param tasks: The tasks, as the body of create_task
+        :returns: The result of each task in order, its task_id or the
+                error why it was not created
+        """
+        validator = jsonschema.Draft4Validator(create_task_schema)
+        results = [{} for _ in tasks]
+        valid = []
+        for i, task in enumerate(tasks):
+            errors = sorted(validator.iter_errors(task), key=lambda e: list(e.path))
+            if errors:
+                results[i]['error'] = errors[0].message
+            else:
+                valid.append(i)
+
+        capacity, message = license_capacity()
+        for i in valid[max(capacity, 0):]:
+            results[i]['error'] = message
+        valid = valid[:max(capacity, 0)]
+        if not valid:
+            return results
+
+        placer = self._placer([tasks[i]['src_cloud'] for i in valid])
+        objs = []
+        for i in valid:
+            obj = self._new_task(agent=placer(tasks[i]['src_cloud']), **tasks[i])
+            objs.append(obj)
+            results[i]['task_id'] = obj.uuid
+        db_api.create_all(objs)
+
+        # The agents take the tasks from the task table, one wakeup each
+        # is enough
+        woken = collections.OrderedDict((obj.agent, obj.uuid) for obj in objs)
+        for agent, task_id in woken.items():
+            self.async_task(task_id, agent)
+        return results
+
     def action_task(self, uuid, **kwargs):
         task = db_api.get_by_uuid(Task, uuid, to_dict=False)
         if not task:
@@ -169,15 +337,155 @@ class API(object, metaclass=LogMeta):
     def retry_task(self, uuid, task):
         if task.state not in ('aborted', 'failed'):
             raise Exception(f'task with uuid={uuid} and state={task.state} not support retry')
-        self.async_task(uuid)
+        agent = self._place_task(task.src_cloud)
+        db_api.task_requeue(uuid, agent=agent)
+        self.async_task(uuid, agent)
+
+    def _place_task(self, src_cloud):
+        """Choose the agent of a task
+
+        The task goes to the agents pinned to its vCenter or ESXi host if
+        any is alive, otherwise to any alive agent, and among them to the
+        one with the most free slots left once its queued tasks are run.
+
+        :returns: The host of the agent, None if no agent is alive
+        """
+        return self._placer([src_cloud])(src_cloud)
+
+    def _placer(self, src_clouds):
+        """Returns a function choosing the agent of a task by its source
+        cloud, see _place_task
+
+        The agents, the clouds and the queued tasks are read once, each
+        placement counts as a queued task of its agent for the next ones.
 
-    def async_task(self, task_id):
+        :param src_clouds: The source clouds of the tasks to place
+        """
+        alive_since = datetime.utcnow() - timedelta(seconds=CONF.agent_down_time)
+        agents = db_api.agent_get_all(alive_since=alive_since)
+        if not agents:
+            return lambda src_cloud: None
+        clouds = db_api.get_by_uuids(VMware, src_clouds)
+        queued = collections.Counter(db_api.task_count_queued_by_agent())
+
+        def _load(agent):
+            free_slots = agent.get('free_slots')
+            if free_slots is None:
+                free_slots = float('inf')
+            return (free_slots - queued.get(agent['host'], 0),
+                    agent.get('free_disk_gb') or 0,
+                    -(agent.get('throughput') or 0))
+
+        def _place(src_cloud):
+            sources = {source_name(kind, name)
+                       for kind, name in source_keys(clouds[src_cloud])}
+            pinned = [a for a in agents
+                      if sources & set((a.get('affinity') or '').split(','))]
+            host = max(pinned or agents, key=_load)['host']
+            queued[host] += 1
+            return host
+
+        return _place
+
+    def plan_wave(self, **kwargs):
+        """Plan the order of a wave of migrations
+
+        The servers should be submitted as tasks in the planned order, the
+        agents run the queued tasks oldest first.
+        """
+        history = db_api.task_avg_throughput_by_src_cloud()
+        clouds = {}
+        sizes = {}
+        jobs = []
+        for i, item in enumerate(kwargs.get('servers')):
+            src_cloud, src_server = item['src_cloud'], item['src_server']
+            if src_cloud not in clouds:
+                cloud = db_api.get_by_uuid(VMware, src_cloud)
+                if cloud.get('uuid') is None:
+                    raise Exception(f'no VMware cloud with uuid={src_cloud}')
+                clouds[src_cloud] = cloud
+            disk_gb = src_server.get('diskGB')
+            if disk_gb is None:
+                # The committed size of the servers the client did not give
+                if src_cloud not in sizes:
+                    servers = self.list_servers(src_cloud, fields=['name', 'diskGB'])
+                    if not isinstance(servers, list):
+                        raise Exception(servers.get('msg'))
+                    sizes[src_cloud] = {s['name']: s['diskGB'] for s in servers}
+                if src_server['name'] not in sizes[src_cloud]:
+                    raise Exception(f'no server with name={src_server["name"]} in cloud={src_cloud}')
+                disk_gb = sizes[src_cloud][src_server['name']]
+                if disk_gb is None:
+                    raise Exception(f'the size of server={src_server["name"]} in cloud={src_cloud} '
+                                    f'is unknown, it should be given as diskGB')
+            throughput = history.get(src_cloud) or CONF.default_task_throughput_mbps
+            size = planner.size_of(disk_gb)
+            jobs.append(planner.Job(key=i,
+                                    size=size,
+                                    throughput=throughput,
+                                    duration=planner.predict_duration(size, throughput,
+                                                                      CONF.task_overhead_seconds),
+                                    sources=source_keys(clouds[src_cloud])))
+
+        slots = kwargs.get('slots') or self._total_slots()
+        plan, makespan = planner.plan_wave(jobs, slots)
+        now = datetime.utcnow()
+        servers = kwargs.get('servers')
+        return {
+            'slots': slots,
+            'makespan': int(makespan),
+            'finish_at': self.transfer_to_local_time(now + timedelta(seconds=makespan)),
+            'servers': [{
+                'order': order,
+                'src_cloud': servers[job.key]['src_cloud'],
+                'src_server': servers[job.key]['src_server'],
+                'diskGB': str("%.2f" % (job.size / 1024 ** 3)),
+                'throughput': round(job.throughput, 2),
+                'start': int(start),
+                'finish': int(finish),
+                'finish_at': self.transfer_to_local_time(now + timedelta(seconds=finish)),
+            } for order, (job, start, finish) in enumerate(plan, 1)]
+        }
+
+    def _total_slots(self):
+        """The number of tasks the alive agents run at the same time"""
+        alive_since = datetime.utcnow() - timedelta(seconds=CONF.agent_down_time)
+        slots = 0
+        for agent in db_api.agent_get_all(alive_since=alive_since):
+            if agent.get('free_slots') is None:
+                slots += CONF.max_concurrent_tasks or 1
+            else:
+                slots += agent['free_slots'] + (agent.get('running') or 0)
+        return slots or CONF.max_concurrent_tasks or 1
+
+    def list_agents(self):
+        alive_since = datetime.utcnow() - timedelta(seconds=CONF.agent_down_time)
+        alive = {a['host'] for a in db_api.agent_get_all(alive_since=alive_since)}
+        agents = db_api.agent_get_all()
+        for agent in agents:
+            agent['alive'] = agent['host'] in alive
+        return agents
+
+    def async_task(self, task_id, agent=None):
+        """Wake up the agent, the task itself is queued in the task table
+
+        :param agent: The agent the task is placed on, all the agents are
+                woken up when it is None
+        """
         ctxt = context.get_admin_context()
-        target = messaging.Target(topic='manager')
-        rpc_client = rpc.get_client(target=target)
-        cctxt = rpc_client.prepare(namespace='v2v', server=CONF.host, version='1.0')
+        if self._rpc_client is None:
+            target = messaging.Target(topic='manager')
+            self._rpc_client = rpc.get_client(target=target)
+        rpc_client = self._rpc_client
+        if agent:
+            cctxt = rpc_client.prepare(namespace='v2v', server=agent, version='1.0')
+        else:
+            cctxt = rpc_client.prepare(namespace='v2v', fanout=True, version='1.0')
         return cctxt.cast(ctxt=ctxt, method='task', task_id=task_id)
 
+    def list_task_queue(self):
+        return db_api.task_get_queue()
+
     def transfer_to_local_time(self, utc_time):
         # UTC Zone
         from_zone = tz.gettz('UTC')
@@ -204,9 +512,11 @@ class API(object, metaclass=LogMeta):
 
     def delete_openstack_by_uuid(self, uuid):
         filters = {'dest_cloud': uuid}
-        tasks = db_api.task_get_all_by_filter(filters)
-        if tasks:
-            raise Exception(f'please delete task={tasks[0].uuid} first')
+        task_uuid = db_api.task_exists_by_filter(filters)
+        if task_uuid:
+            raise Exception(f'please delete task={task_uuid} first')
+        invalidate_openstack(uuid)
+        CATALOGS.invalidate(uuid)
         return db_api.delete_by_uuid(Openstack, uuid)
 
     def list_vmware(self):
@@ -221,133 +531,221 @@ class API(object, metaclass=LogMeta):
 
     def delete_vmware_by_uuid(self, uuid):
         filters = {'src_cloud': uuid}
-        tasks = db_api.task_get_all_by_filter(filters)
-        if tasks:
-            raise Exception(f'please delete task={tasks[0].uuid} first')
+        task_uuid = db_api.task_exists_by_filter(filters)
+        if task_uuid:
+            raise Exception(f'please delete task={task_uuid} first')
+        inventory.stop(uuid)
         return db_api.delete_by_uuid(VMware, uuid)
 
     def list_volume_types(self, cloud_uuid):
-        cloud = db_api.get_by_uuid(Openstack, cloud_uuid)
-        types = OpenStack(cloud).cinder.list_types()
-        return [t.to_dict() for t in types]
+        def _load():
+            cloud = db_api.get_by_uuid(Openstack, cloud_uuid)
+            types = get_openstack(cloud).cinder.list_types()
+            return [t.to_dict() for t in types]
+        return CATALOGS.get(cloud_uuid, 'volume_types', _load)
 
     def list_flavors(self, cloud_uuid):
-        cloud = db_api.get_by_uuid(Openstack, cloud_uuid)
-        flavors = OpenStack(cloud).nova.flavor_list()
-        return [f.to_dict() for f in flavors]
+        def _load():
+            cloud = db_api.get_by_uuid(Openstack, cloud_uuid)
+            flavors = get_openstack(cloud).nova.flavor_list()
+            return [f.to_dict() for f in flavors]
+        return CATALOGS.get(cloud_uuid, 'flavors', _load)
+
+    def invalidate_catalogs(self, cloud_uuid, kind=None):
+        CATALOGS.invalidate(cloud_uuid, kind)
 
-    def list_networks(self, cloud_uuid):
+    def list_catalog_stats(self, cloud_uuid=None):
+        return CATALOGS.stats(cloud_uuid)
+
+    def list_networks(self, cloud_uuid, network_id=None):
+        """List the networks of an openstack cloud with their subnets
+
+        :param network_id: Only list this network
+        """
+        if network_id is None:
+            return CATALOGS.get(cloud_uuid, 'networks', lambda: self._list_networks(cloud_uuid))
+        networks = CATALOGS.peek(cloud_uuid, 'networks')
+        if networks is not None:
+            # Filtered from the networks listed lately, without neutron
+            networks = [n for n in networks if n.get('id') == network_id]
+            return Catalog(networks, etag_of(networks))
+        return CATALOGS.get(cloud_uuid, f'networks:{network_id}',
+                            lambda: self._list_networks(cloud_uuid, network_id))
+
+    def _list_networks(self, cloud_uuid, network_id=None):
         cloud = db_api.get_by_uuid(Openstack, cloud_uuid)
-        op = OpenStack(cloud)
-        networks = op.neutron.net_list().get('networks', [])
-        subnets = op.neutron.subnet_list().get('subnets', [])
+        op = get_openstack(cloud)
+        filters = {} if network_id is None else {'id': network_id}
+        subnet_filters = {} if network_id is None else {'network_id': network_id}
+        # The neutron requests do not depend on each other, they share the
+        # session of the cloud and run at most neutron_max_parallel at once
+        pool = eventlet.GreenPool(CONF.neutron_max_parallel)
+        networks = pool.spawn(op.neutron.net_list, **filters)
+        subnets = pool.spawn(op.neutron.subnet_list, **subnet_filters)
+        networks = networks.wait().get('networks', [])
+        subnets = subnets.wait().get('subnets', [])
         subnets_dict = {i.get('id'): i for i in subnets}
         for n in networks:
             n['subnets'] = [subnets_dict.get(s, {}) for s in n.get('subnets', [])]
-        for network in networks:
-            subnets = network.get('subnets', [])
-            for subnet in subnets:
-                self._get_available_ips(subnet, op)
+
+        def _availability(network):
+            # One availability per network holds all its subnets
+            availability = op.neutron.show_network_ip_availability(network.get('id'))
+            return network, availability
+
+        with_subnets = [n for n in networks if any(n.get('subnets', []))]
+        for network, availability in pool.imap(_availability, with_subnets):
+            subnet_availability = availability.get('network_ip_availability', {}).get('subnet_ip_availability') or []
+            subnet_availability = {item.get('subnet_id'): item for item in subnet_availability}
+            for subnet in network.get('subnets', []):
+                if subnet:
+                    self._get_available_ips(subnet, subnet_availability.get(subnet.get('id')))
         return networks
 
-    def _get_available_ips(self, subnet, openstack):
-        network_id = subnet.get('network_id')
-        allocation_pools = subnet.get('allocation_pools', [])
-        net_ip_availability = openstack.neutron.show_network_ip_availability(network_id)
-        subnet_available_ips = net_ip_availability.get('network_ip_availability', {}).get('subnet_ip_availability')
-        used_ip_addresses = []
-        available_ip_num = 0
-        for item in subnet_available_ips:
-            if item.get('subnet_id') == subnet.get('id'):
-                used_ip_addresses = item.get('used_ip_addresses', [])
-                total_ips = item.get('total_ips')
-                used_ips = item.get('used_ips')
-                available_ip_num = total_ips - used_ips
-                break
-
-        available_ips = []
-        pool_len = 0
-        for pool in allocation_pools:
-            start_ip = pool.get('start')
-            end_ip = pool.get('end')
-            start_ip_index = netaddr.IPNetwork(start_ip, flags=1).value
-            end_ip_index = netaddr.IPNetwork(end_ip, flags=1).value
-            pool_len = pool_len + (end_ip_index - start_ip_index + 1)
-            for ip in netaddr.IPRange(start_ip, end_ip):
-                if str(ip) in used_ip_addresses:
-                    continue
-                available_ips.append(str(ip))
-                if len(available_ips) >= 300:
-                    break
+    @staticmethod
+    def _get_available_ips(subnet, availability, limit=MAX_AVAILABLE_IPS):
+        """Set the first free addresses of a subnet and how many are free
 
-        subnet['available_ips'] = available_ips
-        subnet['pool_len'] = pool_len
+        :param availability: The ip availability of the subnet as reported
+                by neutron, None if it is not reported
+        """
+        availability = availability or {}
+        index = IPIndex(subnet.get('allocation_pools', []),
+                        availability.get('used_ip_addresses', []))
+        available_ip_num = 0
+        if availability:
+            available_ip_num = availability.get('total_ips') - availability.get('used_ips')
+        subnet['available_ips'] = index.first_free(limit)
+        subnet['pool_len'] = index.pool_len
         subnet['available_len'] = available_ip_num
 
-    def list_servers(self, cloud_uuid):
+    def list_servers(self, cloud_uuid, limit=None, offset=0, fields=None, scope='host'):
+        """List the servers of a VMware cloud
 
-        def _disk_number(disk_device):
-            disk_num = 0
-            for device in disk_device:
-                if device.__class__.__name__ == 'vim.vm.device.VirtualDisk':
-                    disk_num = disk_num + 1
-            return disk_num
+        :param fields: The fields of the servers to return, see
+                SERVER_FIELDS, all by default. Only the properties these
+                fields need are retrieved from the vCenter.
+        :param scope: host lists the servers of the ESXi of the cloud,
+                cluster those of its cluster and datacenter those of its
+                datacenter, with the esxi and the cluster of each server.
+        """
+        fields = list(fields or SERVER_FIELDS)
+        properties = server_properties(fields)
 
         def _detail(s):
             if s is None:
                 return {}
-            return {
-                "name": s.get("name"),
-                'template': s.get("config.template"),
-                "os": s.get("guest.guestFullName"),
-                "hostName": s.get("guest.hostName"),
-                "ipAddress": s.get("guest.ipAddress"),
-                "numCpu": s.get("config.hardware.numCPU"),
-                "memoryGB": str(s.get("config.hardware.memoryMB") / 1024),
-                "diskGB": str("%.2f" % (s.get("summary.storage.committed") / 1024 ** 3)),
-                "diskNum": _disk_number(s.get("config.hardware.device")),
-                "driver": None,
-                "toolsStatus": s.get("guest.toolsStatus"),
-                "toolsRunningStatus": s.get("guest.toolsRunningStatus"),
-                "powerState": s.get("runtime.powerState")
-            }
-        cloud = db_api.get_by_uuid(VMware, cloud_uuid)
-        servers = self._list_servers_on_exsi(cloud.get('ip'), cloud.get('user'), cloud.get('password'), cloud.get('uri'))
-        if not isinstance(servers, list):
-            return servers
-
-        servers_list = []
-        for server in servers:
-            try:
+            detail = {f: SERVER_FIELDS[f][1](s) for f in fields}
+            detail['template'] = s.get("config.template")
+            if scope != 'host':
+                detail['esxi'] = s.get('esxi')
+                detail['cluster'] = s.get('cluster')
+            return detail
+
+        def _page(servers):
+            # Stop reading the servers once the page is full
+            servers_list = inventory.Inventory([], getattr(servers, 'synced_at', None))
+            skipped = 0
+            for server in servers:
                 server = _detail(server)
-                if not server.get('template', False):
-                    servers_list.append(server)
-            except KeyError:
-                pass
-        return servers_list
+                if server.get('template', False):
+                    continue
+                if 'template' not in fields:
+                    server.pop('template')
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                if limit is not None and len(servers_list) == limit:
+                    servers_list.next_offset = offset + limit
+                    break
+                servers_list.append(server)
+            return servers_list
 
-    def _list_servers_on_exsi(self, ip, user, pwd, uri):
+        cloud = db_api.get_by_uuid(VMware, cloud_uuid)
+        if scope != 'host':
+            servers = self._list_servers_in_scope(cloud, scope, properties)
+            if not isinstance(servers, list):
+                return servers
+            return _page(servers)
+        servers = None
+        if CONF.inventory_sync and cloud.get('uuid') is not None:
+            servers = inventory.list_servers(cloud)
+        if servers is not None:
+            return _page(servers)
+        return self._list_servers_on_exsi(cloud.get('ip'), cloud.get('user'), cloud.get('password'),
+                                          cloud.get('uri'), properties=properties, select=_page)
+
+    def _list_servers_in_scope(self, cloud, scope, properties):
+        """List the servers of all the ESXi of the cluster or the datacenter of a cloud
+
+        The servers of each ESXi are collected concurrently, each ESXi over
+        its own pooled session, at most ``vsphere_max_parallel_hosts`` at
+        the same time. The pooled sessions are shared with the other
+        listings of the process, so a collection may have to wait for a
+        session to be given back: it waits up to
+        ``vsphere_session_wait_timeout``, and the listing fails past that.
+
+        :returns: dict of fault message or list of servers
+        """
+        ip, user, pwd = cloud.get('ip'), cloud.get('user'), cloud.get('password')
+        with vSphere(host=ip, user=user, pwd=pwd) as vs:
+            if vs.si is None:
+                return {
+                    "msg": "Could not connect to the specified vcenter "
+                           "using specified username and password."
+                }
+            host, msg = vs.find_host(cloud.get('uri'))
+            if host is None:
+                return {"msg": msg}
+            container = host.parent
+            if scope == 'datacenter':
+                # The ESXi may be nested in folders of its datacenter
+                while container is not None and not isinstance(container, vim.Datacenter):
+                    container = container.parent
+                if container is None:
+                    return {"msg": f"Could not find the datacenter of esxi {host.name}."}
+            hosts = vs.list_hosts(container)
+
+        def _collect(host):
+            with vSphere(host=ip, user=user, pwd=pwd) as hvs:
+                if hvs.si is None:
+                    raise Exception(f"Could not connect to the specified vcenter for esxi {host['name']}")
+                servers = []
+                for page in hvs.iter_host_vms(hvs.get_host(host['moid']), properties):
+                    for server in page:
+                        server['esxi'] = host['name']
+                        server['cluster'] = host['cluster']
+                    servers.extend(page)
+                return servers
+
+        pool = eventlet.GreenPool(min(CONF.vsphere_max_parallel_hosts, CONF.vsphere_max_sessions))
+        servers = []
+        try:
+            for host_servers in pool.imap(_collect, hosts):
+                servers.extend(host_servers)
+        except Exception as ex:
+            LOG.exception(f'list servers of {scope} failed with {str(ex)}')
+            return {"msg": str(ex)}
+        servers.sort(key=lambda s: (s.get('cluster') or '', s.get('esxi') or '', s.get('name') or ''))
+        return servers
+
+    def _list_servers_on_exsi(self, ip, user, pwd, uri, properties=VM_PROPERTIES, select=list):
         """ List servers and templates on specified ESXi
 
         :param ip: The Ip address of vcenter
         :param user: The username of vcenter
         :param pwd: The password of vcenter
         :param uri: The uri of ESXi will be searched
+        :param properties: The properties of the servers to retrieve
+        :param select: Called with an iterator of the servers as they are
+                retrieved, what it returns is returned. The retrieval of the
+                servers it does not read is cancelled.
         :returns: dict or list
             when return is dict, the return is fault message
             of connect to vcenter or search uri.
             when return is list. the return is list of servers
             and templates.
         """
-        # Ensure the uri does not start with '/'
-        # and end with '/'
-        if uri.startswith('/'):
-            uri = uri.split('/', 1)[1]
-        if uri.endswith('/'):
-            uri = uri.rsplit('/', 1)[0]
-
-        uri = uri.split('/')
-
         with vSphere(host=ip, user=user, pwd=pwd) as vs:
             if vs.si is None:
                 return {
@@ -355,36 +753,15 @@ class API(object, metaclass=LogMeta):
                            "using specified username and password."
                 }
 
-            datacenters = vs.si.content.rootFolder.childEntity
-            find_dc = False
-            for dc in datacenters:
-                if dc.name == uri[0]:
-                    find_dc = True
-                    break
+            host, msg = vs.find_host(uri)
+            if host is None:
+                return {"msg": msg}
 
-            if not find_dc:
-                LOG.error("Could not find specified datacenter %s." % dc.name)
-                return {"msg": "Could not find specified datacenter." % dc.name}
-
-            hosts = vs.get_container_view(dc, [vim.HostSystem])
-            find_host = False
-            for host in hosts:
-                if host.name == uri[-1]:
-                    find_host = True
-                    break
-
-            if not find_host:
-                LOG.error("Could not find specified esxi %s." % host.name)
-                return {"msg": "Could not find specified esxi %s." % host.name}
-
-            prop_spec = {
-                "VirtualMachine": ["name", "guest.toolsStatus", "guest.toolsRunningStatus",
-                                   "guest.guestFullName", "guest.hostName", "guest.ipAddress",
-                                   "runtime.powerState", "config.template", "config.hardware.device", "config.hardware.numCPU",
-                                   "config.hardware.memoryMB", "summary.storage.committed"]
-            }
-            servers = vs.property_collector(host, [vim.VirtualMachine], prop_spec)
-            return servers
+            pages = vs.iter_host_vms(host, properties)
+            try:
+                return select(itertools.chain.from_iterable(pages))
+            finally:
+                pages.close()
 
 
 v2v_api = API()
@@ -1,6 +1,7 @@
 from flask_restx import Namespace, Resource
 from v2v.common.utils import resp_message, get_request_info
 from v2v.api.v1.api import v2v_api
+from v2v.cloud.catalog import KINDS as CATALOG_KINDS
 from v2v.api.schema.cloud_schema import create_openstack_schema, create_vmware_schema
 
 ns_clouds = Namespace('clouds', description="Endpoint to manage clouds")
@@ -69,6 +70,33 @@ class OpenStackCloud(Resource):
         return resp_message(resp)
 
 
+@ns_clouds.route("/openstack/<string:uuid>/catalogs")
+class OpenStackCatalogs(Resource):
+
+    def get(self, uuid):
+        """
+        获取openstack cloud的flavor, volume type, network缓存命中统计
+
+        :param uuid:
+        :return:
+        """
+        stats = v2v_api.list_catalog_stats(uuid)
+        return resp_message(stats)
+
+    def delete(self, uuid):
+        """清除openstack cloud的flavor, volume type, network缓存, kind参数指定只清除其中一种
+
+        :param uuid:
+        :return:
+        """
+        request_info = get_request_info()
+        kind = request_info.get('args_data').get('kind')
+        if kind is not None and kind not in CATALOG_KINDS:
+            return resp_message(success=False, code=400, message=f'kind should be in {list(CATALOG_KINDS)}.')
+        v2v_api.invalidate_catalogs(uuid, kind)
+        return resp_message()
+
+
 @ns_clouds.route('/vmware', methods=['GET', 'POST'])
 class VMwareClouds(Resource):
     """manage vmware clouds"""
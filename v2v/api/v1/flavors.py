@@ -1,5 +1,5 @@
 from flask_restx import Namespace, Resource
-from v2v.common.utils import resp_message, get_request_info
+from v2v.common.utils import resp_catalog, resp_message, get_request_info
 from v2v.api.v1.api import v2v_api
 
 ns_flavors = Namespace('flavors', description="Endpoint to manage flavors")
@@ -20,5 +20,7 @@ class Flavors(Resource):
         cloud_uuid = args_data.get('cloud')
         if not cloud_uuid:
             return resp_message(success=False, code=400, message='cloud uuid is need for get es flavor.')
+        if args_data.get('refresh') in ('true', 'True', '1'):
+            v2v_api.invalidate_catalogs(cloud_uuid, 'flavors')
         flavors = v2v_api.list_flavors(cloud_uuid)
-        return resp_message(flavors)
+        return resp_catalog(flavors)
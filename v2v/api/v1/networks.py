@@ -1,5 +1,5 @@
 from flask_restx import Namespace, Resource
-from v2v.common.utils import resp_message, get_request_info
+from v2v.common.utils import resp_catalog, resp_message, get_request_info
 from v2v.api.v1.api import v2v_api
 
 ns_networks = Namespace('networks', description="Endpoint to manage networks")
@@ -20,5 +20,10 @@ class Networks(Resource):
         cloud_uuid = args_data.get('cloud')
         if not cloud_uuid:
             return resp_message(success=False, code=400, message='cloud uuid is need for get es network.')
-        networks = v2v_api.list_networks(cloud_uuid)
-        return resp_message(networks)
+        if args_data.get('refresh') in ('true', 'True', '1'):
+            v2v_api.invalidate_catalogs(cloud_uuid, 'networks')
+        network_id = args_data.get('network')
+        networks = v2v_api.list_networks(cloud_uuid, network_id=network_id)
+        if network_id is not None and not networks:
+            return resp_message(success=False, code=400, message=f'no network with id={network_id}.')
+        return resp_catalog(networks)
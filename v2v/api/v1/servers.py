@@ -1,6 +1,6 @@
 from flask_restx import Namespace, Resource
 from v2v.common.utils import resp_message, get_request_info
-from v2v.api.v1.api import v2v_api
+from v2v.api.v1.api import SERVER_FIELDS, v2v_api
 
 ns_servers = Namespace('servers', description="Endpoint to manage servers")
 
@@ -20,7 +20,29 @@ class Servers(Resource):
         cloud_uuid = args_data.get('cloud')
         if not cloud_uuid:
             return resp_message(success=False, code=400, message='cloud uuid is need for get VMware instances.')
-        servers = v2v_api.list_servers(cloud_uuid)
+        try:
+            limit = args_data.get('limit')
+            limit = None if limit is None else int(limit)
+            offset = int(args_data.get('offset', 0))
+            if (limit is not None and limit < 1) or offset < 0:
+                raise ValueError()
+        except ValueError:
+            return resp_message(success=False, code=400, message='limit and offset should be positive integers.')
+        fields = [f for f in args_data.get('fields', '').split(',') if f]
+        unknown = [f for f in fields if f not in SERVER_FIELDS]
+        if unknown:
+            return resp_message(success=False, code=400, message=f'unknown fields {unknown}, '
+                                                                 f'fields should be in {list(SERVER_FIELDS)}.')
+        scope = args_data.get('scope', 'host')
+        if scope not in ('host', 'cluster', 'datacenter'):
+            return resp_message(success=False, code=400, message='scope should be host, cluster or datacenter.')
+        servers = v2v_api.list_servers(cloud_uuid, limit=limit, offset=offset, fields=fields, scope=scope)
         if not isinstance(servers, list):
             return resp_message(success=False, code=400, message=servers.get('msg'))
-        return resp_message(servers)
+        headers = {}
+        if servers.next_offset is not None:
+            headers['X-Next-Offset'] = str(servers.next_offset)
+        if servers.synced_at is not None:
+            # When the listing was answered from the inventory synced at
+            headers['X-Inventory-Synced-At'] = v2v_api.transfer_to_local_time(servers.synced_at)
+        return resp_message(servers), 200, headers
@@ -1,7 +1,9 @@
 from flask_restx import Namespace, Resource
 from v2v.common.utils import resp_message, get_request_info
 from v2v.api.v1.api import v2v_api
-from v2v.api.schema.cloud_schema import create_task_schema, task_action_schema
+from v2v.db.api import TASK_SORT_KEYS
+from v2v.api.schema.cloud_schema import create_task_schema, create_tasks_schema, plan_wave_schema, \
+    task_action_schema
 
 ns_tasks = Namespace('tasks', description="Endpoint to manage tasks")
 
@@ -12,12 +14,37 @@ class Tasks(Resource):
 
     def get(self):
         """
-        获取task列表
+        获取task列表, 支持limit/marker分页, state/src_cloud/dest_cloud/name过滤和sort_key/sort_dir排序
 
         :return:
         """
-        tasks = v2v_api.list_tasks()
-        return resp_message(tasks)
+        request_info = get_request_info()
+        args_data = request_info.get('args_data')
+        try:
+            limit = args_data.get('limit')
+            limit = None if limit is None else int(limit)
+            if limit is not None and limit < 1:
+                raise ValueError()
+        except ValueError:
+            return resp_message(success=False, code=400, message='limit should be a positive integer.')
+        sort_key = args_data.get('sort_key')
+        if sort_key is not None and sort_key not in TASK_SORT_KEYS:
+            return resp_message(success=False, code=400, message=f'sort_key should be in {list(TASK_SORT_KEYS)}.')
+        sort_dir = args_data.get('sort_dir', 'desc')
+        if sort_dir not in ('asc', 'desc'):
+            return resp_message(success=False, code=400, message='sort_dir should be asc or desc.')
+        filters = {k: args_data.get(k) for k in ('src_cloud', 'dest_cloud', 'name') if args_data.get(k)}
+        if args_data.get('state'):
+            filters['state'] = args_data.get('state').split(',')
+        try:
+            tasks = v2v_api.list_tasks(limit=limit, marker=args_data.get('marker'),
+                                       sort_key=sort_key, sort_dir=sort_dir, **filters)
+        except Exception as ex:
+            return resp_message(success=False, code=400, message=str(ex))
+        headers = {'X-Total-Count': str(tasks.total)}
+        if tasks.next_marker is not None:
+            headers['X-Next-Marker'] = tasks.next_marker
+        return resp_message(tasks), 200, headers
 
     @ns_tasks.expect(
         ns_tasks.schema_model('create convert task', create_task_schema), validate=True)
@@ -37,6 +64,66 @@ class Tasks(Resource):
         return resp_message(task)
 
 
+@ns_tasks.route('/bulk', methods=['POST'])
+class TasksBulk(Resource):
+    """create tasks in bulk"""
+
+    @ns_tasks.expect(
+        ns_tasks.schema_model('create convert tasks', create_tasks_schema), validate=True)
+    def post(self):
+        """
+        批量新增迁移task, 逐个返回task_id或未新增的原因
+
+        :return:
+        """
+        request_data = get_request_info()
+        data = request_data.get('json_data')
+        try:
+            results = v2v_api.create_tasks(data.get('tasks'))
+        except Exception as ex:
+            return resp_message(success=False, code=400, message=str(ex))
+
+        return resp_message(results)
+
+
+@ns_tasks.route('/queue', methods=['GET'])
+class TaskQueue(Resource):
+    """task queue of agent"""
+
+    def get(self):
+        """
+        获取正在运行和排队等待的task
+
+        :return:
+        """
+        try:
+            queue = v2v_api.list_task_queue()
+        except Exception as ex:
+            return resp_message(success=False, code=400, message=str(ex))
+        return resp_message(queue)
+
+
+@ns_tasks.route('/plan', methods=['POST'])
+class TaskPlan(Resource):
+    """plan a wave of tasks"""
+
+    @ns_tasks.expect(
+        ns_tasks.schema_model('plan migration wave', plan_wave_schema), validate=True)
+    def post(self):
+        """
+        规划一批虚拟机的迁移顺序, 预估每个虚拟机和整批的完成时间
+
+        :return:
+        """
+        request_data = get_request_info()
+        data = request_data.get('json_data')
+        try:
+            plan = v2v_api.plan_wave(**data)
+        except Exception as ex:
+            return resp_message(success=False, code=400, message=str(ex))
+        return resp_message(plan)
+
+
 @ns_tasks.route("/<string:uuid>")
 class Task(Resource):
 
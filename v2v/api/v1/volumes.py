@@ -1,5 +1,5 @@
 from flask_restx import Namespace, Resource
-from v2v.common.utils import resp_message, get_request_info
+from v2v.common.utils import resp_catalog, resp_message, get_request_info
 from v2v.api.v1.api import v2v_api
 
 ns_volumes = Namespace('volumes', description="Endpoint to manage volumes")
@@ -20,5 +20,7 @@ class Types(Resource):
         cloud_uuid = args_data.get('cloud')
         if not cloud_uuid:
             return resp_message(success=False, code=400, message='cloud uuid is need for get es volume type.')
+        if args_data.get('refresh') in ('true', 'True', '1'):
+            v2v_api.invalidate_catalogs(cloud_uuid, 'volume_types')
         types = v2v_api.list_volume_types(cloud_uuid)
-        return resp_message(types)
+        return resp_catalog(types)
@@ -0,0 +1,207 @@
+"""
+Catalogs of the registered openstack clouds.
+
+The flavors, the volume types and the networks of a cloud rarely change, so
+they are kept per cloud for catalog_cache_ttl seconds. Once expired, a
+catalog is still served for catalog_stale_seconds while it is fetched again
+in the background, so the clients do not wait on nova, cinder or neutron.
+The networks are the exception: their available ips are picked by the
+clients for the new servers, so an expired networks catalog is always
+fetched again before it is served.
+Each catalog has an ETag, the digest of its content, for the conditional
+requests of the clients.
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+from oslo_log import log as logging
+
+import v2v.conf
+
+LOG = logging.getLogger(__name__)
+CONF = v2v.conf.CONF
+
+# The kinds of catalogs, a filtered catalog is named <kind>:<filter>, at
+# most catalog_max_filtered of them are kept per cloud and kind
+KINDS = ('flavors', 'volume_types', 'networks')
+
+
+class Catalog(list):
+    """A catalog of a cloud with the ETag of its content"""
+
+    def __init__(self, items, etag=None):
+        super(Catalog, self).__init__(items)
+        self.etag = etag
+
+
+def etag_of(items):
+    """The ETag of a catalog, a digest of its content"""
+    data = json.dumps(items, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+class _Entry(object):
+
+    def __init__(self):
+        self.items = None
+        self.etag = None
+        self.fetched_at = None
+        self.used_at = time.time()
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+
+class CatalogCache(object):
+    """The catalogs of the openstack clouds, by cloud uuid and kind"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def _ttl(kind):
+        if kind.split(':')[0] == 'networks':
+            return CONF.catalog_networks_ttl
+        return CONF.catalog_cache_ttl
+
+    @staticmethod
+    def _stale_seconds(kind):
+        if kind.split(':')[0] == 'networks':
+            # Stale available ips would be handed out to the new servers
+            return 0
+        return CONF.catalog_stale_seconds
+
+    def _entry(self, cloud_uuid, kind):
+        with self._lock:
+            entry = self._entries.get((cloud_uuid, kind))
+            if entry is None:
+                if ':' in kind:
+                    self._evict_filtered(cloud_uuid, kind.split(':')[0])
+                entry = self._entries[(cloud_uuid, kind)] = _Entry()
+            entry.used_at = time.time()
+            return entry
+
+    def _evict_filtered(self, cloud_uuid, kind):
+        """Make room for one more filtered catalog of a kind, the least
+        recently used ones are dropped
+        """
+        filtered = sorted((entry.used_at, key) for key, entry in self._entries.items()
+                          if key[0] == cloud_uuid and key[1].startswith(f'{kind}:'))
+        for _, key in filtered[:max(len(filtered) - CONF.catalog_max_filtered + 1, 0)]:
+            self._entries.pop(key)
+
+    def peek(self, cloud_uuid, kind):
+        """Returns a catalog if it is cached and not expired, otherwise None"""
+        with self._lock:
+            entry = self._entries.get((cloud_uuid, kind))
+        if entry is None:
+            return None
+        with entry.lock:
+            if entry.fetched_at is None or time.time() - entry.fetched_at >= self._ttl(kind):
+                return None
+            return Catalog(entry.items, entry.etag)
+
+    def get(self, cloud_uuid, kind, loader):
+        """Returns a catalog of a cloud
+
+        :param kind: One of KINDS
+        :param loader: Fetches the catalog from the cloud when it is not
+                cached or expired
+        """
+        entry = self._entry(cloud_uuid, kind)
+        ttl = self._ttl(kind)
+        with entry.lock:
+            age = None if entry.fetched_at is None else time.time() - entry.fetched_at
+            if age is not None and age < ttl:
+                entry.hits += 1
+                return Catalog(entry.items, entry.etag)
+            if age is not None and age < ttl + self._stale_seconds(kind):
+                entry.stale_hits += 1
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    thread = threading.Thread(target=self._refresh,
+                                              args=(cloud_uuid, kind, entry, loader))
+                    thread.daemon = True
+                    thread.start()
+                return Catalog(entry.items, entry.etag)
+            # Loaded under the lock of the entry, so the concurrent requests
+            # of a missing catalog wait for one fetch
+            entry.misses += 1
+            self._load(entry, loader)
+            catalog = Catalog(entry.items, entry.etag)
+        if ':' in kind and not catalog:
+            # Nothing matches the filter, e.g. an unknown id, which is not
+            # worth an entry
+            with self._lock:
+                if self._entries.get((cloud_uuid, kind)) is entry:
+                    self._entries.pop((cloud_uuid, kind))
+        return catalog
+
+    @staticmethod
+    def _load(entry, loader):
+        try:
+            items = loader()
+        except Exception:
+            entry.errors += 1
+            raise
+        entry.items = items
+        entry.etag = etag_of(items)
+        entry.fetched_at = time.time()
+
+    def _refresh(self, cloud_uuid, kind, entry, loader):
+        try:
+            items = loader()
+        except Exception as ex:
+            LOG.warning(f'refresh the {kind} of cloud={cloud_uuid} failed with {str(ex)}')
+            with entry.lock:
+                entry.errors += 1
+                entry.refreshing = False
+            return
+        with entry.lock:
+            entry.items = items
+            entry.etag = etag_of(items)
+            entry.fetched_at = time.time()
+            entry.refreshing = False
+
+    def invalidate(self, cloud_uuid, kind=None):
+        """Drop the catalogs of a cloud, only the catalog kind if given
+
+        The catalogs of a kind include its filtered catalogs, e.g. the
+        networks include the networks:<network id> catalogs.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == cloud_uuid and kind in (None, key[1], key[1].split(':')[0]):
+                    self._entries.pop(key)
+
+    def stats(self, cloud_uuid=None):
+        """Returns the hits and misses of the catalogs"""
+        with self._lock:
+            entries = sorted(self._entries.items())
+        now = time.time()
+        stats = []
+        for (uuid, kind), entry in entries:
+            if cloud_uuid is not None and uuid != cloud_uuid:
+                continue
+            stats.append({
+                'cloud': uuid,
+                'kind': kind,
+                'etag': entry.etag,
+                'age': None if entry.fetched_at is None else int(now - entry.fetched_at),
+                'count': None if entry.items is None else len(entry.items),
+                'hits': entry.hits,
+                'stale_hits': entry.stale_hits,
+                'misses': entry.misses,
+                'errors': entry.errors,
+            })
+        return stats
+
+
+CATALOGS = CatalogCache()
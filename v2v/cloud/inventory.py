@@ -0,0 +1,199 @@
+"""
+Inventory of the virtual machines of the registered VMware clouds.
+
+A synchronizer per cloud builds a property filter on the ESXi of the cloud
+once, then applies the changes reported by WaitForUpdatesEx to an in memory
+model of its virtual machines. The servers listing is answered from that
+model, with the time the model was last known to be in sync.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_utils import timeutils
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+import v2v.conf
+from v2v.cloud.vsphere import host_vm_spec, vSphere, VM_PROPERTIES
+
+LOG = logging.getLogger(__name__)
+CONF = v2v.conf.CONF
+
+_SYNCERS = {}
+_SYNCERS_LOCK = threading.Lock()
+
+
+class Inventory(list):
+    """The servers of a cloud
+
+    synced_at is the UTC time of the last sync when the servers come from
+    the synced inventory, next_offset the offset of the next page when the
+    servers are a page of the listing.
+    """
+
+    def __init__(self, servers, synced_at=None, next_offset=None):
+        super(Inventory, self).__init__(servers)
+        self.synced_at = synced_at
+        self.next_offset = next_offset
+
+
+class InventorySync(object):
+    """Keep the virtual machines of a VMware cloud in sync
+
+    :param cloud: The ``VMware`` cloud row
+    """
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.fingerprint = self._fingerprint(cloud)
+        self.ready = threading.Event()
+        self.synced_at = None
+        self.error = None
+        self.accessed_at = time.time()
+        self._lock = threading.Lock()
+        self._vms = {}
+        self._stopped = False
+        self._thread = None
+
+    @staticmethod
+    def _fingerprint(cloud):
+        return tuple(cloud.get(k) for k in ('ip', 'user', 'password', 'uri'))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name=f'inventory-{self.cloud.get("uuid")}')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def servers(self):
+        """Returns a snapshot of the virtual machines"""
+        self.accessed_at = time.time()
+        with self._lock:
+            servers = [dict(vm) for vm in self._vms.values()]
+        servers.sort(key=lambda s: s.get('name') or '')
+        return Inventory(servers, self.synced_at)
+
+    def _idle(self):
+        return time.time() - self.accessed_at > CONF.inventory_idle_timeout
+
+    def _run(self):
+        backoff = 1
+        while not self._stopped and not self._idle():
+            try:
+                self._sync()
+                backoff = 1
+            except Exception as ex:
+                LOG.exception(f'sync the inventory of cloud={self.cloud.get("uuid")} '
+                              f'failed with {str(ex)}')
+                self.error = str(ex)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, CONF.inventory_wait_seconds)
+        LOG.info(f'stop the inventory sync of cloud={self.cloud.get("uuid")}')
+        with _SYNCERS_LOCK:
+            if _SYNCERS.get(self.cloud.get('uuid')) is self:
+                _SYNCERS.pop(self.cloud.get('uuid'))
+
+    def _sync(self):
+        # The session is held as long as the cloud is listed, so it is our
+        # own rather than one of the pool the listings share
+        with vSphere(host=self.cloud.get('ip'), user=self.cloud.get('user'),
+                     pwd=self.cloud.get('password'), pooled=False) as vs:
+            if vs.si is None:
+                raise Exception('Could not connect to the specified vcenter '
+                                'using specified username and password.')
+            host, msg = vs.find_host(self.cloud.get('uri'))
+            if host is None:
+                raise Exception(msg)
+
+            # A collector of our own, so the filter does not mix with the
+            # filters of the other users of the session
+            pc = vs.si.content.propertyCollector.CreatePropertyCollector()
+            try:
+                self._wait_for_updates(pc, host)
+            finally:
+                try:
+                    pc.Destroy()
+                except Exception:
+                    pass
+
+    def _wait_for_updates(self, pc, host):
+        PC = vmodl.query.PropertyCollector
+        spec = PC.FilterSpec(
+            objectSet=[host_vm_spec(host)],
+            propSet=[PC.PropertySpec(type=vim.VirtualMachine, all=False, pathSet=VM_PROPERTIES)])
+        # Whole values of the changed properties, not the changed elements
+        pc.CreateFilter(spec, partialUpdates=False)
+        options = PC.WaitOptions(maxWaitSeconds=CONF.inventory_wait_seconds)
+
+        version = ''
+        # The model of a previous sync is kept until the new one is complete
+        vms = {}
+        while not self._stopped and not self._idle():
+            update = pc.WaitForUpdatesEx(version, options)
+            if update is not None:
+                self._apply(vms, update)
+                version = update.version
+                if update.truncated:
+                    # More updates are waiting, the model is not in sync yet
+                    continue
+            with self._lock:
+                self._vms = vms
+            self.synced_at = timeutils.utcnow()
+            self.error = None
+            self.ready.set()
+
+    def _apply(self, vms, update):
+        with self._lock:
+            for filter_update in update.filterSet:
+                for obj in filter_update.objectSet:
+                    moid = obj.obj._moId
+                    if obj.kind == 'leave':
+                        vms.pop(moid, None)
+                        continue
+                    if obj.kind == 'enter':
+                        vms[moid] = {}
+                    vm = vms.setdefault(moid, {})
+                    for change in obj.changeSet:
+                        if change.op == 'assign':
+                            vm[change.name] = change.val
+                        elif change.op in ('remove', 'indirectRemove'):
+                            vm.pop(change.name, None)
+
+
+def get_syncer(cloud):
+    """Returns the running synchronizer of a cloud, started if needed"""
+    uuid = cloud.get('uuid')
+    with _SYNCERS_LOCK:
+        syncer = _SYNCERS.get(uuid)
+        if syncer is not None and syncer.fingerprint != InventorySync._fingerprint(cloud):
+            # The cloud was registered again with other settings
+            syncer.stop()
+            syncer = None
+        if syncer is None:
+            syncer = InventorySync(cloud)
+            _SYNCERS[uuid] = syncer
+            syncer.start()
+    return syncer
+
+
+def list_servers(cloud):
+    """Returns the servers of a cloud, None while the first sync runs"""
+    syncer = get_syncer(cloud)
+    syncer.accessed_at = time.time()
+    if syncer.error is None:
+        syncer.ready.wait(CONF.inventory_initial_wait)
+    if not syncer.ready.is_set():
+        return None
+    return syncer.servers()
+
+
+def stop(uuid):
+    with _SYNCERS_LOCK:
+        syncer = _SYNCERS.pop(uuid, None)
+    if syncer is not None:
+        syncer.stop()
@@ -2,9 +2,14 @@ from keystoneauth1 import identity
 from keystoneauth1 import session
 from oslo_utils import importutils
 import requests
+import collections
 import json
+import threading
 from requests import sessions
 
+import v2v.conf
+
+CONF = v2v.conf.CONF
 
 DOMAIN_AUTH = {
     'os_auth_url': 'http://keystone.opsl2.svc.cluster.local:80/v3',
@@ -34,13 +39,99 @@ AUTH = {
 NOVA_API_VERSION = '2.67'
 GLANCE_API_VERSION = '2'
 
+# The sessions of the most recently used credentials kept by get_session
+MAX_SESSIONS = 32
+
+_SESSIONS = collections.OrderedDict()
+_SESSIONS_LOCK = threading.Lock()
+# cloud uuid -> ((session key, region name), OpenStack)
+_CLOUDS = {}
+
+
+def _session_auth(auth_dict):
+    return {
+        "username": auth_dict.get('username'),
+        "password": auth_dict.get('password'),
+        "auth_url": auth_dict.get('auth_url'),
+        "project_name": auth_dict.get('project_name'),
+        "project_domain_name": auth_dict.get('project_domain_name'),
+        "user_domain_name": auth_dict.get('user_domain_name')
+    }
+
+
+def _session_key(auth_info):
+    return tuple(sorted(auth_info.items()))
+
+
+def get_session(auth_dict):
+    """Returns the keystoneauth session of an openstack cloud
+
+    The sessions are shared by all the users of the same credentials in the
+    process, so the token and the HTTP connections are reused instead of
+    being set up for every client. Only the MAX_SESSIONS most recently used
+    sessions are kept.
+
+    :param auth_dict: The auth information of the cloud, as an
+            ``Openstack`` cloud row
+    """
+    auth_info = _session_auth(auth_dict)
+    key = _session_key(auth_info)
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.get(key)
+        if sess is None:
+            auth = identity.Password(**auth_info)
+            # Get a new token once the token expires within so many seconds
+            auth.MIN_TOKEN_LIFE_SECONDS = CONF.openstack_token_min_life
+            sess = session.Session(auth=auth)
+            _SESSIONS[key] = sess
+            while len(_SESSIONS) > MAX_SESSIONS:
+                _SESSIONS.popitem(last=False)
+        else:
+            _SESSIONS.move_to_end(key)
+        return sess
+
+
+def get_openstack(cloud):
+    """Returns the clients of a registered openstack cloud
+
+    The clients are built once per cloud and shared by the process, with
+    the session, the token and the HTTP connections under them. When the
+    cloud was registered again with other credentials, the session of the
+    former credentials is dropped too.
+
+    :param cloud: The ``Openstack`` cloud row
+    """
+    uuid = cloud.get('uuid')
+    key = _session_key(_session_auth(cloud))
+    fingerprint = (key, cloud.get('region_name'))
+    with _SESSIONS_LOCK:
+        cached = _CLOUDS.get(uuid)
+        if cached is not None:
+            if cached[0] == fingerprint:
+                return cached[1]
+            if cached[0][0] != key:
+                _SESSIONS.pop(cached[0][0], None)
+    openstack = OpenStack(cloud)
+    with _SESSIONS_LOCK:
+        _CLOUDS[uuid] = (fingerprint, openstack)
+    return openstack
+
+
+def invalidate_openstack(uuid):
+    """Forget the clients and the session of a cloud, e.g. once it is deleted"""
+    with _SESSIONS_LOCK:
+        cached = _CLOUDS.pop(uuid, None)
+        if cached is not None:
+            _SESSIONS.pop(cached[0][0], None)
+
 
 class Base(object):
 
-    def __init__(self, component, session):
+    def __init__(self, component, session, region_name=None):
         self.session = session
         self.running = True
         self.component = component
+        self.region_name = region_name
 
     def client_proxy(self, client_name, client_version, api_version,
                      endpoint_type, endpoint):
@@ -54,6 +145,8 @@ class Base(object):
             client_params['endpoint_type'] = endpoint_type
         else:
             client_params['endpoint'] = endpoint
+        if self.region_name:
+            client_params['region_name'] = self.region_name
         if api_version:
             return client.Client(api_version, **client_params)
         return client.Client(**client_params)
@@ -77,8 +170,8 @@ class Base(object):
 
 class Nova(Base):
 
-    def __init__(self, session):
-        super(Nova, self).__init__('nova', session)
+    def __init__(self, session, region_name=None):
+        super(Nova, self).__init__('nova', session, region_name=region_name)
         self.nc = self.get_client(self.component, api_version=NOVA_API_VERSION)
 
     def flavor_list(self):
@@ -99,7 +192,7 @@ class Nova(Base):
              nics=None, scheduler_hints=None,
              config_drive=None, disk_config=None, admin_pass=None,
              access_ip_v4=None, access_ip_v6=None, **kwargs):
-        self.nc.servers.create(name, image, flavor, userdata=userdata,
+        return self.nc.servers.create(name, image, flavor, userdata=userdata,
                                security_groups=security_groups,
                                key_name=key_name, block_device_mapping=block_device_mapping,
                                block_device_mapping_v2=block_device_mapping_v2,
@@ -110,14 +203,17 @@ class Nova(Base):
 
 
 class Glance(Base):
-    def __init__(self, session):
-        super(Glance, self).__init__('glance', session)
+    def __init__(self, session, region_name=None):
+        super(Glance, self).__init__('glance', session, region_name=region_name)
         self.gc = self.get_client(self.component, api_version=GLANCE_API_VERSION)
 
     def image_list(self):
         images = self.gc.images.list()
         return images
 
+    def get_image(self, image_id):
+        return self.gc.images.get(image_id)
+
 
 class Keystone(object):
     def __init__(self):
@@ -298,16 +394,16 @@ class Keystone(object):
 
 class Neutron(Base):
 
-    def __init__(self, session):
-        super(Neutron, self).__init__('neutron', session)
+    def __init__(self, session, region_name=None):
+        super(Neutron, self).__init__('neutron', session, region_name=region_name)
         self.nc = self.get_client(self.component)
 
-    def net_list(self):
-        networks = self.nc.list_networks()
+    def net_list(self, **filters):
+        networks = self.nc.list_networks(**filters)
         return networks
 
-    def subnet_list(self):
-        subnets = self.nc.list_subnets()
+    def subnet_list(self, **filters):
+        subnets = self.nc.list_subnets(**filters)
         return subnets
 
     def show_network_ip_availability(self, net_id):
@@ -364,8 +460,8 @@ class Neutron(Base):
 
 class Cinder(Base):
 
-    def __init__(self, session):
-        super(Cinder, self).__init__('cinder', session)
+    def __init__(self, session, region_name=None):
+        super(Cinder, self).__init__('cinder', session, region_name=region_name)
         self.cc = self.get_client(self.component, api_version='2')
 
     def get_quota(self, project_id):
@@ -377,6 +473,19 @@ class Cinder(Base):
     def list_types(self):
         return self.cc.volume_types.list()
 
+    def create_volume(self, size, name=None, volume_type=None, image_id=None, metadata=None):
+        return self.cc.volumes.create(size, name=name, volume_type=volume_type,
+                                      imageRef=image_id, metadata=metadata)
+
+    def get_volume(self, volume_id):
+        return self.cc.volumes.get(volume_id)
+
+    def list_volumes(self, search_opts=None):
+        return self.cc.volumes.list(search_opts=search_opts)
+
+    def delete_volume(self, volume_id):
+        return self.cc.volumes.delete(volume_id)
+
 
 class Boot(object):
 
@@ -627,21 +736,16 @@ class OpenStack(object):
 
     def __init__(self, cloud):
 
-        self.session = self.get_session(cloud)
-        self.nova = Nova(self.session)
-        self.glance = None
-        self.neutron = Neutron(self.session)
-        self.cinder = Cinder(self.session)
-
-    def get_session(self, auth_dict):
-        auth_info = {
-            "username": auth_dict.get('username'),
-            "password": auth_dict.get('password'),
-            "auth_url": auth_dict.get('auth_url'),
-            "project_name": auth_dict.get('project_name'),
-            "project_domain_name": auth_dict.get('project_domain_name'),
-            "user_domain_name": auth_dict.get('user_domain_name')
-        }
-        auth = identity.Password(**auth_info)
-        sess = session.Session(auth=auth)
-        return sess
\ No newline at end of file
+        self.session = get_session(cloud)
+        self.region_name = cloud.get('region_name')
+        self.nova = Nova(self.session, region_name=self.region_name)
+        self._glance = None
+        self.neutron = Neutron(self.session, region_name=self.region_name)
+        self.cinder = Cinder(self.session, region_name=self.region_name)
+
+    @property
+    def glance(self):
+        """The glance client, created on first use as few callers need it"""
+        if self._glance is None:
+            self._glance = Glance(self.session, region_name=self.region_name)
+        return self._glance
@@ -1,130 +1,233 @@
+import collections
+import hashlib
+import threading
+import time
+
 from oslo_log import log as logging
 from pyVim import connect
 from pyVmomi import vim
 from pyVmomi import vmodl
 import six
 
+import v2v.conf
 from v2v.common.exception import vSpherePropertyNotExist
 from v2v.cloud.base import BaseDriver
 
 LOG = logging.getLogger(__name__)
+CONF = v2v.conf.CONF
+
+# The properties of the virtual machines shown by the servers listing
+VM_PROPERTIES = ["name", "guest.toolsStatus", "guest.toolsRunningStatus",
+                 "guest.guestFullName", "guest.hostName", "guest.ipAddress",
+                 "runtime.powerState", "config.template", "config.hardware.numCPU",
+                 "config.hardware.memoryMB", "summary.storage.committed",
+                 "summary.config.numVirtualDisks"]
+
+
+def _smart_connect(host, port, user, pwd):
+    """Log in a new session, None when it could not be opened"""
+    try:
+        return connect.SmartConnect(host=host,
+                                    port=port,
+                                    user=user,
+                                    pwd=pwd,
+                                    disableSslCertValidation=True)
+    except Exception as ex:
+        LOG.error(f"connet vcenter use host={host}, port={port}, usr={user} has error={str(ex)}")
+        return None
+
+
+def host_vm_spec(host):
+    """Returns the ObjectSpec selecting the virtual machines of an ESXi"""
+    PC = vmodl.query.PropertyCollector
+    host_to_vm = PC.TraversalSpec(name='hToVm', type=vim.HostSystem, path='vm', skip=False)
+    return PC.ObjectSpec(obj=host, skip=True, selectSet=[host_to_vm])
+
+
+class SessionPool(object):
+    """Process wide pool of logged in ServiceInstance objects
+
+    The sessions are kept per (host, port, user, password) and lent to one
+    borrower at a time, since a ServiceInstance is not thread safe. At most
+    ``vsphere_max_sessions`` sessions are opened to the same vCenter, the
+    borrowers wait for a session to be given back beyond that. The idle
+    sessions are kept alive by a background thread, and closed once they
+    are idle for ``vsphere_session_idle_timeout`` seconds. A session which
+    expired on the vCenter is logged in again before it is lent.
+
+    The long lived users of a session, like the inventory syncs which wait
+    for updates for as long as their cloud is listed, open their own
+    session instead (``pooled=False``), so they neither hold nor count
+    against the sessions of the pool.
+    """
 
+    def __init__(self):
+        self._cond = threading.Condition()
+        # key -> [(si, idle since)], the most recently used last
+        self._idle = collections.defaultdict(list)
+        # vCenter host -> number of opened sessions
+        self._opened = collections.Counter()
+        # id(si) -> key
+        self._keys = {}
+        self._keepalive = None
 
-def build_full_traversal():
-    """
-    Builds a traversal spec that will recurse through all objects .. or at
-    least I think it does. additions welcome.
+    @staticmethod
+    def _key(host, port, user, pwd):
+        return host, port, user, hashlib.sha256(pwd.encode('utf-8')).hexdigest()
+
+    def acquire(self, host, port, user, pwd):
+        """Borrow a session, None when it could not be opened in time"""
+        key = self._key(host, port, user, pwd)
+        deadline = time.time() + CONF.vsphere_session_wait_timeout
+        si = evicted = None
+        with self._cond:
+            self._start_keepalive()
+            while True:
+                if self._idle[key]:
+                    si, idle_since = self._idle[key].pop()
+                    break
+                if self._opened[host] < CONF.vsphere_max_sessions:
+                    self._opened[host] += 1
+                    break
+                # Take over the slot of an idle session of another user
+                evicted = self._evict(host)
+                if evicted is not None:
+                    break
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    LOG.error(f'No free session to vcenter {host} after '
+                              f'{CONF.vsphere_session_wait_timeout}s')
+                    return None
+                self._cond.wait(timeout)
+        if evicted is not None:
+            self._disconnect(evicted)
+
+        if si is not None:
+            if time.time() - idle_since < CONF.vsphere_keepalive_interval or \
+                    self._ensure_alive(si, user, pwd):
+                return si
+            # Keep the slot of the dead session for the new one
+            with self._cond:
+                self._keys.pop(id(si), None)
+            self._disconnect(si)
+
+        si = _smart_connect(host, port, user, pwd)
+        with self._cond:
+            if si is None:
+                self._opened[host] -= 1
+                self._cond.notify_all()
+            else:
+                self._keys[id(si)] = key
+        return si
+
+    def release(self, si, discard=False):
+        """Give back a session
+
+        :param discard: Close the session instead, when it is broken
+        """
+        with self._cond:
+            key = self._keys.get(id(si))
+            if key is None:
+                return
+            if not discard:
+                self._idle[key].append((si, time.time()))
+                self._cond.notify_all()
+                return
+        self._close(si)
+
+    def _close(self, si):
+        with self._cond:
+            key = self._keys.pop(id(si), None)
+            if key is not None:
+                self._opened[key[0]] -= 1
+            self._cond.notify_all()
+        self._disconnect(si)
+
+    def _evict(self, host):
+        """Forget the least recently used idle session of host
+
+        Called with the lock held, the slot of the session is kept for the
+        caller and the session is to be disconnected by the caller.
+        """
+        oldest = None
+        for key, idle in self._idle.items():
+            if key[0] == host and idle and (oldest is None or idle[0][1] < oldest[0][1]):
+                oldest = idle
+        if oldest is None:
+            return None
+        si, _ = oldest.pop(0)
+        self._keys.pop(id(si), None)
+        return si
 
-    See com.vmware.apputils.vim25.ServiceUtil.buildFullTraversal in the java
-    API. Extended by Sebastian Tello's examples from pysphere to reach networks
-    and datastores.
-    """
+    @staticmethod
+    def _disconnect(si):
+        try:
+            connect.Disconnect(si)
+        except Exception as ex:
+            LOG.debug(f'disconnect vcenter failed with {str(ex)}')
+
+    @staticmethod
+    def _ensure_alive(si, user, pwd):
+        """Log in again a session which expired on the vCenter"""
+        try:
+            if si.content.sessionManager.currentSession is not None:
+                return True
+            si.content.sessionManager.Login(user, pwd)
+            return True
+        except Exception as ex:
+            LOG.info(f'vcenter session can not be reused: {str(ex)}')
+            return False
+
+    def _start_keepalive(self):
+        if self._keepalive is None:
+            self._keepalive = threading.Thread(target=self._keepalive_loop,
+                                               name='vsphere-keepalive')
+            self._keepalive.daemon = True
+            self._keepalive.start()
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(CONF.vsphere_keepalive_interval)
+            try:
+                self._keep_alive()
+            except Exception as ex:
+                LOG.exception(f'keepalive of vcenter sessions failed with {str(ex)}')
+
+    def _keep_alive(self):
+        now = time.time()
+        with self._cond:
+            # Take the idle sessions out while they are checked
+            idle = [(key, si, since) for key, sessions in self._idle.items()
+                    for si, since in sessions]
+            self._idle.clear()
+        alive = collections.defaultdict(list)
+        for key, si, since in idle:
+            if now - since > CONF.vsphere_session_idle_timeout:
+                self._close(si)
+                continue
+            try:
+                si.CurrentTime()
+            except Exception as ex:
+                LOG.info(f'close the vcenter session of {key[0]}: {str(ex)}')
+                self._close(si)
+                continue
+            alive[key].append((si, since))
+        with self._cond:
+            for key, sessions in alive.items():
+                # The sessions given back meanwhile are the most recent
+                self._idle[key][:0] = sessions
+            self._cond.notify_all()
 
-    TraversalSpec = vmodl.query.PropertyCollector.TraversalSpec
-    SelectionSpec = vmodl.query.PropertyCollector.SelectionSpec
-
-    # Recurse through all resourcepools
-    rpToRp = TraversalSpec(name='rpToRp', type=vim.ResourcePool,
-                           path="resourcePool", skip=False)
-
-    rpToRp.selectSet.extend(
-        (
-            SelectionSpec(name="rpToRp"),
-            SelectionSpec(name="rpToVm"),
-        )
-    )
-
-    rpToVm = TraversalSpec(name='rpToVm', type=vim.ResourcePool, path="vm",
-                           skip=False)
-
-    # Traversal through resourcepool branch
-    crToRp = TraversalSpec(name='crToRp', type=vim.ComputeResource,
-                           path='resourcePool', skip=False)
-    crToRp.selectSet.extend(
-        (
-            SelectionSpec(name='rpToRp'),
-            SelectionSpec(name='rpToVm'),
-        )
-    )
-
-    # Traversal through host branch
-    crToH = TraversalSpec(name='crToH', type=vim.ComputeResource, path='host',
-                          skip=False)
-
-    # Traversal through hostFolder branch
-    dcToHf = TraversalSpec(name='dcToHf', type=vim.Datacenter,
-                           path='hostFolder', skip=False)
-    dcToHf.selectSet.extend(
-        (
-            SelectionSpec(name='visitFolders'),
-        )
-    )
-
-    # Traversal through vmFolder branch
-    dcToVmf = TraversalSpec(name='dcToVmf', type=vim.Datacenter,
-                            path='vmFolder', skip=False)
-    dcToVmf.selectSet.extend(
-        (
-            SelectionSpec(name='visitFolders'),
-        )
-    )
-
-    # Traversal through network folder branch
-    dcToNet = TraversalSpec(name='dcToNet', type=vim.Datacenter,
-                            path='networkFolder', skip=False)
-    dcToNet.selectSet.extend(
-        (
-            SelectionSpec(name='visitFolders'),
-        )
-    )
-
-    # Traversal through datastore branch
-    dcToDs = TraversalSpec(name='dcToDs', type=vim.Datacenter,
-                           path='datastore', skip=False)
-    dcToDs.selectSet.extend(
-        (
-            SelectionSpec(name='visitFolders'),
-        )
-    )
-
-    # Recurse through all hosts
-    hToVm = TraversalSpec(name='hToVm', type=vim.HostSystem, path='vm',
-                          skip=False)
-    hToVm.selectSet.extend(
-        (
-            SelectionSpec(name='visitFolders'),
-        )
-    )
-
-    # Recurse through the folders
-    visitFolders = TraversalSpec(name='visitFolders', type=vim.Folder,
-                                 path='childEntity', skip=False)
-    visitFolders.selectSet.extend(
-        (
-            SelectionSpec(name='visitFolders'),
-            SelectionSpec(name='dcToHf'),
-            SelectionSpec(name='dcToVmf'),
-            SelectionSpec(name='dcToNet'),
-            SelectionSpec(name='crToH'),
-            SelectionSpec(name='crToRp'),
-            SelectionSpec(name='dcToDs'),
-            SelectionSpec(name='hToVm'),
-            SelectionSpec(name='rpToVm'),
-        )
-    )
-
-    fullTraversal = SelectionSpec.Array(
-        (visitFolders, dcToHf, dcToVmf, dcToNet, crToH, crToRp, dcToDs, rpToRp,
-         hToVm, rpToVm,))
-
-    return fullTraversal
+
+_POOL = SessionPool()
 
 
 class VMwareDriver(BaseDriver):
     """Initialize a connection to a vcenter"""
 
-    def __init__(self, host='localhost', port=443, user='root', pwd='', **kwargs):
+    def __init__(self, host='localhost', port=443, user='root', pwd='', pooled=True, **kwargs):
         self._host = host
+        self._pooled = pooled
         self._port = port
         self._user = user
         self._pwd = pwd
@@ -137,25 +240,28 @@ class VMwareDriver(BaseDriver):
                 raise ValueError("The type of port should be integer.")
 
     def connect(self):
-        try:
-            self.si = connect.SmartConnect(
-                host=self._host,
-                port=self._port,
-                user=self._user,
-                pwd=self._pwd,
-                disableSslCertValidation=True
-            )
-        except Exception as ex:
-            LOG.error(f"connet vcenter use host={self._host}, port={self._port}, usr={self._user},"
-                      f" pwd={self._pwd} has error={str(ex)}")
-        finally:
-            if self.si is None:
-                LOG.error("Could not connect to the specified vcenter using "
-                          "specified username and password")
+        """Borrow a logged in session from the pool, or log in a session of
+        our own when the driver is not pooled
+        """
+        if self._pooled:
+            self.si = _POOL.acquire(self._host, self._port, self._user, self._pwd)
+        else:
+            self.si = _smart_connect(self._host, self._port, self._user, self._pwd)
+        if self.si is None:
+            LOG.error("Could not connect to the specified vcenter using "
+                      "specified username and password")
+
+    def disconnect(self, discard=False):
+        """Give the session back to the pool, or log out the session of our
+        own when the driver is not pooled
 
-    def disconnect(self):
+        :param discard: Close the session instead, when it is broken
+        """
         if self.si:
-            connect.Disconnect(self.si)
+            if self._pooled:
+                _POOL.release(self.si, discard=discard)
+            else:
+                SessionPool._disconnect(self.si)
             self.si = None
 
     def __enter__(self):
@@ -163,7 +269,12 @@ class VMwareDriver(BaseDriver):
         return self.si
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.disconnect()
+        self.disconnect(discard=self._broken(exc_val))
+
+    @staticmethod
+    def _broken(exc):
+        """Whether an error leaves the session unusable"""
+        return isinstance(exc, (vim.fault.NotAuthenticated, OSError))
 
 
 class vSphere(VMwareDriver):
@@ -177,7 +288,49 @@ class vSphere(VMwareDriver):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.disconnect()
+        self.disconnect(discard=self._broken(exc_val))
+
+    @staticmethod
+    def split_uri(uri):
+        """Returns the names of the path of an ESXi, e.g. [datacenter, host]"""
+        # Ensure the uri does not start with '/'
+        # and end with '/'
+        if uri.startswith('/'):
+            uri = uri.split('/', 1)[1]
+        if uri.endswith('/'):
+            uri = uri.rsplit('/', 1)[0]
+        return uri.split('/')
+
+    def find_host(self, uri):
+        """Find the ESXi of an uri
+
+        The inventory path of the ESXi is resolved on the vCenter by
+        SearchIndex.FindByInventoryPath, the uri being the datacenter
+        followed by the path of the ESXi in the host folder, which may go
+        through folders and clusters.
+
+        :param uri: The uri of the ESXi, e.g. Datacenter/192.168.5.12
+        :returns: (host, None) or (None, fault message)
+        """
+        uri = self.split_uri(uri)
+        search = self.si.content.searchIndex
+        path = '/'.join([uri[0], 'host'] + uri[1:])
+        entity = search.FindByInventoryPath(path)
+        if isinstance(entity, vim.HostSystem):
+            return entity, None
+        if isinstance(entity, vim.ComputeResource) and not \
+                isinstance(entity, vim.ClusterComputeResource):
+            # A standalone ESXi is the only host of its compute resource
+            hosts = entity.host
+            if hosts:
+                return hosts[0], None
+
+        if entity is None and search.FindByInventoryPath(uri[0]) is None:
+            LOG.error("Could not find specified datacenter %s." % uri[0])
+            return None, "Could not find specified datacenter %s." % uri[0]
+
+        LOG.error("Could not find specified esxi %s." % uri[-1])
+        return None, "Could not find specified esxi %s." % uri[-1]
 
     @staticmethod
     def _parse_propspec(propspec):
@@ -198,95 +351,46 @@ class vSphere(VMwareDriver):
             props.append((motype, objprops,))
         return props
 
-    @staticmethod
-    def _create_filter_spec(objs, props):
-        """Returns filterSpec object"""
-        obj_specs = []
-        prop_specs = []
-        traversal = build_full_traversal()
-        for obj in objs:
-            obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=obj,
-                                                               selectSet=traversal)
-            obj_specs.append(obj_spec)
-        for motype, proplist in props:
-            # param all: bool
-            # Specifies whether or not all properties of the object are read.
-            # If this properties is set to true, the 'pathSet' property is ignored.
-            prop_spec = vmodl.query.PropertyCollector.PropertySpec(all=False,
-                                                                   type=motype,
-                                                                   pathSet=proplist)
-            prop_specs.append(prop_spec)
-        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs,
-                                                               propSet=prop_specs)
-        return filter_spec
-
-    def get_container_view(self, container=None, object_type=None, recursive=True):
-        """Returns the container view of specified object type
+    def _iter_property_collector(self, obj_spec, props, max_objects=None):
+        """Yields the pages of ObjectContent of the objects of an ObjectSpec
 
-        :param container: A reference to an instance of a Folder, Datacenter,
-                ResourcePool or HostSystem object.
-        :type container: ManagedEntity Object
-        :param object_type: An optional list of managed entity types. The server
-                associates only objects of the specified types with the view.
-                If you specify an empty list, the server uses all types.
-        :type object_type: List
-        :param recursive: When True, include only the immediate children of the
-                container instance. When False, include additional objects by
-                following paths beyond the immediate children.
-        :type recursive: Bool
-        """
-        if self.si is None:
-            return
+        The pages are yielded as RetrievePropertiesEx and
+        ContinueRetrievePropertiesEx return them, so the inventory is never
+        held whole in memory. When the generator is closed before the last
+        page, the rest of the retrieval is cancelled.
 
-        container = container or self.si.content.rootFolder
-        container_view = self.si.content.viewManager.CreateContainerView(
-            container, object_type, recursive
-        )
-        view = container_view.view
-        container_view.Destroy()
-        return view
-
-    def _do_property_collector(self, objs, props, max_objects=100):
-        """Really do properties collector using RetrievePropertiesEx
-
-        :param objs: The objects will be queried
+        :param obj_spec: The ObjectSpec selecting the objects will be queried
         :param props: The properties of objects will be queried
-        :param max_objects: The maximum number of ObjectContent data objects that should
-        be returned in a single result from RetrievePropertiesEx. The default is 100
+        :param max_objects: The maximum number of ObjectContent data objects
+                of a page, ``vsphere_max_objects`` by default
         """
-        if self.si is None:
-            return
-
+        PC = vmodl.query.PropertyCollector
         pc = self.si.content.propertyCollector
-        filter_spec = self._create_filter_spec(objs, props)
-        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=max_objects)
-        result = pc.RetrievePropertiesEx([filter_spec], options)
-
-        # Because the maximum number of objects retrieved by RetrievePropertiesEx
-        # and ContinueRetrievePropertiesEx were limit to 100. So, we need to
-        # continue retrieve properties using token
-        def _continue(token=None):
-            _result = pc.ContinueRetrievePropertiesEx(token)
-            _token = _result.token
-            _objects = _result.objects
-            if _token is not None:
-                _objects_ex = _continue(_token)
-                _objects.extend(_objects_ex)
-            return _objects
+        prop_specs = [PC.PropertySpec(all=False, type=motype, pathSet=proplist)
+                      for motype, proplist in props]
+        filter_spec = PC.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+        options = PC.RetrieveOptions(maxObjects=max_objects or CONF.vsphere_max_objects)
 
-        if result is None:
-            return []
-
-        token = result.token
-        objects = result.objects
-        if token is not None:
-            _objects = _continue(token)
-            objects.extend(_objects)
+        result = pc.RetrievePropertiesEx([filter_spec], options)
+        token = None
+        try:
+            while result is not None:
+                token = result.token
+                yield result.objects
+                if token is None:
+                    break
+                result = pc.ContinueRetrievePropertiesEx(token)
+            token = None
+        finally:
+            if token is not None:
+                pc.CancelRetrievePropertiesEx(token)
 
-        return objects
+    def iter_property_collector(self, container=None, object_type=None, property_spec=None,
+                                max_objects=None):
+        """Yields the specified properties of specified objects page by page
 
-    def property_collector(self, container=None, object_type=None, property_spec=None):
-        """Retrieve specified properties of  specified objects
+        The objects are selected on the vCenter by traversing a container
+        view.
 
         :param container: A reference to an instance of a Folder, Datacenter,
                 ResourcePool or HostSystem object.
@@ -297,31 +401,87 @@ class vSphere(VMwareDriver):
         :type object_type: List
         :param property_spec: The property specifications need to be parsed.
         :type property_spec: dict
-        :return: The ObjectContent data objects which retrieved from RetrievePropertiesEx.
+        :param max_objects: The maximum number of objects of a page
+        :returns: Lists of dicts of the properties of an object
 
         :useage
             with vSphere(host='localhost', user='root', pwd='') as vs:
-                container = vs.si.content.rootFolder
-                object_type = [vim.Datacenter]
                 prop_spec = {
                     "VirtualMachine": ["name"]
                 }
-                objects = vs.property_collector(container, object_type, prop_spec)
+                for page in vs.iter_property_collector(None, [vim.VirtualMachine], prop_spec):
+                    ...
         """
+        if self.si is None:
+            return
+
         # The type of object_type must be list
         if not isinstance(object_type, list):
             object_type = [object_type]
 
-        objs = self.get_container_view(container=container, object_type=object_type)
+        PC = vmodl.query.PropertyCollector
+        container = container or self.si.content.rootFolder
+        view = self.si.content.viewManager.CreateContainerView(container, object_type, True)
+        traversal = PC.TraversalSpec(name='traverseView', type=vim.view.ContainerView,
+                                     path='view', skip=False)
+        obj_spec = PC.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
         props = self._parse_propspec(property_spec)
-        result = []
         try:
-            objects = self._do_property_collector(objs, props)
-        except vmodl.query.InvalidProperty:
-            raise
-        for obj in objects:
-            value = dict()
-            for prop in obj.propSet:
-                value[prop.name] = prop.val
-            result.append(value)
-        return result
+            for objects in self._iter_property_collector(obj_spec, props, max_objects):
+                yield self._to_dicts(objects)
+        finally:
+            view.Destroy()
+
+    def iter_host_vms(self, host, properties, max_objects=None):
+        """Yields the properties of the virtual machines of an ESXi page by page
+
+        The virtual machines are reached by traversing HostSystem.vm, so no
+        container view is created.
+        """
+        if self.si is None:
+            return
+        for objects in self._iter_property_collector(host_vm_spec(host),
+                                                     [(vim.VirtualMachine, properties)],
+                                                     max_objects):
+            yield self._to_dicts(objects)
+
+    @staticmethod
+    def _to_dicts(objects):
+        return [{prop.name: prop.val for prop in obj.propSet} for obj in objects]
+
+    def list_hosts(self, container):
+        """List the ESXi of a datacenter or a cluster
+
+        :param container: The Datacenter, ClusterComputeResource or
+                ComputeResource the ESXi are in
+        :returns: A list of dicts with the moid, the name and the cluster
+                name of the ESXi
+        """
+        PC = vmodl.query.PropertyCollector
+        view = self.si.content.viewManager.CreateContainerView(
+            container, [vim.HostSystem, vim.ClusterComputeResource], True)
+        traversal = PC.TraversalSpec(name='traverseView', type=vim.view.ContainerView,
+                                     path='view', skip=False)
+        obj_spec = PC.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+        props = [(vim.HostSystem, ['name', 'parent']), (vim.ClusterComputeResource, ['name'])]
+        hosts, clusters = [], {}
+        try:
+            for objects in self._iter_property_collector(obj_spec, props):
+                for obj in objects:
+                    values = {prop.name: prop.val for prop in obj.propSet}
+                    if isinstance(obj.obj, vim.HostSystem):
+                        hosts.append((obj.obj._moId, values))
+                    else:
+                        clusters[obj.obj._moId] = values.get('name')
+        finally:
+            view.Destroy()
+        if isinstance(container, vim.ClusterComputeResource):
+            clusters[container._moId] = container.name
+        return [{'moid': moid,
+                 'name': values.get('name'),
+                 'cluster': clusters.get(getattr(values.get('parent'), '_moId', None))}
+                for moid, values in hosts]
+
+    def get_host(self, moid):
+        """Returns the ESXi of a moid in the session of this instance"""
+        return vim.HostSystem(moid, self.si._stub)
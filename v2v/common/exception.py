@@ -7,3 +7,12 @@ class vSpherePropertyNotExist(Exception):
 
     def __str__(self):
         return self.message
+
+
+class TaskLeaseLost(Exception):
+    def __init__(self, task_id):
+        self.message = ("The lease of task %s is lost, the task is left to "
+                        "the agent which claims it next." % task_id)
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,93 @@
+"""
+Parser of the virt-v2v output, reporting which disk is copied and the
+progress of the copy of that disk.
+"""
+
+from collections import namedtuple
+import re
+
+
+ImportProgress = namedtuple('ImportProgress',
+                            ['current_disk', 'disk_count', 'description'])
+DiskProgress = namedtuple('DiskProgress', ['progress'])
+
+
+class V2VError(Exception):
+    ''' Base class for v2v errors '''
+    err_name = 'unexpected'  # TODO: use more specific error
+
+
+class OutputParserError(V2VError):
+    ''' Error while parsing virt-v2v output '''
+
+
+class OutputParser(object):
+    COPY_DISK_RE = re.compile(br'.*(Copying disk (\d+)/(\d+)).*')
+    DISK_PROGRESS_RE = re.compile(br'\s+\((\d+).*|.+ (\d+)% \[[*-]+\]')
+
+    def __init__(self):
+        self.copying = False
+
+    def parse(self, stream):
+        for line in stream:
+            if b'Copying disk' in line:
+                description, current_disk, disk_count = self._parse_line(line)
+                yield ImportProgress(int(current_disk), int(disk_count),
+                                     description.decode('utf-8'))
+                for chunk in self._iter_progress(stream):
+                    progress = self._parse_progress(chunk)
+                    if progress is not None:
+                        yield DiskProgress(progress)
+                    if progress == 100:
+                        break
+
+    def feed(self, line):
+        """Parse a single line of output which is read incrementally
+
+        Unlike parse(), it never blocks waiting for more output, so the
+        caller can feed the lines of a log file while it is being written.
+
+        :param line: A line of output, ended by '\\n' or '\\r' or not ended
+        :returns: ImportProgress, DiskProgress or None
+        """
+        if b'Copying disk' in line:
+            description, current_disk, disk_count = self._parse_line(line)
+            self.copying = True
+            return ImportProgress(int(current_disk), int(disk_count),
+                                  description.decode('utf-8'))
+        if self.copying:
+            progress = self._parse_progress(line)
+            if progress == 100:
+                self.copying = False
+            if progress is not None:
+                return DiskProgress(progress)
+        return None
+
+    def _parse_line(self, line):
+        m = self.COPY_DISK_RE.match(line)
+        if m is None:
+            raise OutputParserError('unexpected format in "Copying disk"'
+                                    ', line: %r' % line)
+        return m.group(1), m.group(2), m.group(3)
+
+    def _iter_progress(self, stream):
+        chunk = b''
+        while True:
+            c = stream.read(1)
+            if not c:
+                raise OutputParserError('copy-disk stream closed unexpectedly')
+            chunk += c
+            if c in [b'\n', b'\r']:
+                yield chunk
+                chunk = b''
+
+    def _parse_progress(self, chunk):
+        m = self.DISK_PROGRESS_RE.match(chunk)
+        if m is None:
+            return None
+        value = [x for x in m.groups() if x is not None][0]
+        try:
+            return int(value)
+        except ValueError:
+            raise OutputParserError('error parsing progress regex: %r'
+                                    % m.groups)
@@ -0,0 +1,53 @@
+"""
+The sources a conversion reads from, shared by the agent which admits the
+tasks and the API which places them.
+"""
+
+from oslo_log import log as logging
+
+import v2v.conf
+
+LOG = logging.getLogger(__name__)
+CONF = v2v.conf.CONF
+
+
+def source_keys(src_cloud):
+    """The sources a task reads from: its vCenter and its ESXi host
+
+    A host is named after its vCenter too, as different vCenters may manage
+    hosts of the same name.
+
+    :param src_cloud: The ``VMware`` cloud row of the task
+    """
+    vcenter = src_cloud.get('ip')
+    host = (src_cloud.get('uri') or '').strip('/').split('/')[-1]
+    return (('vcenter', vcenter), ('host', f'{vcenter}/{host}'))
+
+
+def _source_limits():
+    """source_concurrency_limits as a dict of ``kind:name`` to the limit"""
+    limits = {}
+    for item in CONF.source_concurrency_limits or ():
+        key, _, limit = item.rpartition(':')
+        try:
+            limits[key] = int(limit)
+        except ValueError:
+            LOG.warning(f'Invalid item {item} of source_concurrency_limits is ignored')
+    return limits
+
+
+def source_name(kind, name):
+    """The name of a source in the options, e.g. ``vcenter:192.168.5.10``
+    or ``host:192.168.5.10/10.0.0.1``
+    """
+    return f'{kind}:{name}'
+
+
+def source_limit(kind, name):
+    """The maximum concurrent tasks of a source on an agent, 0 for unlimited"""
+    limit = _source_limits().get(source_name(kind, name))
+    if limit is not None:
+        return limit
+    if kind == 'vcenter':
+        return CONF.max_concurrent_tasks_per_vcenter
+    return CONF.max_concurrent_tasks_per_host
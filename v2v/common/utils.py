@@ -94,6 +94,19 @@ def resp_message(data=None, success=True, code=200, message='', exception=None)
     return resp
 
 
+def resp_catalog(catalog):
+    """
+    带ETag的返回值包装器, 请求的If-None-Match与ETag一致时返回304
+
+    :param catalog: 带etag属性的列表
+    :return:
+    """
+    headers = {'ETag': f'"{catalog.etag}"'}
+    if catalog.etag and request.if_none_match.contains_weak(catalog.etag):
+        return None, 304, headers
+    return resp_message(catalog), 200, headers
+
+
 def storage_unit_switch(size: int or float, org_unit: str = ("B", "KB", "MB", "GB", "TB", "PB"),
                         target_unit: str = ("B", "KB", "MB", "GB", "TB", "PB")):
     """
@@ -135,12 +148,18 @@ def check_cmd_output(cmd):
         return None
 
 
+_HOST_UUID = None
+
+
 def get_host_uuid():
-    cmd = ['dmidecode', '-s', 'system-serial-number']
-    uuid = check_cmd_output(cmd)
-    if uuid is not None:
-        uuid = uuid.decode().strip()
-    return uuid
+    """The serial number of the host, read once per process"""
+    global _HOST_UUID
+    if _HOST_UUID is None:
+        cmd = ['dmidecode', '-s', 'system-serial-number']
+        uuid = check_cmd_output(cmd)
+        if uuid is not None:
+            _HOST_UUID = uuid.decode().strip()
+    return _HOST_UUID
 
 
 def time_func(func):
@@ -6,7 +6,6 @@ progress is a number which represent percentage of a single disk copy,
 status is a way to feedback information on the job (init, error etc)
 """
 
-from collections import namedtuple
 from contextlib import closing, contextmanager
 import errno
 import io
@@ -32,6 +31,8 @@ from v2v.common.commands import execCmd, BUFFSIZE, terminating
 from v2v.common.config import config
 from v2v.common.define import errCode, doneCode
 from v2v.common.logutils import traceback
+from v2v.common.outputparser import DiskProgress, ImportProgress, OutputParser
+from v2v.common.outputparser import V2VError
 from v2v.common.time import monotonic_time
 from v2v.common.units import MiB
 from v2v.constants import P_VDSM_LOG, P_VDSM_RUN, EXT_KVM_2_OVIRT
@@ -68,11 +69,6 @@ _OVF_NS = 'http://schemas.dmtf.org/ovf/envelope/1'
 _RASD_NS = 'http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/' \
            'CIM_ResourceAllocationSettingData'
 
-ImportProgress = namedtuple('ImportProgress',
-                            ['current_disk', 'disk_count', 'description'])
-DiskProgress = namedtuple('DiskProgress', ['progress'])
-
-
 class STATUS:
     '''
     STARTING: request granted and starting the import process
@@ -88,11 +84,6 @@ class STATUS:
     DONE = 'done'
 
 
-class V2VError(Exception):
-    ''' Base class for v2v errors '''
-    err_name = 'unexpected'  # TODO: use more specific error
-
-
 class ClientError(Exception):
     ''' Base class for client error '''
     err_name = 'unexpected'
@@ -102,10 +93,6 @@ class InvalidVMConfiguration(ValueError):
     ''' Unexpected error while parsing libvirt domain xml '''
 
 
-class OutputParserError(V2VError):
-    ''' Error while parsing virt-v2v output '''
-
-
 class JobExistsError(ClientError):
     ''' Job already exists in _jobs collection '''
     err_name = 'JobExistsError'
@@ -925,53 +912,6 @@ class ImportVm(object):
                 self._proc.wait()
 
 
-class OutputParser(object):
-    COPY_DISK_RE = re.compile(br'.*(Copying disk (\d+)/(\d+)).*')
-    DISK_PROGRESS_RE = re.compile(br'\s+\((\d+).*|.+ (\d+)% \[[*-]+\]')
-
-    def parse(self, stream):
-        for line in stream:
-            if b'Copying disk' in line:
-                description, current_disk, disk_count = self._parse_line(line)
-                yield ImportProgress(int(current_disk), int(disk_count),
-                                     description.decode('utf-8'))
-                for chunk in self._iter_progress(stream):
-                    progress = self._parse_progress(chunk)
-                    if progress is not None:
-                        yield DiskProgress(progress)
-                    if progress == 100:
-                        break
-
-    def _parse_line(self, line):
-        m = self.COPY_DISK_RE.match(line)
-        if m is None:
-            raise OutputParserError('unexpected format in "Copying disk"'
-                                    ', line: %r' % line)
-        return m.group(1), m.group(2), m.group(3)
-
-    def _iter_progress(self, stream):
-        chunk = b''
-        while True:
-            c = stream.read(1)
-            if not c:
-                raise OutputParserError('copy-disk stream closed unexpectedly')
-            chunk += c
-            if c in [b'\n', b'\r']:
-                yield chunk
-                chunk = b''
-
-    def _parse_progress(self, chunk):
-        m = self.DISK_PROGRESS_RE.match(chunk)
-        if m is None:
-            return None
-        value = [x for x in m.groups() if x is not None][0]
-        try:
-            return int(value)
-        except ValueError:
-            raise OutputParserError('error parsing progress regex: %r'
-                                    % m.groups)
-
-
 def _mem_to_mib(size, unit):
     lunit = unit.lower()
     if lunit in ('bytes', 'b'):
@@ -23,6 +23,103 @@ v2v_api_opts = [
         default=5,
         help="when no license the server number allow to convert"
     ),
+    cfg.IntOpt('vsphere_max_sessions',
+               default=4,
+               min=1,
+               help="Maximum pooled sessions the API opens to the same "
+                    "vCenter for the listings. The inventory syncs open one "
+                    "more session per synced cloud, outside of this limit."),
+    cfg.IntOpt('vsphere_keepalive_interval',
+               default=300,
+               min=10,
+               help="The interval in seconds to keep the idle vCenter "
+                    "sessions alive."),
+    cfg.IntOpt('vsphere_session_idle_timeout',
+               default=1800,
+               min=0,
+               help="The seconds after which an idle vCenter session is "
+                    "closed."),
+    cfg.IntOpt('vsphere_session_wait_timeout',
+               default=30,
+               min=0,
+               help="The seconds to wait for a free vCenter session when "
+                    "vsphere_max_sessions are in use."),
+    cfg.IntOpt('openstack_token_min_life',
+               default=120,
+               min=0,
+               help="The keystone token of an openstack cloud is reused "
+                    "until it expires within so many seconds."),
+    cfg.IntOpt('catalog_cache_ttl',
+               default=300,
+               min=0,
+               help="The seconds the flavors and the volume types of an "
+                    "openstack cloud are cached."),
+    cfg.IntOpt('catalog_networks_ttl',
+               default=30,
+               min=0,
+               help="The seconds the networks of an openstack cloud, with "
+                    "their available ips, are cached."),
+    cfg.IntOpt('catalog_stale_seconds',
+               default=600,
+               min=0,
+               help="The seconds an expired catalog is still returned while "
+                    "it is fetched again in the background. An expired "
+                    "networks catalog is never returned, as its available "
+                    "ips may be taken."),
+    cfg.IntOpt('catalog_max_filtered',
+               default=32,
+               min=1,
+               help="Maximum filtered catalogs, e.g. the networks listed "
+                    "one by one, cached per openstack cloud."),
+    cfg.IntOpt('neutron_max_parallel',
+               default=8,
+               min=1,
+               help="Maximum concurrent neutron requests to list the "
+                    "networks of an openstack cloud."),
+    cfg.IntOpt('vsphere_max_parallel_hosts',
+               default=4,
+               min=1,
+               help="Maximum ESXi of a vCenter whose servers are collected "
+                    "at the same time when listing a cluster or a "
+                    "datacenter, bounded by vsphere_max_sessions. The "
+                    "sessions are shared with the other listings, a "
+                    "collection waits for a free one up to "
+                    "vsphere_session_wait_timeout."),
+    cfg.IntOpt('vsphere_max_objects',
+               default=100,
+               min=1,
+               help="The maximum objects of a page of RetrievePropertiesEx."),
+    cfg.BoolOpt('inventory_sync',
+                default=True,
+                help="Keep the virtual machines of the VMware clouds in "
+                     "memory, updated by WaitForUpdatesEx, to answer the "
+                     "servers listing. Each synced cloud holds a vCenter "
+                     "session of its own, not counted in "
+                     "vsphere_max_sessions."),
+    cfg.IntOpt('inventory_wait_seconds',
+               default=60,
+               min=1,
+               help="The longest wait in seconds of a WaitForUpdatesEx call."),
+    cfg.IntOpt('inventory_initial_wait',
+               default=10,
+               min=0,
+               help="The seconds the servers listing waits for the first "
+                    "sync of a cloud before listing the servers directly."),
+    cfg.IntOpt('inventory_idle_timeout',
+               default=3600,
+               min=60,
+               help="The sync of a cloud whose servers are not listed for "
+                    "so many seconds is stopped."),
+    cfg.FloatOpt('default_task_throughput_mbps',
+                 default=50,
+                 min=0.1,
+                 help="The copy throughput in MB/s assumed by the wave "
+                      "planner for a source without finished tasks."),
+    cfg.IntOpt('task_overhead_seconds',
+               default=300,
+               min=0,
+               help="The seconds a conversion takes besides the copy of "
+                    "the disks, used by the wave planner."),
 ]
 
 
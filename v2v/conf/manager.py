@@ -24,9 +24,6 @@ engine_opts = [
     cfg.StrOpt('openstack_type',
                default='openstack',
                help="The convert type."),
-    cfg.BoolOpt('use_openstack_cli',
-               default=True,
-               help="Set True to use openstack cli not request."),
     cfg.IntOpt(
         "max_concurrent_tasks",
         default=1,
@@ -42,8 +39,103 @@ engine_opts = [
     cfg.IntOpt('block_device_allocate_retries_interval',
                default=3,
                min=0,
-               help='')
-
+               help=''),
+    cfg.StrOpt('libguestfs_cache_dir',
+               default='/var/tmp',
+               help="The directory where libguestfs keeps its appliance "
+                    "and virt-v2v its overlays."),
+    cfg.IntOpt('default_task_disk_gb',
+               default=100,
+               min=0,
+               help="The disk size assumed for a source server whose size "
+                    "is not given by the task."),
+    cfg.IntOpt('task_cache_gb',
+               default=2,
+               min=0,
+               help="The space in libguestfs_cache_dir a task needs for the "
+                    "appliance and the overlays."),
+    cfg.IntOpt('task_memory_mb',
+               default=2048,
+               min=0,
+               help="The memory a task needs for its appliance."),
+    cfg.IntOpt('task_cpus',
+               default=1,
+               min=0,
+               help="The cpus a task needs."),
+    cfg.IntOpt('task_bandwidth_mbps',
+               default=0,
+               min=0,
+               help="The network bandwidth in MB/s a task needs."),
+    cfg.IntOpt('agent_bandwidth_mbps',
+               default=0,
+               min=0,
+               help="The network bandwidth in MB/s of the agent. "
+                    "Set 0 to not limit the tasks by bandwidth."),
+    cfg.IntOpt('reserved_host_memory_mb',
+               default=1024,
+               min=0,
+               help="The memory kept for the host and not used by tasks."),
+    cfg.IntOpt('reserved_disk_gb',
+               default=10,
+               min=0,
+               help="The disk space kept free in the work dir and in "
+                    "libguestfs_cache_dir."),
+    cfg.IntOpt('max_concurrent_tasks_per_vcenter',
+               default=0,
+               min=0,
+               help="Maximum concurrent tasks of an agent reading from the "
+                    "same vCenter. The limit applies per agent, not across "
+                    "the cluster. Set 0 for unlimited."),
+    cfg.IntOpt('max_concurrent_tasks_per_host',
+               default=0,
+               min=0,
+               help="Maximum concurrent tasks of an agent reading from the "
+                    "same ESXi host. The limit applies per agent, not across "
+                    "the cluster. Set 0 for unlimited."),
+    cfg.ListOpt('source_concurrency_limits',
+                default=[],
+                help="Maximum concurrent tasks of an agent reading from "
+                     "specified vCenters or ESXi hosts, which overrides "
+                     "max_concurrent_tasks_per_vcenter and "
+                     "max_concurrent_tasks_per_host. The limits apply per "
+                     "agent, not across the cluster. A vCenter is given by "
+                     "its ip and a host by the ip of its vCenter and its name, "
+                     "e.g. vcenter:192.168.5.10:4,host:192.168.5.10/10.0.0.1:2"),
+    cfg.IntOpt('admission_recheck_interval',
+               default=30,
+               min=1,
+               help="The interval in seconds to poll the task queue and "
+                    "check again whether the waiting tasks fit into the "
+                    "free resources."),
+    cfg.IntOpt('task_lease_seconds',
+               default=60,
+               min=10,
+               help="How long an agent holds a task without renewing the "
+                    "lease. The task of an agent which stopped renewing it "
+                    "is requeued."),
+    cfg.IntOpt('task_max_attempts',
+               default=3,
+               min=1,
+               help="How many times a task is claimed before it is failed "
+                    "because its agents were lost."),
+    cfg.IntOpt('agent_down_time',
+               default=90,
+               min=1,
+               help="An agent without heartbeat for so many seconds is "
+                    "lost, no task is placed on it and its queued tasks "
+                    "may be claimed by any agent."),
+    cfg.ListOpt('agent_affinity',
+                default=[],
+                help="The vCenters or ESXi hosts the tasks of which are "
+                     "placed on this agent, named as in "
+                     "source_concurrency_limits, e.g. "
+                     "vcenter:192.168.5.10,host:192.168.5.12/10.0.0.1"),
+    cfg.IntOpt('task_claim_batch',
+               default=20,
+               min=1,
+               help="How many queued tasks are read at a time while the "
+                    "task queue is scanned for the tasks which fit into the "
+                    "agent."),
 ]
 
 
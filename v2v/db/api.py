@@ -1,11 +1,18 @@
+import os
 import threading
 
+from migrate import exceptions as versioning_exceptions
+from migrate.versioning import api as versioning_api
 from oslo_db import exception as db_exc
 from oslo_db import options
 from oslo_db.sqlalchemy import session as db_session
+from oslo_db.sqlalchemy import utils as db_utils
 from oslo_log import log as logging
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
 from dateutil import tz
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import func, inspect, or_, text
 
 import v2v.conf
 from v2v.db import models
@@ -21,6 +28,9 @@ options.set_defaults(CONF,
 _LOCK = threading.Lock()
 _FACADE = None
 
+# The most values of an IN clause in one query
+IN_QUERY_BATCH = 500
+
 
 def _create_facade_lazily():
     global _LOCK
@@ -61,8 +71,51 @@ def is_user_context(context):
 
 def register_models():
     # NOTE(lhx): register all models before invoking db api functions
+    db_sync()
+
+
+# The version of the schema of the first release, see migrate_repo
+BASELINE_VERSION = 1
+MIGRATE_REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrate_repo')
+# Named lock serializing db_sync on MySQL, and how long to wait for it
+DB_SYNC_LOCK = 'v2v_db_sync'
+DB_SYNC_LOCK_TIMEOUT = 300
+
+
+def db_sync():
+    """Create the tables, or upgrade them to the schema of the models
+
+    A new database is created from the models and stamped with the last
+    version of migrate_repo. A database of the first release, which has
+    tables but no version, is stamped with BASELINE_VERSION then upgraded.
+    The API and the agent start at the same time, on MySQL the upgrade is
+    serialized by a named lock.
+    """
     engine = get_engine()
-    BASE.metadata.create_all(engine)
+    with engine.connect() as conn:
+        locked = engine.dialect.name == 'mysql'
+        if locked:
+            # GET_LOCK returns 0 on timeout and NULL on error
+            acquired = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                    name=DB_SYNC_LOCK,
+                                    timeout=DB_SYNC_LOCK_TIMEOUT).scalar()
+            if acquired != 1:
+                raise Exception(f'Failed to acquire the database lock {DB_SYNC_LOCK} '
+                                f'in {DB_SYNC_LOCK_TIMEOUT}s')
+        try:
+            try:
+                versioning_api.db_version(engine, MIGRATE_REPO)
+            except versioning_exceptions.DatabaseNotControlledError:
+                if 'task' in inspect(engine).get_table_names():
+                    versioning_api.version_control(engine, MIGRATE_REPO, BASELINE_VERSION)
+                else:
+                    BASE.metadata.create_all(engine)
+                    versioning_api.version_control(engine, MIGRATE_REPO,
+                                                   versioning_api.version(MIGRATE_REPO))
+            versioning_api.upgrade(engine, MIGRATE_REPO)
+        finally:
+            if locked:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), name=DB_SYNC_LOCK)
 
 
 def unregister_models():
@@ -108,6 +161,14 @@ def create(obj):
     return obj
 
 
+def create_all(objs):
+    """Insert the objects in one transaction"""
+    session = get_session()
+    with session.begin():
+        session.add_all(objs)
+    return objs
+
+
 def get_all(model, to_dict=True):
     session = get_session()
     datas = session.query(model).order_by(model.id.desc()).all()
@@ -116,20 +177,63 @@ def get_all(model, to_dict=True):
     return datas
 
 
-def task_get_all_by_filter(filters):
+# The columns the tasks can be sorted by
+TASK_SORT_KEYS = ('created_at', 'updated_at', 'name', 'state', 'percent')
+
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _task_filter_query(session, filters):
+    """The query of the tasks matching the filters
+
+    :param filters: state, a list of states, src_cloud, dest_cloud and name,
+            a substring of the name of the tasks
+    """
+    query = session.query(models.Task)
+    if filters.get('state'):
+        query = query.filter(models.Task.state.in_(filters['state']))
+    if filters.get('src_cloud'):
+        query = query.filter(models.Task.src_cloud == filters['src_cloud'])
+    if filters.get('dest_cloud'):
+        query = query.filter(models.Task.dest_cloud == filters['dest_cloud'])
+    if filters.get('name'):
+        query = query.filter(models.Task.name.like(
+            f'%{_like_escape(filters["name"])}%', escape='\\'))
+    return query
+
+
+def task_get_page(filters=None, limit=None, marker=None, sort_key=None, sort_dir='desc'):
+    """Returns a page of the tasks
+
+    :param filters: state, a list of states, src_cloud, dest_cloud and name,
+            a substring of the name of the tasks
+    :param limit: The maximum tasks to return, all if None
+    :param marker: The uuid of the last task of the previous page
+    :param sort_key: One of TASK_SORT_KEYS, the tasks are sorted by id
+            after it, by id only if None
+    :param sort_dir: asc or desc
+    :returns: The tasks as dicts, the count of the tasks matching the
+            filters and the marker of the next page, None on the last page
+    """
     session = get_session()
-    if 'state' in filters:
-        state = filters.pop('state')
-        query = session.query(models.Task)
-        return query.filter(models.Task.state.in_(state)).all()
-    if 'dest_cloud' in filters:
-        dest_cloud = filters.pop('dest_cloud')
-        query = session.query(models.Task)
-        return query.filter(models.Task.dest_cloud == dest_cloud).all()
-    if 'src_cloud' in filters:
-        src_cloud = filters.pop('src_cloud')
-        query = session.query(models.Task)
-        return query.filter(models.Task.src_cloud == src_cloud).all()
+    query = _task_filter_query(session, filters or {})
+    total = query.count()
+
+    marker_task = None
+    if marker is not None:
+        marker_task = session.query(models.Task).filter_by(uuid=marker).first()
+        if marker_task is None:
+            raise Exception(f'no task with uuid={marker}')
+    sort_keys = [sort_key, 'id'] if sort_key else ['id']
+    query = db_utils.paginate_query(query, models.Task, limit, sort_keys,
+                                    marker=marker_task, sort_dir=sort_dir)
+    tasks = query.all()
+    next_marker = None
+    if limit is not None and len(tasks) == limit:
+        next_marker = tasks[-1].uuid
+    return [data_to_dict(models.Task, t) for t in tasks], total, next_marker
 
 
 def get_by_uuid(model, uuid, to_dict=True):
@@ -141,6 +245,43 @@ def get_by_uuid(model, uuid, to_dict=True):
     return data
 
 
+def task_count_by_filter(filters):
+    """Returns the count of the tasks matching the filters
+
+    :param filters: As for task_get_page
+    """
+    session = get_session()
+    query = _task_filter_query(session, filters)
+    return query.with_entities(func.count(models.Task.id)).scalar()
+
+
+def task_exists_by_filter(filters):
+    """Returns the uuid of a task matching the filters, None if none does
+
+    :param filters: As for task_get_page
+    """
+    session = get_session()
+    query = _task_filter_query(session, filters)
+    return query.with_entities(models.Task.uuid).limit(1).scalar()
+
+
+def get_by_uuids(model, uuids, to_dict=True):
+    """Returns the rows of the uuids by uuid, in one query per
+    IN_QUERY_BATCH uuids
+
+    A uuid without row maps to what get_by_uuid returns for it.
+    """
+    uuids = list(set(uuids))
+    session = get_session()
+    datas = {}
+    for i in range(0, len(uuids), IN_QUERY_BATCH):
+        query = session.query(model).filter(model.uuid.in_(uuids[i:i + IN_QUERY_BATCH]))
+        datas.update((d.uuid, d) for d in query.all())
+    if to_dict:
+        return {u: data_to_dict(model, datas.get(u)) for u in uuids}
+    return {u: datas.get(u) for u in uuids}
+
+
 def delete_by_uuid(model, uuid):
     session = get_session()
     with session.begin():
@@ -195,10 +336,239 @@ def task_update_percent_by_uuid(uuid, percent=0):
     return task
 
 
+def task_update_by_uuid(uuid, **values):
+    session = get_session()
+    with session.begin():
+        query = session.query(models.Task)
+        task = query.filter_by(uuid=uuid).first()
+        for k, v in values.items():
+            setattr(task, k, v)
+    return task
+
+
+def task_get_claimable(limit, agent, after_id=None):
+    """Returns the oldest queued tasks which no agent holds
+
+    :param agent: Only the tasks placed on this agent or on no agent
+    :param after_id: Only the tasks queued after the task of this id, to
+            page through the queue
+    """
+    session = get_session()
+    query = session.query(models.Task)
+    query = query.filter(models.Task.state == 'init',
+                         models.Task.lease_owner.is_(None),
+                         or_(models.Task.agent.is_(None), models.Task.agent == agent))
+    if after_id is not None:
+        query = query.filter(models.Task.id > after_id)
+    tasks = query.order_by(models.Task.id.asc()).limit(limit).all()
+    return [data_to_dict(models.Task, t) for t in tasks]
+
+
+def task_claim(uuid, owner, lease_seconds):
+    """Take the lease of a queued task
+
+    The lease is taken by a single conditional UPDATE, so only one of the
+    agents claiming the same task at the same time gets it.
+
+    :returns: True if the task is claimed by owner
+    """
+    session = get_session()
+    expires_at = timeutils.utcnow() + timedelta(seconds=lease_seconds)
+    with session.begin():
+        count = session.query(models.Task).filter(
+            models.Task.uuid == uuid,
+            models.Task.state == 'init',
+            models.Task.lease_owner.is_(None)).update(
+            {'lease_owner': owner,
+             'lease_expires_at': expires_at,
+             'attempts': func.coalesce(models.Task.attempts, 0) + 1,
+             'reason': None},
+            synchronize_session=False)
+    return count == 1
+
+
+def task_update_by_owner(uuid, owner, **values):
+    """Update a task only while owner holds its lease
+
+    :returns: True if the task is updated
+    """
+    session = get_session()
+    with session.begin():
+        count = session.query(models.Task).filter(
+            models.Task.uuid == uuid,
+            models.Task.lease_owner == owner).update(
+            values, synchronize_session=False)
+    return count == 1
+
+
+def task_renew_leases(uuids, owner, lease_seconds):
+    """Extend the leases held by owner
+
+    :returns: The uuids of the tasks whose lease owner still holds
+    """
+    if not uuids:
+        return []
+    session = get_session()
+    expires_at = timeutils.utcnow() + timedelta(seconds=lease_seconds)
+    with session.begin():
+        query = session.query(models.Task).filter(
+            models.Task.uuid.in_(uuids),
+            models.Task.lease_owner == owner)
+        count = query.update({'lease_expires_at': expires_at},
+                             synchronize_session=False)
+        if count == len(uuids):
+            return list(uuids)
+        return [t.uuid for t in query.all()]
+
+
+def task_release_lease(uuid, owner):
+    session = get_session()
+    with session.begin():
+        session.query(models.Task).filter(
+            models.Task.uuid == uuid,
+            models.Task.lease_owner == owner).update(
+            {'lease_owner': None, 'lease_expires_at': None},
+            synchronize_session=False)
+
+
+def task_expire_leases(owner):
+    """Expire at once the leases owner held before it restarted"""
+    session = get_session()
+    with session.begin():
+        return session.query(models.Task).filter(
+            models.Task.lease_owner == owner).update(
+            {'lease_expires_at': timeutils.utcnow()},
+            synchronize_session=False)
+
+
+def task_reclaim_expired(max_attempts):
+    """Requeue the unfinished tasks whose agent stopped renewing the lease
+
+    A task already claimed max_attempts times is failed instead, so a task
+    which kills its agent does not go round forever.
+
+    :returns: (requeued, failed) counts
+    """
+    session = get_session()
+    now = timeutils.utcnow()
+    attempts = func.coalesce(models.Task.attempts, 0)
+    with session.begin():
+        query = session.query(models.Task).filter(
+            models.Task.lease_owner.isnot(None),
+            models.Task.lease_expires_at < now,
+            models.Task.state.in_(['init', 'running']))
+        failed = query.filter(attempts >= max_attempts).update(
+            {'state': 'failed',
+             'reason': f'the agent was lost {max_attempts} times',
+             'lease_owner': None,
+             'lease_expires_at': None},
+            synchronize_session=False)
+        requeued = query.filter(attempts < max_attempts).update(
+            {'state': 'init',
+             'reason': 'the agent was lost, requeued',
+             'lease_owner': None,
+             'lease_expires_at': None},
+            synchronize_session=False)
+    return requeued, failed
+
+
+def task_requeue(uuid, agent=None):
+    """Queue a finished task again for a retry"""
+    return task_update_by_uuid(uuid, state='init', percent=0, reason=None, agent=agent,
+                               attempts=0, lease_owner=None, lease_expires_at=None)
+
+
+def task_unplace_lost(alive_since):
+    """Let any agent claim the queued tasks placed on a lost agent"""
+    session = get_session()
+    alive = session.query(models.Agent.host).filter(
+        models.Agent.heartbeat_at >= alive_since)
+    with session.begin():
+        return session.query(models.Task).filter(
+            models.Task.state == 'init',
+            models.Task.lease_owner.is_(None),
+            models.Task.agent.isnot(None),
+            models.Task.agent.notin_(alive.subquery())).update(
+            {'agent': None}, synchronize_session=False)
+
+
+def task_count_queued_by_agent():
+    """Returns the number of queued tasks placed on each agent"""
+    session = get_session()
+    rows = session.query(models.Task.agent, func.count(models.Task.id)).filter(
+        models.Task.state == 'init',
+        models.Task.lease_owner.is_(None),
+        models.Task.agent.isnot(None)).group_by(models.Task.agent).all()
+    return dict(rows)
+
+
+def task_sum_throughput(owner):
+    """Returns the copy throughput of the running tasks of owner"""
+    session = get_session()
+    total = session.query(func.sum(models.Task.throughput)).filter(
+        models.Task.state == 'running',
+        models.Task.lease_owner == owner).scalar()
+    return total or 0.0
+
+
+def task_avg_throughput_by_src_cloud():
+    """Returns the average copy throughput of the succeeded tasks per source"""
+    session = get_session()
+    rows = session.query(models.Task.src_cloud, func.avg(models.Task.throughput)).filter(
+        models.Task.state == 'succeed',
+        models.Task.throughput.isnot(None)).group_by(models.Task.src_cloud).all()
+    return {src_cloud: float(avg) for src_cloud, avg in rows}
+
+
+def agent_heartbeat(host, **values):
+    """Record the capacity reported by an agent"""
+    session = get_session()
+    with session.begin():
+        agent = session.query(models.Agent).filter_by(host=host).first()
+        if agent is None:
+            agent = models.Agent(uuid=uuidutils.generate_uuid(), host=host)
+            session.add(agent)
+        for k, v in values.items():
+            setattr(agent, k, v)
+        agent.heartbeat_at = timeutils.utcnow()
+    return agent
+
+
+def agent_get_all(alive_since=None):
+    """Returns the agents, only those alive since alive_since if given"""
+    session = get_session()
+    query = session.query(models.Agent)
+    if alive_since is not None:
+        query = query.filter(models.Agent.heartbeat_at >= alive_since)
+    return [data_to_dict(models.Agent, a) for a in query.order_by(models.Agent.host).all()]
+
+
+def task_get_queue():
+    """Returns the tasks held by an agent and the tasks waiting for one"""
+    session = get_session()
+    query = session.query(models.Task).filter(
+        models.Task.state.in_(['init', 'running']))
+    running, waiting = [], []
+    for t in query.order_by(models.Task.id.asc()).all():
+        if t.lease_owner is None:
+            waiting.append({'task_id': t.uuid, 'agent': t.agent, 'reason': t.reason})
+        else:
+            running.append({'task_id': t.uuid, 'state': t.state, 'agent': t.lease_owner,
+                            'attempts': t.attempts})
+    return {'running': running, 'waiting': waiting}
+
+
 def license_update_by_uuid(uuid, data):
     session = get_session()
     with session.begin():
         query = session.query(models.License)
         license = query.filter_by(uuid=uuid).first()
         license.license = data
-    return license
\ No newline at end of file
+    return license
+
+
+def license_get_latest():
+    """Returns the last registered license, None if there is none"""
+    session = get_session()
+    query = session.query(models.License)
+    return query.order_by(models.License.id.desc()).first()
@@ -0,0 +1,7 @@
+# The schema of the first release: the openstack, vmware, task and license
+# tables. The databases of that release are stamped with this version, the
+# new databases are created from the models and stamped with the last one.
+
+
+def upgrade(migrate_engine):
+    pass
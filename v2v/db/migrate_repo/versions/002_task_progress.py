@@ -0,0 +1,18 @@
+from sqlalchemy import BigInteger, Column, Float, Integer, MetaData, Table
+
+from v2v.db.migrate_repo.versions.utils import add_columns
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    task = Table('task', meta, autoload=True)
+    add_columns(migrate_engine, task, [
+        # progress of the copy of the disks
+        Column('current_disk', Integer),
+        Column('disk_count', Integer),
+        Column('disk_percent', Integer),
+        Column('copied_bytes', BigInteger),
+        Column('total_bytes', BigInteger),
+        Column('throughput', Float),
+        Column('eta', Integer),
+    ])
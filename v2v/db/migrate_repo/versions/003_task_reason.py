@@ -0,0 +1,12 @@
+from sqlalchemy import Column, MetaData, String, Table
+
+from v2v.db.migrate_repo.versions.utils import add_columns
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    task = Table('task', meta, autoload=True)
+    add_columns(migrate_engine, task, [
+        # why the task is waiting
+        Column('reason', String(255)),
+    ])
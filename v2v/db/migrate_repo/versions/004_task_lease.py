@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+from v2v.db.migrate_repo.versions.utils import add_columns
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    task = Table('task', meta, autoload=True)
+    add_columns(migrate_engine, task, [
+        # the agent converting the task and until when it holds the task
+        Column('lease_owner', String(255)),
+        Column('lease_expires_at', DateTime),
+        # how many times the task has been claimed by an agent
+        Column('attempts', Integer, default=0),
+    ])
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, inspect
+
+from v2v.db.migrate_repo.versions.utils import add_columns
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    task = Table('task', meta, autoload=True)
+    add_columns(migrate_engine, task, [
+        # the agent the task is placed on, any agent may claim it when empty
+        Column('agent', String(255)),
+    ])
+
+    if 'agent' in inspect(migrate_engine).get_table_names():
+        return
+    agent = Table(
+        'agent', meta,
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('uuid', String(36), index=True),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('host', String(255), nullable=False, unique=True),
+        Column('running', Integer),
+        Column('free_slots', Integer),
+        Column('free_disk_gb', Integer),
+        Column('free_cache_gb', Integer),
+        Column('free_memory_mb', Integer),
+        Column('throughput', Float),
+        Column('affinity', String(1024)),
+        Column('heartbeat_at', DateTime),
+    )
+    agent.create()
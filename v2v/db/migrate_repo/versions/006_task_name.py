@@ -0,0 +1,46 @@
+import json
+
+from sqlalchemy import Column, MetaData, String, Table, select
+
+from v2v.db.migrate_repo.versions.utils import add_columns, add_index
+
+BATCH = 500
+
+
+def _name(task):
+    """The destination server name, the source server name by default"""
+    for server in (task.dest_server, task.src_server):
+        try:
+            name = (json.loads(server) or {}).get('name')
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if name:
+            return name[:255]
+    return None
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    task = Table('task', meta, autoload=True)
+    add_columns(migrate_engine, task, [
+        Column('name', String(255)),
+    ])
+    add_index(migrate_engine, task, 'ix_task_name', 'name')
+
+    # Name the tasks created before, so the name filter finds them
+    last_id = 0
+    while True:
+        rows = migrate_engine.execute(
+            select([task.c.id, task.c.src_server, task.c.dest_server])
+            .where(task.c.name.is_(None))
+            .where(task.c.id > last_id)
+            .order_by(task.c.id)
+            .limit(BATCH)).fetchall()
+        if not rows:
+            break
+        with migrate_engine.begin() as conn:
+            for row in rows:
+                name = _name(row)
+                if name is not None:
+                    conn.execute(task.update().where(task.c.id == row.id).values(name=name))
+        last_id = rows[-1].id
@@ -0,0 +1,11 @@
+from sqlalchemy import MetaData, Table
+
+from v2v.db.migrate_repo.versions.utils import add_index
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    task = Table('task', meta, autoload=True)
+    add_index(migrate_engine, task, 'task_state_idx', 'state')
+    add_index(migrate_engine, task, 'task_src_cloud_state_idx', 'src_cloud', 'state')
+    add_index(migrate_engine, task, 'task_dest_cloud_state_idx', 'dest_cloud', 'state')
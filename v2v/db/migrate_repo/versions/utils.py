@@ -0,0 +1,18 @@
+# Adds Column.create to add the columns to the existing tables
+import migrate.changeset  # noqa: F401
+from sqlalchemy import Index, inspect
+
+
+def add_columns(migrate_engine, table, columns):
+    """Add the columns missing from a table"""
+    existing = {c['name'] for c in inspect(migrate_engine).get_columns(table.name)}
+    for column in columns:
+        if column.name not in existing:
+            column.create(table)
+
+
+def add_index(migrate_engine, table, name, *columns):
+    """Add an index to a table unless it already has it"""
+    existing = {i['name'] for i in inspect(migrate_engine).get_indexes(table.name)}
+    if name not in existing:
+        Index(name, *[table.c[c] for c in columns]).create(migrate_engine)
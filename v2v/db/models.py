@@ -1,7 +1,7 @@
 import uuid
 from oslo_utils import timeutils
 from oslo_db.sqlalchemy import models
-from sqlalchemy import Column, DateTime, String, Integer
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, String, Integer
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -47,13 +47,58 @@ class Task(BASE, V2VDBBase):
     """task table"""
 
     __tablename__ = 'task'
-
+    __table_args__ = (
+        Index('task_state_idx', 'state'),
+        Index('task_src_cloud_state_idx', 'src_cloud', 'state'),
+        Index('task_dest_cloud_state_idx', 'dest_cloud', 'state'),
+    )
+
+    # the name of the converted server, to search the tasks
+    name = Column(String(255), index=True)
     src_cloud = Column(String(36), nullable=False)
     src_server = Column(String(255), nullable=False)
     dest_cloud = Column(String(36), nullable=False)
     dest_server = Column(String(255), nullable=False)
     state = Column(String(36))
     percent = Column(Integer)
+    # why the task is waiting
+    reason = Column(String(255))
+    # progress of the copy of the disks
+    current_disk = Column(Integer)
+    disk_count = Column(Integer)
+    disk_percent = Column(Integer)
+    copied_bytes = Column(BigInteger)
+    total_bytes = Column(BigInteger)
+    # MB/s, the average of the whole copy once it is done
+    throughput = Column(Float)
+    # remaining seconds of the copy
+    eta = Column(Integer)
+    # the agent converting the task and until when it holds the task
+    lease_owner = Column(String(255))
+    lease_expires_at = Column(DateTime)
+    # how many times the task has been claimed by an agent
+    attempts = Column(Integer, default=0)
+    # the agent the task is placed on, any agent may claim it when empty
+    agent = Column(String(255))
+
+
+class Agent(BASE, V2VDBBase):
+    """agent table, the capacity each agent reports with its heartbeat"""
+
+    __tablename__ = 'agent'
+
+    host = Column(String(255), nullable=False, unique=True)
+    running = Column(Integer)
+    # empty when the agent does not limit the number of tasks
+    free_slots = Column(Integer)
+    free_disk_gb = Column(Integer)
+    free_cache_gb = Column(Integer)
+    free_memory_mb = Column(Integer)
+    # MB/s, the sum of the copy throughput of the running tasks
+    throughput = Column(Float)
+    # the vCenters and ESXi hosts the agent is pinned to, comma separated
+    affinity = Column(String(1024))
+    heartbeat_at = Column(DateTime)
 
 
 class License(BASE, V2VDBBase):
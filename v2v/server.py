@@ -11,6 +11,7 @@ from v2v.api.v1.tasks import ns_tasks
 from v2v.api.v1.license import ns_license
 from v2v.api.v1.volumes import ns_volumes
 from v2v.api.v1.hosts import ns_hosts
+from v2v.api.v1.agents import ns_agents
 import v2v.conf
 from v2v import config
 
@@ -31,6 +32,7 @@ def register_blueprints(app):
     api_version_1.add_namespace(ns_license, '/license')
     api_version_1.add_namespace(ns_volumes, '/volumes')
     api_version_1.add_namespace(ns_hosts, '/hosts')
+    api_version_1.add_namespace(ns_agents, '/agents')
     app.register_blueprint(bp_api, url_prefix='/v2v')
 
 
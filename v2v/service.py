@@ -35,6 +35,8 @@ class Service(service.Service):
         self.rpcserver = None
 
     def start(self):
+        self.manager.init_host()
+
         if CONF.use_rpc:
             target = messaging.Target(topic=self.topic, server=self.host)
 
@@ -0,0 +1,42 @@
+"""
+Base classes of the unit tests.
+"""
+
+from oslo_config import fixture as config_fixture
+import testtools
+
+import v2v.conf
+from v2v.db import api as db_api
+
+CONF = v2v.conf.CONF
+
+
+class TestCase(testtools.TestCase):
+    """Test case of the v2v modules, the options set by flags() are
+    restored once the test is done
+    """
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        self.conf = self.useFixture(config_fixture.Config(CONF))
+
+    def flags(self, **kw):
+        """Override the options of CONF for the test"""
+        self.conf.config(**kw)
+
+
+class DBTestCase(TestCase):
+    """Test case running on an in-memory sqlite database, created by
+    db_sync like the database of a deployment
+    """
+    # Whether setUp creates the tables
+    SYNC = True
+
+    def setUp(self):
+        super(DBTestCase, self).setUp()
+        self.flags(connection='sqlite://', group='database')
+        self.addCleanup(setattr, db_api, '_FACADE', db_api._FACADE)
+        db_api._FACADE = None
+        self.addCleanup(db_api.dispose_engine)
+        if self.SYNC:
+            db_api.db_sync()
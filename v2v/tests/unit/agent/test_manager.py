@@ -0,0 +1,261 @@
+from unittest import mock
+
+import eventlet
+import fixtures
+
+from v2v.agent import manager
+from v2v.tests import base
+
+
+class FakeVolume(object):
+
+    def __init__(self, id, status='available'):
+        self.id = id
+        self.status = status
+
+
+class FakeCinder(object):
+    """Cinder creating the volumes from the images in ``polls`` list requests"""
+
+    def __init__(self, polls=1, fail=()):
+        self.polls = polls
+        self.fail = fail
+        self.volumes = {}
+        self.creating = 0
+        self.max_creating = 0
+        self.deleted = []
+
+    def create_volume(self, size, name=None, volume_type=None, image_id=None, metadata=None):
+        self.creating += 1
+        self.max_creating = max(self.max_creating, self.creating)
+        # Yield to the other creations like a request would
+        eventlet.sleep(0)
+        self.creating -= 1
+        if image_id in self.fail:
+            raise Exception('quota exceeded')
+        vol = FakeVolume(f'vol-{name}', 'creating')
+        vol.metadata = metadata
+        vol.polls = 0
+        self.volumes[vol.id] = vol
+        return vol
+
+    def list_volumes(self, search_opts=None):
+        volumes = [v for v in self.volumes.values()
+                   if v.metadata == search_opts['metadata']]
+        for vol in volumes:
+            vol.polls += 1
+            if vol.status in ('creating', 'downloading') and vol.polls >= self.polls:
+                vol.status = 'available'
+        return volumes
+
+    def delete_volume(self, volume_id):
+        self.deleted.append(volume_id)
+        self.volumes[volume_id].status = 'deleting'
+
+
+class HandleFinishTestCase(base.TestCase):
+
+    def setUp(self):
+        super(HandleFinishTestCase, self).setUp()
+        self.useFixture(fixtures.MockPatchObject(manager.db_api, 'get_by_uuid'))
+        self.openstack = mock.Mock()
+        self.useFixture(fixtures.MockPatchObject(manager, 'OpenStack',
+                                                 return_value=self.openstack))
+        self.v2v_task = manager.V2VTask(
+            'task-1', 'src', {'name': 'src-vm'}, 'dest',
+            {'flavor': 'm1', 'network': 'net-1', 'volume_type': 'ssd'})
+        self.v2v_task.tracker = mock.Mock(image_ids={}, image_names={},
+                                          image_sizes={}, volume_ids={})
+        self.write_task = self.useFixture(
+            fixtures.MockPatchObject(self.v2v_task, 'write_task')).mock
+
+    def test_openstack_boot_from_volume(self):
+        self.flags(openstack_type='openstack')
+        self.v2v_task.tracker.volume_ids = {1: 'vol-1', 2: 'vol-2'}
+        self.v2v_task.dest_server['v4_fixed_ip'] = '10.0.0.5'
+        self.assertTrue(self.v2v_task.handle_finish({}))
+        self.openstack.nova.boot.assert_called_once_with(
+            'src-vm', None, 'm1',
+            block_device_mapping_v2=[
+                {'uuid': 'vol-1', 'source_type': 'volume', 'destination_type': 'volume',
+                 'delete_on_termination': False, 'boot_index': 0},
+                {'uuid': 'vol-2', 'source_type': 'volume', 'destination_type': 'volume',
+                 'delete_on_termination': False, 'device_name': 'vdb'}],
+            nics=[{'net-id': 'net-1', 'v4-fixed-ip': '10.0.0.5'}])
+        self.write_task.assert_has_calls([mock.call(state=manager.STATUS.SUCCEED),
+                                          mock.call(percent=100)])
+
+    def test_openstack_connection_failed(self):
+        self.openstack.session.get_token.side_effect = Exception('unauthorized')
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.assertFalse(self.openstack.nova.boot.called)
+
+    def test_boot_failed(self):
+        self.flags(openstack_type='openstack')
+        self.v2v_task.tracker.volume_ids = {1: 'vol-1'}
+        self.openstack.nova.boot.side_effect = Exception('no valid host')
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.write_task.assert_called_once_with(state=manager.STATUS.FAILED)
+
+    def _glance_images(self, count):
+        self.flags(openstack_type='glance', block_device_allocate_retries=3,
+                   block_device_allocate_retries_interval=4)
+        self.sleep = self.useFixture(fixtures.MockPatchObject(manager.time, 'sleep')).mock
+        for i in range(1, count + 1):
+            self.v2v_task.tracker.image_ids[i] = f'img-{i}'
+            self.v2v_task.tracker.image_names[i] = f'vm-sd{chr(ord("a") + i - 1)}'
+        self.openstack.glance.get_image.return_value = mock.Mock(size=10 * 1024 ** 3)
+
+    def test_glance_image_to_volumes(self):
+        self._glance_images(3)
+        self.v2v_task.tracker.image_sizes = {1: 20}
+        self.openstack.cinder = FakeCinder(polls=3)
+        self.assertTrue(self.v2v_task.handle_finish({}))
+        # The volumes are created at the same time
+        self.assertEqual(2, self.openstack.cinder.max_creating)
+        self.assertEqual(['img-2', 'img-3'],
+                         [c[0][0] for c in self.openstack.glance.get_image.call_args_list])
+        # Both volumes are polled by the same requests, 1 then 2 seconds apart
+        self.assertEqual([mock.call(1), mock.call(2)], self.sleep.call_args_list)
+        self.openstack.nova.boot.assert_called_once_with(
+            'src-vm', 'img-1', 'm1',
+            block_device_mapping_v2=[
+                {'uuid': 'vol-vm-sdb', 'source_type': 'volume', 'destination_type': 'volume',
+                 'delete_on_termination': False, 'device_name': 'vdb'},
+                {'uuid': 'vol-vm-sdc', 'source_type': 'volume', 'destination_type': 'volume',
+                 'delete_on_termination': False, 'device_name': 'vdc'}],
+            nics=[{'net-id': 'net-1'}])
+
+    def test_glance_volumes_timeout(self):
+        self._glance_images(2)
+        self.openstack.cinder = FakeCinder(polls=6)
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.assertFalse(self.openstack.nova.boot.called)
+        # 3 retries and a final check, then the volume is deleted once created
+        self.assertEqual([mock.call(1), mock.call(2), mock.call(4), mock.call(1)],
+                         self.sleep.call_args_list)
+        self.assertEqual(['vol-vm-sdb'], self.openstack.cinder.deleted)
+
+    def test_glance_volume_create_failed(self):
+        self._glance_images(3)
+        self.openstack.cinder = FakeCinder(fail=('img-3',))
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.assertFalse(self.openstack.nova.boot.called)
+        self.assertEqual(['vol-vm-sdb'], self.openstack.cinder.deleted)
+
+    def test_wait_for_volumes_without_interval(self):
+        self.flags(block_device_allocate_retries=2,
+                   block_device_allocate_retries_interval=0)
+        sleep = self.useFixture(fixtures.MockPatchObject(manager.time, 'sleep')).mock
+        cinder = self.openstack.cinder = FakeCinder(polls=3)
+        cinder.create_volume(1, name='a', metadata=self.v2v_task.volume_metadata)
+        volumes = self.v2v_task.wait_for_volumes(self.openstack, ['vol-a'])
+        self.assertEqual(['vol-a'], [v.id for v in volumes])
+        self.assertEqual([mock.call(0), mock.call(0)], sleep.call_args_list)
+
+    def test_wait_for_volumes_error(self):
+        cinder = self.openstack.cinder = FakeCinder()
+        cinder.create_volume(1, name='a', metadata=self.v2v_task.volume_metadata)
+        cinder.volumes['vol-a'].status = 'error'
+        self.assertIsNone(self.v2v_task.wait_for_volumes(self.openstack, ['vol-a']))
+
+
+class LeaseTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LeaseTestCase, self).setUp()
+        self.useFixture(fixtures.MockPatchObject(manager.db_api, 'get_by_uuid'))
+        self.db = self.useFixture(fixtures.MockPatchObject(manager, 'db_api')).mock
+        self.openstack = mock.Mock()
+        self.useFixture(fixtures.MockPatchObject(manager, 'OpenStack',
+                                                 return_value=self.openstack))
+        self.v2v_task = manager.V2VTask(
+            'task-1', 'src', {'name': 'src-vm'}, 'dest',
+            {'flavor': 'm1', 'network': 'net-1', 'volume_type': 'ssd'},
+            owner='agent-1', attempt=2)
+        self.v2v_task.tracker = mock.Mock(image_ids={1: 'img-1', 2: 'img-2'},
+                                          image_names={1: 'vm-sda', 2: 'vm-sdb'},
+                                          image_sizes={1: 20, 2: 10}, volume_ids={})
+        self.flags(openstack_type='glance', block_device_allocate_retries_interval=0)
+
+    def test_lease_lost_before_volumes(self):
+        self.db.task_renew_leases.return_value = []
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.assertTrue(self.v2v_task.lease_lost)
+        self.assertFalse(self.openstack.cinder.create_volume.called)
+        self.assertFalse(self.openstack.nova.boot.called)
+
+    def test_lease_lost_before_boot(self):
+        self.db.task_renew_leases.side_effect = [['task-1'], []]
+        cinder = self.openstack.cinder = FakeCinder()
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.assertFalse(self.openstack.nova.boot.called)
+        # The volumes of the attempt are tagged with it and deleted
+        self.assertEqual({'v2v_task': 'task-1', 'v2v_attempt': '2'},
+                         cinder.volumes['vol-vm-sdb'].metadata)
+        self.assertEqual(['vol-vm-sdb'], cinder.deleted)
+        self.assertFalse(self.db.task_update_by_owner.called)
+
+    def test_renew_failed(self):
+        self.db.task_renew_leases.side_effect = Exception('db is gone')
+        self.assertFalse(self.v2v_task.handle_finish({}))
+        self.assertFalse(self.openstack.cinder.create_volume.called)
+
+    def test_succeed_written_by_owner(self):
+        self.db.task_renew_leases.return_value = ['task-1']
+        self.db.task_update_by_owner.return_value = True
+        self.openstack.cinder = FakeCinder()
+        self.assertTrue(self.v2v_task.handle_finish({}))
+        self.assertFalse(self.v2v_task.lease_lost)
+        self.assertEqual(self.db.task_update_by_owner.call_args_list, [
+            mock.call('task-1', 'agent-1', state=manager.STATUS.SUCCEED),
+            mock.call('task-1', 'agent-1', percent=100)])
+
+    def test_write_task_after_lease_lost(self):
+        self.db.task_update_by_owner.return_value = False
+        self.v2v_task.write_task(state=manager.STATUS.SUCCEED)
+        self.assertTrue(self.v2v_task.lease_lost)
+        self.v2v_task.write_task(percent=100)
+        self.assertEqual(1, self.db.task_update_by_owner.call_count)
+        self.assertFalse(self.db.task_update_by_uuid.called)
+
+
+class DispatchTestCase(base.TestCase):
+
+    def setUp(self):
+        super(DispatchTestCase, self).setUp()
+        self.flags(task_claim_batch=2)
+        self.db = self.useFixture(fixtures.MockPatchObject(manager, 'db_api')).mock
+        self.manager = manager.V2VTaskManager(host='agent-1')
+        self.manager._scheduler = mock.Mock()
+        self.manager._scheduler.full.return_value = False
+
+    def test_claimable_pages(self):
+        self.db.task_get_claimable.side_effect = [
+            [{'id': 1}, {'id': 2}], [{'id': 3}, {'id': 4}], [{'id': 5}]]
+        self.assertEqual([1, 2, 3, 4, 5], [t['id'] for t in self.manager._claimable()])
+        self.db.task_get_claimable.assert_has_calls([
+            mock.call(2, 'agent-1', after_id=None), mock.call(2, 'agent-1', after_id=2),
+            mock.call(2, 'agent-1', after_id=4)])
+
+    def test_claimable_stops_once_full(self):
+        self.db.task_get_claimable.return_value = [{'id': 1}, {'id': 2}]
+        claimable = self.manager._claimable()
+        self.assertEqual(1, next(claimable)['id'])
+        self.manager._scheduler.full.return_value = True
+        self.assertEqual([], list(claimable))
+        self.assertEqual(1, self.db.task_get_claimable.call_count)
+
+    def test_dispatch_full_agent(self):
+        self.manager._scheduler.full.return_value = True
+        self.assertEqual(0, self.manager.dispatch())
+        self.assertFalse(self.db.task_get_claimable.called)
+
+    def test_report(self):
+        self.flags(agent_affinity=['vcenter:192.168.5.10'])
+        self.manager._scheduler.capacity.return_value = {'running': 1, 'free_slots': 3}
+        self.db.task_sum_throughput.return_value = 50.0
+        self.manager.report()
+        self.db.agent_heartbeat.assert_called_once_with(
+            'agent-1', throughput=50.0, affinity='vcenter:192.168.5.10',
+            running=1, free_slots=3)
@@ -0,0 +1,145 @@
+import os
+from unittest import mock
+
+import fixtures
+
+from v2v.agent import progress
+from v2v.common.units import GiB, MiB
+from v2v.tests import base
+
+MARKERS = (('Opening the source', 5),
+           ('Copying disk', 30),
+           ('Finishing off', 95))
+
+
+class V2VLogTrackerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(V2VLogTrackerTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'v2v.log')
+        self.now = 0
+        self.useFixture(fixtures.MockPatchObject(progress, 'monotonic_time',
+                                                 lambda: self.now))
+        self.tracker = progress.V2VLogTracker(self.path, MARKERS, log=mock.Mock())
+        self.addCleanup(self.tracker.close)
+
+    def _write(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def test_poll_missing_log(self):
+        self.assertEqual(0, self.tracker.poll())
+
+    def test_poll_markers(self):
+        self._write(b'[   1.0] Opening the source\n')
+        self.assertEqual(5, self.tracker.poll())
+        self._write(b'[  90.0] Finishing off\n[  91.0] Opening the source\n')
+        self.assertEqual(95, self.tracker.poll())
+
+    def test_poll_partial_line(self):
+        self._write(b'[   1.0] Opening the sou')
+        self.assertEqual(0, self.tracker.poll())
+        self._write(b'rce\n')
+        self.assertEqual(5, self.tracker.poll())
+
+    def test_poll_reads_appended_bytes_only(self):
+        self._write(b'[   1.0] Opening the source\n')
+        self.tracker.poll()
+        self._write(b'[   2.0] Inspecting the source\n')
+        with mock.patch.object(self.tracker, '_parse') as parse:
+            self.tracker.poll()
+        parse.assert_called_once_with(b'[   2.0] Inspecting the source\n')
+
+    def test_finish_parses_last_line(self):
+        self._write(b'[  90.0] Finishing off')
+        self.assertEqual(0, self.tracker.poll())
+        self.assertEqual(95, self.tracker.finish())
+
+    def test_poll_progress_bar(self):
+        self._write(b'[  20.0] Copying disk 1/1\n    (10.00/100%)\r    (20.00/100%)\r')
+        self.assertEqual(30, self.tracker.poll())
+
+    def test_poll_over_long_line(self):
+        self.useFixture(fixtures.MockPatchObject(progress, 'MAX_PARTIAL_LINE', 32))
+        self.useFixture(fixtures.MockPatchObject(progress, 'READ_CHUNK_SIZE', 16))
+        # The marker at the head of the line is kept, the rest is dropped
+        self._write(b'[  90.0] Finishing off ' + b'x' * 100)
+        self.assertEqual(0, self.tracker.poll())
+        self._write(b'x' * 100 + b' Opening the source\n[   2.0] Copying disk 1/1\n')
+        self.assertEqual(95, self.tracker.poll())
+        self.assertEqual(b'', self.tracker._partial)
+
+    def test_openstack_ids(self):
+        self._write(
+            b'| id               | 0b9a8f0e-5d0c-4bb6-9f3c-5c3b7e3d3b43 |\n'
+            b'| name             | test-sda |\n'
+            b'| size             | 21474836480 |\n'
+            b'openstack --os-volume-api-version 3 volume show -f json '
+            b'5c3b7e3d-0b9a-4bb6-9f3c-8f0e5d0c3b43\n')
+        self.tracker.finish()
+        self.assertEqual({1: '0b9a8f0e-5d0c-4bb6-9f3c-5c3b7e3d3b43'},
+                         self.tracker.image_ids)
+        self.assertEqual('test-sda', self.tracker.image_names[1].strip())
+        self.assertEqual({1: 20}, self.tracker.image_sizes)
+        self.assertEqual({1: '5c3b7e3d-0b9a-4bb6-9f3c-8f0e5d0c3b43'},
+                         self.tracker.volume_ids)
+
+    def test_copy_stats(self):
+        self._write(b'ov_virtual_size = 10737418240 (10.00G)\n'
+                    b'ov_virtual_size = 10737418240 (10.00G)\n'
+                    b'[  10.0] Copying disk 1/2 to /var/tmp/v2v-sda (raw)\n'
+                    b'    (50.00/100%)\r')
+        self.tracker.poll()
+        self.assertEqual({
+            'current_disk': 1,
+            'disk_count': 2,
+            'disk_percent': 50,
+            'copied_bytes': 5 * GiB,
+            'total_bytes': 20 * GiB,
+            'throughput': None,
+            'eta': None,
+        }, self.tracker.copy_stats())
+
+        self.now = 10
+        self._write(b'    (100.00/100%)\n'
+                    b'[  20.0] Copying disk 2/2 to /var/tmp/v2v-sdb (raw)\n'
+                    b'    (50.00/100%)\r')
+        self.tracker.poll()
+        # A half of the copy in 10 seconds
+        self.assertEqual({
+            'current_disk': 2,
+            'disk_count': 2,
+            'disk_percent': 50,
+            'copied_bytes': 15 * GiB,
+            'total_bytes': 20 * GiB,
+            'throughput': 20 * GiB / 20 / MiB,
+            'eta': 5,
+        }, self.tracker.copy_stats())
+
+        self.now = 30
+        self._write(b'    (100.00/100%)\n')
+        self.tracker.poll()
+        self.assertFalse(self.tracker.copying)
+        stats = self.tracker.copy_stats()
+        self.assertEqual(20 * GiB, stats['copied_bytes'])
+        self.assertEqual(round(20 * GiB / 30 / MiB, 2), stats['throughput'])
+        self.assertEqual(0, stats['eta'])
+
+    def test_copy_fraction_without_sizes(self):
+        self._write(b'[  10.0] Copying disk 2/4 to /var/tmp/v2v-sdb (raw)\n'
+                    b'    (50.00/100%)\r')
+        self.tracker.poll()
+        self.assertEqual(0.375, self.tracker.copy_fraction)
+        self.assertIsNone(self.tracker.total_bytes)
+        self.assertIsNone(self.tracker.throughput)
+
+    def test_copying_disk_in_trace(self):
+        self._write(b'+ echo Copying disk\n')
+        self.tracker.poll()
+        self.assertEqual(0, self.tracker.disk_count)
+        self.assertFalse(self.tracker.copying)
+
+    def test_format_size(self):
+        self.assertEqual(20, progress.V2VLogTracker.format_size(20 * GiB))
+        self.assertEqual(1, progress.V2VLogTracker.format_size(1))
+        self.assertEqual(0, progress.V2VLogTracker.format_size('20'))
@@ -0,0 +1,179 @@
+import os
+
+import fixtures
+
+from v2v.agent import scheduler
+from v2v.common.sources import source_keys
+from v2v.common.units import GiB, KiB, MiB
+from v2v.tests import base
+
+
+class EstimateFootprintTestCase(base.TestCase):
+
+    def setUp(self):
+        super(EstimateFootprintTestCase, self).setUp()
+        self.flags(task_cache_gb=2, task_memory_mb=2048, task_cpus=1,
+                   task_bandwidth_mbps=100, default_task_disk_gb=100)
+
+    def test_openstack(self):
+        self.flags(openstack_type='openstack')
+        self.assertEqual(scheduler.Footprint(disk=0, cache=2 * GiB, memory=2048 * MiB,
+                                             cpu=1, bandwidth=100),
+                         scheduler.estimate_footprint({'diskGB': 40}))
+
+    def test_local(self):
+        self.flags(openstack_type='local')
+        fp = scheduler.estimate_footprint({'diskGB': '40'})
+        self.assertEqual(40 * GiB, fp.disk)
+        self.assertEqual(2 * GiB, fp.cache)
+
+    def test_glance(self):
+        self.flags(openstack_type='glance')
+        fp = scheduler.estimate_footprint({'diskGB': 40})
+        self.assertEqual(0, fp.disk)
+        self.assertEqual(42 * GiB, fp.cache)
+
+    def test_default_disk_size(self):
+        self.flags(openstack_type='local')
+        self.assertEqual(100 * GiB, scheduler.estimate_footprint({}).disk)
+        self.assertEqual(100 * GiB, scheduler.estimate_footprint({'diskGB': 'n/a'}).disk)
+
+
+class AdmissionSchedulerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(AdmissionSchedulerTestCase, self).setUp()
+        self.flags(max_concurrent_tasks=10, reserved_disk_gb=10,
+                   reserved_host_memory_mb=1024, agent_bandwidth_mbps=0,
+                   max_concurrent_tasks_per_vcenter=0,
+                   max_concurrent_tasks_per_host=0,
+                   source_concurrency_limits=[])
+        self.free = {'/work': 500 * GiB, '/cache': 100 * GiB}
+        self.meminfo = {'MemTotal': 16 * GiB // KiB, 'MemFree': 1 * GiB // KiB,
+                        'MemAvailable': 12 * GiB // KiB}
+        self.useFixture(fixtures.MockPatch('os.statvfs', self._statvfs))
+        self.useFixture(fixtures.MockPatch('os.cpu_count', return_value=8))
+        self.useFixture(fixtures.MockPatchObject(scheduler.utils, 'readMemInfo',
+                                                 lambda: self.meminfo))
+        self.scheduler = scheduler.AdmissionScheduler('/work', '/cache')
+        self.seq = 0
+
+    def _statvfs(self, path):
+        if path not in self.free:
+            raise OSError(2, 'No such file or directory', path)
+        return os.statvfs_result((4096, 1, 0, 0, self.free[path], 0, 0, 0, 0, 255))
+
+    def _ticket(self, disk=0, cache=0, memory=0, cpu=0, bandwidth=0, sources=()):
+        self.seq += 1
+        fp = scheduler.Footprint(disk=disk, cache=cache, memory=memory, cpu=cpu,
+                                 bandwidth=bandwidth)
+        return scheduler.Ticket(f'task-{self.seq}', fp, sources)
+
+    def _admit(self, ticket):
+        self.assertIsNone(self.scheduler.try_admit(ticket))
+        return ticket
+
+    def test_idle_agent_admits_any_task(self):
+        ticket = self._ticket(disk=10000 * GiB, memory=1000 * GiB, cpu=100)
+        self._admit(ticket)
+        self.assertEqual([ticket.task_id], self.scheduler.running())
+
+    def test_max_concurrent_tasks(self):
+        self.flags(max_concurrent_tasks=2)
+        self._admit(self._ticket())
+        self.assertFalse(self.scheduler.full())
+        self._admit(self._ticket())
+        self.assertTrue(self.scheduler.full())
+        ticket = self._ticket()
+        reason = self.scheduler.try_admit(ticket)
+        self.assertIn('free slot', reason)
+        self.assertEqual(reason, ticket.reason)
+
+    def test_release(self):
+        self.flags(max_concurrent_tasks=1)
+        first = self._admit(self._ticket())
+        self.assertIsNotNone(self.scheduler.try_admit(self._ticket()))
+        self.scheduler.release(first)
+        self.scheduler.release(first)
+        ticket = self._admit(self._ticket())
+        self.assertIsNone(ticket.reason)
+        self.assertEqual([ticket.task_id], self.scheduler.running())
+
+    def test_work_dir_space(self):
+        # 500GB free, 10GB reserved
+        self._admit(self._ticket(disk=300 * GiB))
+        self.assertIn('free space in /work',
+                      self.scheduler.try_admit(self._ticket(disk=200 * GiB)))
+        self._admit(self._ticket(disk=190 * GiB))
+
+    def test_cache_dir_space(self):
+        self._admit(self._ticket(cache=50 * GiB))
+        self.assertIn('free space in /cache',
+                      self.scheduler.try_admit(self._ticket(cache=50 * GiB)))
+        self._admit(self._ticket(cache=40 * GiB))
+
+    def test_unknown_free_space(self):
+        self.scheduler = scheduler.AdmissionScheduler('/missing', '/cache')
+        self._admit(self._ticket(disk=1000 * GiB))
+        self._admit(self._ticket(disk=1000 * GiB))
+
+    def test_memory(self):
+        # 16GB, 1GB reserved for the host
+        self._admit(self._ticket(memory=8 * GiB))
+        self.assertIn('memory', self.scheduler.try_admit(self._ticket(memory=8 * GiB)))
+        self._admit(self._ticket(memory=7 * GiB))
+
+    def test_available_memory(self):
+        self.meminfo['MemAvailable'] = 2 * GiB // KiB
+        self._admit(self._ticket(memory=1 * GiB))
+        self.assertIn('memory', self.scheduler.try_admit(self._ticket(memory=4 * GiB)))
+
+    def test_cpus(self):
+        self._admit(self._ticket(cpu=6))
+        self.assertIn('cpus', self.scheduler.try_admit(self._ticket(cpu=3)))
+        self._admit(self._ticket(cpu=2))
+
+    def test_bandwidth(self):
+        self.flags(agent_bandwidth_mbps=1000)
+        self._admit(self._ticket(bandwidth=600))
+        self.assertIn('bandwidth', self.scheduler.try_admit(self._ticket(bandwidth=600)))
+        self._admit(self._ticket(bandwidth=400))
+
+    def test_unlimited_bandwidth(self):
+        self._admit(self._ticket(bandwidth=600))
+        self._admit(self._ticket(bandwidth=600))
+
+    def test_source_limits(self):
+        self.flags(max_concurrent_tasks_per_vcenter=3, max_concurrent_tasks_per_host=1)
+        host1 = source_keys({'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.1'})
+        host2 = source_keys({'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.2/'})
+        self._admit(self._ticket(sources=host1))
+        self.assertIn('host 192.168.5.10/10.0.0.1',
+                      self.scheduler.try_admit(self._ticket(sources=host1)))
+        # A busy host does not hold back the other hosts
+        self._admit(self._ticket(sources=host2))
+        host3 = source_keys({'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.3'})
+        self._admit(self._ticket(sources=host3))
+        host4 = source_keys({'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.4'})
+        self.assertIn('vcenter 192.168.5.10', self.scheduler.try_admit(self._ticket(sources=host4)))
+
+    def test_same_host_name_of_other_vcenters(self):
+        self.flags(max_concurrent_tasks_per_host=1)
+        self._admit(self._ticket(sources=source_keys(
+            {'ip': '192.168.5.10', 'uri': 'dc/cluster/esxi-1'})))
+        self._admit(self._ticket(sources=source_keys(
+            {'ip': '192.168.5.11', 'uri': 'dc/cluster/esxi-1'})))
+
+    def test_source_concurrency_limits(self):
+        self.flags(max_concurrent_tasks_per_host=1, max_concurrent_tasks_per_vcenter=1,
+                   source_concurrency_limits=['host:192.168.5.10/10.0.0.1:2',
+                                              'vcenter:192.168.5.10:3',
+                                              'invalid'])
+        host1 = source_keys({'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.1'})
+        self._admit(self._ticket(sources=host1))
+        self._admit(self._ticket(sources=host1))
+        self.assertIn('host', self.scheduler.try_admit(self._ticket(sources=host1)))
+        host2 = source_keys({'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.2'})
+        self._admit(self._ticket(sources=host2))
+        self.assertIn('vcenter', self.scheduler.try_admit(self._ticket(sources=host2)))
+
@@ -0,0 +1,405 @@
+from unittest import mock
+
+import fixtures
+
+from v2v.api.v1 import api
+from v2v.cloud import catalog
+from v2v.tests import base
+
+
+class PlaceTaskTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PlaceTaskTestCase, self).setUp()
+        self.db = self.useFixture(fixtures.MockPatchObject(api, 'db_api')).mock
+        cloud = {'ip': '192.168.5.10', 'uri': 'dc/cluster/10.0.0.1'}
+        self.db.get_by_uuids.side_effect = lambda model, uuids: {u: cloud for u in uuids}
+        self.db.task_count_queued_by_agent.return_value = {}
+        self.api = api.API()
+
+    def _agents(self, *agents):
+        self.db.agent_get_all.return_value = [
+            dict({'affinity': '', 'free_slots': 1, 'free_disk_gb': 100, 'throughput': 0},
+                 host=host, **values)
+            for host, values in agents]
+
+    def test_no_agent(self):
+        self._agents()
+        self.assertIsNone(self.api._place_task('src'))
+
+    def test_most_free_slots(self):
+        self._agents(('agent-1', {'free_slots': 2}), ('agent-2', {'free_slots': 3}),
+                     ('agent-3', {'free_slots': None}))
+        self.db.task_count_queued_by_agent.return_value = {'agent-2': 2}
+        # An agent without a slot limit has unlimited free slots
+        self.assertEqual('agent-3', self.api._place_task('src'))
+        self.db.agent_get_all.return_value.pop()
+        self.assertEqual('agent-1', self.api._place_task('src'))
+
+    def test_affinity(self):
+        self._agents(('agent-1', {'free_slots': 5}),
+                     ('agent-2', {'affinity': 'host:192.168.5.10/10.0.0.1'}),
+                     ('agent-3', {'affinity': 'vcenter:192.168.5.11,host:10.0.0.1'}))
+        self.assertEqual('agent-2', self.api._place_task('src'))
+        self.db.agent_get_all.return_value[1]['affinity'] = 'vcenter:192.168.5.10'
+        self.assertEqual('agent-2', self.api._place_task('src'))
+        # Only the names of the sources match
+        self.db.agent_get_all.return_value[1]['affinity'] = '192.168.5.10'
+        self.assertEqual('agent-1', self.api._place_task('src'))
+
+    def test_placements_count_as_queued(self):
+        self._agents(('agent-1', {'free_slots': 2}), ('agent-2', {'free_slots': 1}))
+        place = self.api._placer(['src'])
+        self.assertEqual(['agent-1', 'agent-1', 'agent-2'],
+                         [place('src'), place('src'), place('src')])
+        self.db.get_by_uuids.assert_called_once_with(api.VMware, ['src'])
+
+    def test_async_task(self):
+        with mock.patch.object(api.rpc, 'get_client') as get_client:
+            self.api.async_task('task-1', 'agent-1')
+            get_client.return_value.prepare.assert_called_once_with(
+                namespace='v2v', server='agent-1', version='1.0')
+            get_client.reset_mock()
+            self.api.async_task('task-1')
+            get_client.return_value.prepare.assert_called_once_with(
+                namespace='v2v', fanout=True, version='1.0')
+
+
+def _server(name, template=False):
+    return {'name': name, 'config.template': template, 'config.hardware.memoryMB': 2048,
+            'summary.storage.committed': 2 * 1024 ** 3, 'summary.config.numVirtualDisks': 1}
+
+
+class ListServersTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ListServersTestCase, self).setUp()
+        self.flags(inventory_sync=True)
+        self.db = self.useFixture(fixtures.MockPatchObject(api, 'db_api')).mock
+        self.db.get_by_uuid.return_value = {'uuid': 'c1', 'ip': '192.168.5.10'}
+        self.inventory = self.useFixture(fixtures.MockPatchObject(
+            api.inventory, 'list_servers')).mock
+        self.inventory.return_value = api.inventory.Inventory(
+            [_server('a'), _server('t', template=True), _server('b'), _server('c')],
+            synced_at='now')
+        self.api = api.API()
+
+    def _names(self, servers):
+        return [s['name'] for s in servers]
+
+    def test_all(self):
+        servers = self.api.list_servers('c1')
+        self.assertEqual(['a', 'b', 'c'], self._names(servers))
+        self.assertEqual('now', servers.synced_at)
+        self.assertIsNone(servers.next_offset)
+        self.assertEqual('2.0', servers[0]['memoryGB'])
+        self.assertEqual('2.00', servers[0]['diskGB'])
+
+    def test_page(self):
+        servers = self.api.list_servers('c1', limit=2)
+        self.assertEqual(['a', 'b'], self._names(servers))
+        self.assertEqual(2, servers.next_offset)
+        servers = self.api.list_servers('c1', limit=2, offset=2)
+        self.assertEqual(['c'], self._names(servers))
+        self.assertIsNone(servers.next_offset)
+
+    def test_direct_listing_stops_reading(self):
+        self.inventory.return_value = None
+        read = []
+
+        def _servers():
+            for server in [_server('a'), _server('b'), _server('c')]:
+                read.append(server['name'])
+                yield server
+
+        with mock.patch.object(self.api, '_list_servers_on_exsi',
+                               side_effect=lambda *a, select, **kw: select(_servers())):
+            servers = self.api.list_servers('c1', limit=1, offset=1)
+        self.assertEqual(['b'], self._names(servers))
+        self.assertEqual(['a', 'b', 'c'], read)
+        self.assertEqual(2, servers.next_offset)
+
+    def test_fields(self):
+        servers = self.api.list_servers('c1', fields=['name', 'diskGB'])
+        self.assertEqual([{'name': 'a', 'diskGB': '2.00'}, {'name': 'b', 'diskGB': '2.00'},
+                          {'name': 'c', 'diskGB': '2.00'}], list(servers))
+
+    def test_missing_sizes(self):
+        # An inaccessible virtual machine reports neither memory nor storage
+        self.inventory.return_value = api.inventory.Inventory([{'name': 'a'}])
+        servers = self.api.list_servers('c1')
+        self.assertEqual(1, len(servers))
+        self.assertIsNone(servers[0]['memoryGB'])
+        self.assertIsNone(servers[0]['diskGB'])
+        self.assertIsNone(servers[0]['diskNum'])
+
+    def test_server_properties(self):
+        self.assertEqual(['name', 'config.template', 'summary.storage.committed'],
+                         api.server_properties(['name', 'diskGB', 'driver']))
+        properties = api.server_properties(api.SERVER_FIELDS)
+        self.assertEqual(sorted(api.VM_PROPERTIES), sorted(properties))
+        self.assertNotIn('config.hardware.device', properties)
+
+
+class ListServersInScopeTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ListServersInScopeTestCase, self).setUp()
+        self.cloud = {'ip': '192.168.5.10', 'user': 'root', 'password': 'pwd',
+                      'uri': 'dc/folder/cluster-1/10.0.0.1'}
+        self.vs = mock.Mock()
+        self.vs.split_uri = api.vSphere.split_uri
+        # parent is an argument of Mock itself
+        self.datacenter = mock.Mock(spec=api.vim.Datacenter)
+        self.datacenter.parent = None
+        folder = mock.Mock(spec=api.vim.Folder)
+        folder.parent = self.datacenter
+        self.cluster = mock.Mock(spec=api.vim.ClusterComputeResource)
+        self.cluster.parent = folder
+        host = mock.Mock()
+        host.parent = self.cluster
+        self.vs.find_host.return_value = (host, None)
+        self.vs.list_hosts.return_value = [
+            {'moid': 'host-2', 'name': '10.0.0.2', 'cluster': 'cluster-1'},
+            {'moid': 'host-1', 'name': '10.0.0.1', 'cluster': 'cluster-1'}]
+        self.vs.iter_host_vms.side_effect = lambda host, properties: iter(
+            [[{'name': f'{host}-b'}, {'name': f'{host}-a'}]])
+        self.vs.get_host.side_effect = lambda moid: moid
+        vsphere = self.useFixture(fixtures.MockPatchObject(api, 'vSphere')).mock
+        vsphere.return_value.__enter__.return_value = self.vs
+        self.api = api.API()
+
+    def test_cluster(self):
+        servers = self.api._list_servers_in_scope(self.cloud, 'cluster', ['name'])
+        self.vs.list_hosts.assert_called_once_with(self.cluster)
+        self.assertEqual(['host-1-a', 'host-1-b', 'host-2-a', 'host-2-b'],
+                         [s['name'] for s in servers])
+        self.assertEqual(('10.0.0.1', 'cluster-1'), (servers[0]['esxi'], servers[0]['cluster']))
+
+    def test_datacenter_through_folders(self):
+        self.api._list_servers_in_scope(self.cloud, 'datacenter', ['name'])
+        self.vs.list_hosts.assert_called_once_with(self.datacenter)
+
+    def test_no_datacenter(self):
+        self.datacenter.mock_add_spec(api.vim.Folder)
+        result = self.api._list_servers_in_scope(self.cloud, 'datacenter', ['name'])
+        self.assertIn('msg', result)
+        self.vs.list_hosts.assert_not_called()
+
+    def test_no_session(self):
+        self.vs.iter_host_vms.side_effect = Exception('no free session')
+        result = self.api._list_servers_in_scope(self.cloud, 'cluster', ['name'])
+        self.assertEqual({'msg': 'no free session'}, result)
+
+
+class AvailableIpsTestCase(base.TestCase):
+
+    def setUp(self):
+        super(AvailableIpsTestCase, self).setUp()
+        self.subnet = {'id': 's1', 'allocation_pools': [{'start': '10.0.0.2', 'end': '10.0.0.6'}]}
+
+    def test_availability(self):
+        api.API._get_available_ips(self.subnet, {'subnet_id': 's1', 'total_ips': 5, 'used_ips': 2,
+                                                 'used_ip_addresses': ['10.0.0.2', '10.0.0.4']},
+                                   limit=2)
+        self.assertEqual(['10.0.0.3', '10.0.0.5'], self.subnet['available_ips'])
+        self.assertEqual(5, self.subnet['pool_len'])
+        self.assertEqual(3, self.subnet['available_len'])
+
+    def test_no_availability(self):
+        api.API._get_available_ips(self.subnet, None)
+        self.assertEqual(5, len(self.subnet['available_ips']))
+        self.assertEqual(5, self.subnet['pool_len'])
+        # The used addresses are unknown, none is counted as available
+        self.assertEqual(0, self.subnet['available_len'])
+
+
+class ListNetworksTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ListNetworksTestCase, self).setUp()
+        self.useFixture(fixtures.MockPatchObject(api, 'CATALOGS', catalog.CatalogCache()))
+        self.useFixture(fixtures.MockPatchObject(api, 'db_api'))
+        self.neutron = self.useFixture(fixtures.MockPatchObject(
+            api, 'get_openstack')).mock.return_value.neutron
+        self.neutron.net_list.return_value = {'networks': [
+            {'id': 'net-1', 'subnets': ['s1']}, {'id': 'net-2', 'subnets': []}]}
+        self.neutron.subnet_list.return_value = {'subnets': [
+            {'id': 's1', 'allocation_pools': [{'start': '10.0.0.2', 'end': '10.0.0.3'}]}]}
+        self.neutron.show_network_ip_availability.return_value = {'network_ip_availability': {
+            'subnet_ip_availability': [{'subnet_id': 's1', 'total_ips': 2, 'used_ips': 1,
+                                        'used_ip_addresses': ['10.0.0.2']}]}}
+        self.api = api.API()
+
+    def test_list(self):
+        networks = self.api.list_networks('c1')
+        self.assertEqual(['net-1', 'net-2'], [n['id'] for n in networks])
+        subnet = networks[0]['subnets'][0]
+        self.assertEqual((['10.0.0.3'], 1), (subnet['available_ips'], subnet['available_len']))
+        # The network without subnets needs no availability
+        self.neutron.show_network_ip_availability.assert_called_once_with('net-1')
+
+    def test_filtered_from_the_catalog(self):
+        self.api.list_networks('c1')
+        networks = self.api.list_networks('c1', network_id='net-2')
+        self.assertEqual(['net-2'], [n['id'] for n in networks])
+        self.assertEqual(1, self.neutron.net_list.call_count)
+
+    def test_filtered_by_neutron(self):
+        self.neutron.net_list.return_value = {'networks': [{'id': 'net-1', 'subnets': ['s1']}]}
+        networks = self.api.list_networks('c1', network_id='net-1')
+        self.assertEqual(['net-1'], [n['id'] for n in networks])
+        self.neutron.net_list.assert_called_once_with(id='net-1')
+        self.neutron.subnet_list.assert_called_once_with(network_id='net-1')
+
+
+class TaskDetailsTestCase(base.TestCase):
+
+    def test_task_name(self):
+        self.assertEqual('web-2', api.API._task_name({'src_server': {'name': 'web'},
+                                                      'dest_server': {'name': 'web-2'}}))
+        self.assertEqual('web', api.API._task_name({'src_server': {'name': 'web'},
+                                                    'dest_server': {}}))
+        self.assertIsNone(api.API._task_name({'src_server': {}, 'dest_server': None}))
+
+    def test_clouds_fetched_once(self):
+        db = self.useFixture(fixtures.MockPatchObject(api, 'db_api')).mock
+        db.get_by_uuids.side_effect = lambda model, uuids: {u: {'uuid': u} for u in uuids}
+        tasks = [{'src_cloud': 'vc', 'dest_cloud': 'os', 'src_server': '{"name": "web"}',
+                  'dest_server': '{}'} for _ in range(3)]
+        tasks = api.API()._task_details(tasks)
+        self.assertEqual(2, db.get_by_uuids.call_count)
+        db.get_by_uuid.assert_not_called()
+        self.assertEqual(({'uuid': 'vc'}, {'uuid': 'os'}, 'web'),
+                         (tasks[0]['src_cloud'], tasks[0]['dest_cloud'],
+                          tasks[0]['dest_server']['name']))
+        # The tasks do not share the clouds
+        self.assertIsNot(tasks[0]['src_cloud'], tasks[1]['src_cloud'])
+
+
+class DeleteCloudTestCase(base.TestCase):
+
+    def setUp(self):
+        super(DeleteCloudTestCase, self).setUp()
+        self.db = self.useFixture(fixtures.MockPatchObject(api, 'db_api')).mock
+        self.useFixture(fixtures.MockPatchObject(api, 'inventory'))
+
+    def test_cloud_with_tasks(self):
+        self.db.task_exists_by_filter.return_value = 't1'
+        self.assertRaisesRegex(Exception, 'task=t1', api.API().delete_vmware_by_uuid, 'vc')
+        self.db.task_exists_by_filter.assert_called_once_with({'src_cloud': 'vc'})
+        self.db.delete_by_uuid.assert_not_called()
+
+    def test_cloud_without_tasks(self):
+        self.db.task_exists_by_filter.return_value = None
+        api.API().delete_vmware_by_uuid('vc')
+        self.db.delete_by_uuid.assert_called_once_with(api.VMware, 'vc')
+
+
+class CheckServerNumbersTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CheckServerNumbersTestCase, self).setUp()
+        self.db = self.useFixture(fixtures.MockPatchObject(api, 'db_api')).mock
+        self.decrypt = self.useFixture(fixtures.MockPatchObject(api, 'decrypt')).mock
+        self.decrypt.return_value = ('{"uuid": "serial", "server": "3", '
+                                     '"expired_at": "-1"}')
+        self.useFixture(fixtures.MockPatchObject(api, '_LICENSE', {}))
+        self.useFixture(fixtures.MockPatchObject(api.utils, 'get_host_uuid',
+                                                 return_value='serial'))
+        self.create = api.check_server_numbers(lambda: 'created')
+
+    def test_without_license(self):
+        self.flags(allowed_server_number=2)
+        self.db.license_get_latest.return_value = None
+        self.db.task_count_by_filter.return_value = 1
+        self.assertEqual('created', self.create())
+        self.db.task_count_by_filter.return_value = 2
+        self.assertRaisesRegex(Exception, 'maximum quantity', self.create)
+        self.decrypt.assert_not_called()
+
+    def test_license_decrypted_once(self):
+        self.db.license_get_latest.return_value = mock.Mock(license='data')
+        self.db.task_count_by_filter.return_value = 2
+        self.assertEqual('created', self.create())
+        self.assertEqual('created', self.create())
+        self.decrypt.assert_called_once_with('data')
+        self.db.task_count_by_filter.return_value = 3
+        self.assertRaisesRegex(Exception, 'license limit', self.create)
+
+    def test_license_changed(self):
+        self.db.license_get_latest.return_value = mock.Mock(license='data')
+        self.db.task_count_by_filter.return_value = 0
+        self.create()
+        self.db.license_get_latest.return_value = mock.Mock(license='other')
+        self.decrypt.return_value = '{"uuid": "other", "server": "3", "expired_at": "-1"}'
+        self.assertRaisesRegex(Exception, 'illegal', self.create)
+        self.assertEqual(2, self.decrypt.call_count)
+
+
+def _task(name, src_cloud='vc'):
+    return {'src_cloud': src_cloud, 'src_server': {'name': name}, 'dest_cloud': 'os',
+            'dest_server': {'name': name, 'network': 'net-1', 'flavor': 'f1',
+                            'volume_type': 'hdd'}}
+
+
+class CreateTasksTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CreateTasksTestCase, self).setUp()
+        self.db = self.useFixture(fixtures.MockPatchObject(api, 'db_api')).mock
+        self.capacity = self.useFixture(fixtures.MockPatchObject(api, 'license_capacity')).mock
+        self.capacity.return_value = (10, 'Exceeded the maximum license limit')
+        self.api = api.API()
+        self.placer = self.useFixture(fixtures.MockPatchObject(self.api, '_placer')).mock
+        self.placer.return_value = lambda src_cloud: {'vc': 'agent-1', 'vc2': 'agent-2'}[src_cloud]
+        self.async_task = self.useFixture(fixtures.MockPatchObject(self.api, 'async_task')).mock
+
+    def _created(self):
+        (objs,), _ = self.db.create_all.call_args
+        return objs
+
+    def test_create_tasks(self):
+        results = self.api.create_tasks([_task('web'), _task('db'), _task('app', 'vc2')])
+        objs = self._created()
+        self.assertEqual([{'task_id': o.uuid} for o in objs], results)
+        self.assertEqual((['web', 'db', 'app'], ['agent-1', 'agent-1', 'agent-2']),
+                         ([o.name for o in objs], [o.agent for o in objs]))
+        self.assertEqual(('init', 0, '{"name": "web"}'),
+                         (objs[0].state, objs[0].percent, objs[0].src_server))
+        self.placer.assert_called_once_with(['vc', 'vc', 'vc2'])
+        # Each agent is woken up once
+        self.assertEqual([mock.call(objs[1].uuid, 'agent-1'), mock.call(objs[2].uuid, 'agent-2')],
+                         self.async_task.call_args_list)
+
+    def test_invalid_tasks(self):
+        invalid = _task('db')
+        del invalid['dest_cloud']
+        results = self.api.create_tasks([_task('web'), invalid, dict(_task('app'), extra=1)])
+        objs = self._created()
+        self.assertEqual(['web'], [o.name for o in objs])
+        self.assertEqual({'task_id': objs[0].uuid}, results[0])
+        self.assertIn('dest_cloud', results[1]['error'])
+        self.assertIn('extra', results[2]['error'])
+
+    def test_capacity_used_up(self):
+        self.capacity.return_value = (2, 'Exceeded the maximum license limit')
+        invalid = dict(_task('db'), src_server={})
+        results = self.api.create_tasks([invalid, _task('web'), _task('app'), _task('www')])
+        objs = self._created()
+        self.assertEqual(['web', 'app'], [o.name for o in objs])
+        self.assertIn('name', results[0]['error'])
+        self.assertEqual([{'task_id': o.uuid} for o in objs], results[1:3])
+        self.assertEqual({'error': 'Exceeded the maximum license limit'}, results[3])
+
+    def test_no_capacity(self):
+        self.capacity.return_value = (-1, 'Exceeded maximum quantity limit')
+        results = self.api.create_tasks([_task('web')])
+        self.assertEqual([{'error': 'Exceeded maximum quantity limit'}], results)
+        self.db.create_all.assert_not_called()
+        self.async_task.assert_not_called()
+
+    def test_illegal_license(self):
+        self.capacity.side_effect = Exception('License is illegal')
+        self.assertRaisesRegex(Exception, 'illegal', self.api.create_tasks, [_task('web')])
+        self.db.create_all.assert_not_called()
@@ -0,0 +1,59 @@
+from v2v.api.ipindex import IPIndex
+from v2v.tests import base
+
+
+class IPIndexTestCase(base.TestCase):
+
+    def test_merge_pools(self):
+        index = IPIndex([{'start': '10.0.0.20', 'end': '10.0.0.30'},
+                         {'start': '10.0.0.2', 'end': '10.0.0.10'},
+                         {'start': '10.0.0.11', 'end': '10.0.0.12'},
+                         {'start': '10.0.0.25', 'end': '10.0.0.40'}])
+        self.assertEqual(11 + 21, index.pool_len)
+        self.assertEqual(index.pool_len, index.free_len)
+        self.assertEqual(2, len(index.pools))
+
+    def test_used_addresses(self):
+        index = IPIndex([{'start': '10.0.0.2', 'end': '10.0.0.10'}],
+                        ['10.0.0.2', '10.0.0.4', '10.0.0.5', '10.0.0.10',
+                         '10.0.0.1', '192.168.0.4', '10.0.0.4'])
+        self.assertEqual(9, index.pool_len)
+        self.assertEqual(5, index.free_len)
+        self.assertEqual(['10.0.0.3', '10.0.0.6', '10.0.0.7', '10.0.0.8', '10.0.0.9'],
+                         index.first_free(10))
+
+    def test_invalid_used_addresses(self):
+        index = IPIndex([{'start': '10.0.0.2', 'end': '10.0.0.3'}],
+                        ['10.0.0.2', 'not-an-ip', None, '10.0.0'])
+        self.assertEqual(['10.0.0.3'], index.first_free(10))
+
+    def test_first_free(self):
+        index = IPIndex([{'start': '10.0.0.2', 'end': '10.0.0.4'},
+                         {'start': '10.0.1.2', 'end': '10.0.1.4'}], ['10.0.0.3'])
+        self.assertEqual([], index.first_free(0))
+        self.assertEqual(['10.0.0.2'], index.first_free(1))
+        self.assertEqual(['10.0.0.2', '10.0.0.4', '10.0.1.2'], index.first_free(3))
+
+    def test_all_used(self):
+        index = IPIndex([{'start': '10.0.0.2', 'end': '10.0.0.3'}],
+                        ['10.0.0.2', '10.0.0.3'])
+        self.assertEqual(0, index.free_len)
+        self.assertEqual([], index.first_free(5))
+
+    def test_large_pool(self):
+        index = IPIndex([{'start': '172.16.0.2', 'end': '172.16.255.254'}],
+                        [f'172.16.{i // 256}.{i % 256}' for i in range(2, 1002)])
+        self.assertEqual(65533, index.pool_len)
+        self.assertEqual(64533, index.free_len)
+        self.assertEqual(['172.16.3.234', '172.16.3.235'], index.first_free(2))
+
+    def test_ipv6(self):
+        index = IPIndex([{'start': 'fd00::2', 'end': 'fd00::ffff'}], ['fd00::2'])
+        self.assertEqual(6, index.version)
+        self.assertEqual(0xfffe - 1, index.free_len)
+        self.assertEqual(['fd00::3', 'fd00::4'], index.first_free(2))
+
+    def test_no_pools(self):
+        index = IPIndex([])
+        self.assertEqual(0, index.pool_len)
+        self.assertEqual([], index.first_free(5))
@@ -0,0 +1,76 @@
+from v2v.api import planner
+from v2v.common.units import GiB, MiB
+from v2v.tests import base
+
+HOST1 = (('vcenter', '192.168.5.10'), ('host', '192.168.5.10/10.0.0.1'))
+HOST2 = (('vcenter', '192.168.5.10'), ('host', '192.168.5.10/10.0.0.2'))
+
+
+def _job(key, duration, sources=HOST1):
+    return planner.Job(key, 0, 0, duration, sources)
+
+
+class PlannerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PlannerTestCase, self).setUp()
+        self.flags(max_concurrent_tasks_per_vcenter=0, max_concurrent_tasks_per_host=0,
+                   source_concurrency_limits=[])
+
+    def _starts(self, plan):
+        return [(job.key, start, finish) for job, start, finish in plan]
+
+    def test_predict_duration(self):
+        self.assertEqual(300 + 1024, planner.predict_duration(100 * GiB, 100, 300))
+        self.assertEqual(60 + 10, planner.predict_duration(10 * MiB, 1, 60))
+
+    def test_size_of(self):
+        self.assertEqual(40 * GiB, planner.size_of(40))
+        self.assertEqual(GiB + GiB // 2, planner.size_of('1.5'))
+
+    def test_plan_wave_longest_first(self):
+        jobs = [_job('e', 2), _job('c', 5), _job('a', 10), _job('d', 3), _job('b', 7)]
+        plan, makespan = planner.plan_wave(jobs, 2)
+        self.assertEqual([('a', 0.0, 10.0),
+                          ('b', 0.0, 7.0),
+                          ('c', 7.0, 12.0),
+                          ('d', 10.0, 13.0),
+                          ('e', 12.0, 14.0)], self._starts(plan))
+        self.assertEqual(14.0, makespan)
+
+    def test_plan_wave_ends_at_the_same_time(self):
+        jobs = [_job('a', 5), _job('b', 5), _job('c', 1), _job('d', 1)]
+        plan, makespan = planner.plan_wave(jobs, 2)
+        self.assertEqual([('a', 0.0, 5.0),
+                          ('b', 0.0, 5.0),
+                          ('c', 5.0, 6.0),
+                          ('d', 5.0, 6.0)], self._starts(plan))
+        self.assertEqual(6.0, makespan)
+
+    def test_plan_wave_source_limits(self):
+        self.flags(max_concurrent_tasks_per_host=1)
+        jobs = [_job('a', 10), _job('b', 8), _job('c', 4, HOST2)]
+        plan, makespan = planner.plan_wave(jobs, 3)
+        # b waits for a reading from the same host, c starts at once
+        self.assertEqual([('a', 0.0, 10.0),
+                          ('c', 0.0, 4.0),
+                          ('b', 10.0, 18.0)], self._starts(plan))
+        self.assertEqual(18.0, makespan)
+
+    def test_plan_wave_no_slot(self):
+        plan, makespan = planner.plan_wave([_job('a', 1), _job('b', 2)], 0)
+        self.assertEqual([('b', 0.0, 2.0), ('a', 2.0, 3.0)], self._starts(plan))
+        self.assertEqual(3.0, makespan)
+
+    def test_plan_wave_empty(self):
+        self.assertEqual(([], 0.0), planner.plan_wave([], 4))
+
+    def test_plan_wave_named_source_limit(self):
+        self.flags(source_concurrency_limits=['host:192.168.5.10/10.0.0.2:1'])
+        jobs = [_job('a', 10), _job('b', 8), _job('c', 4, HOST2), _job('d', 2, HOST2)]
+        plan, makespan = planner.plan_wave(jobs, 4)
+        self.assertEqual([('a', 0.0, 10.0),
+                          ('b', 0.0, 8.0),
+                          ('c', 0.0, 4.0),
+                          ('d', 4.0, 6.0)], self._starts(plan))
+        self.assertEqual(10.0, makespan)
@@ -0,0 +1,163 @@
+from unittest import mock
+
+import fixtures
+
+from v2v.cloud import catalog
+from v2v.tests import base
+
+
+class _Thread(object):
+    """Runs the background refresh when the test asks for it"""
+
+    started = []
+
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+        self.daemon = False
+
+    def start(self):
+        self.started.append(self)
+
+    def run(self):
+        self.target(*self.args)
+
+
+class CatalogCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CatalogCacheTestCase, self).setUp()
+        self.flags(catalog_cache_ttl=300, catalog_networks_ttl=30,
+                   catalog_stale_seconds=600)
+        self.now = 1000.0
+        time = self.useFixture(fixtures.MockPatch('v2v.cloud.catalog.time')).mock
+        time.time.side_effect = lambda: self.now
+        self.useFixture(fixtures.MockPatch('v2v.cloud.catalog.threading.Thread', _Thread))
+        _Thread.started = []
+        self.cache = catalog.CatalogCache()
+        self.loader = mock.Mock(return_value=[{'id': 'flavor-1'}])
+
+    def _refresh(self):
+        threads, _Thread.started = _Thread.started, []
+        for thread in threads:
+            thread.run()
+        return len(threads)
+
+    def test_etag_of(self):
+        self.assertEqual(catalog.etag_of([{'id': 1, 'name': 'a'}]),
+                         catalog.etag_of([{'name': 'a', 'id': 1}]))
+        self.assertNotEqual(catalog.etag_of([{'id': 1}]), catalog.etag_of([{'id': 2}]))
+
+    def test_get_miss_then_hit(self):
+        flavors = self.cache.get('cloud-1', 'flavors', self.loader)
+        self.assertEqual([{'id': 'flavor-1'}], flavors)
+        self.assertEqual(catalog.etag_of(flavors), flavors.etag)
+        self.now += 299
+        self.assertEqual(flavors.etag, self.cache.get('cloud-1', 'flavors', self.loader).etag)
+        self.assertEqual(1, self.loader.call_count)
+        stats, = self.cache.stats()
+        self.assertEqual({'cloud': 'cloud-1', 'kind': 'flavors', 'etag': flavors.etag,
+                          'age': 299, 'count': 1, 'hits': 1, 'stale_hits': 0,
+                          'misses': 1, 'errors': 0}, stats)
+
+    def test_networks_ttl(self):
+        self.cache.get('cloud-1', 'networks', self.loader)
+        self.now += 29
+        self.cache.get('cloud-1', 'networks', self.loader)
+        self.assertEqual(1, self.loader.call_count)
+        # An expired networks catalog is fetched again before it is served
+        self.loader.return_value = [{'id': 'net-2'}]
+        self.now += 1
+        self.assertEqual([{'id': 'net-2'}], self.cache.get('cloud-1', 'networks', self.loader))
+        self.assertEqual(0, self._refresh())
+        stats, = self.cache.stats()
+        self.assertEqual((1, 0, 2), (stats['hits'], stats['stale_hits'], stats['misses']))
+
+    def test_filtered_networks_ttl(self):
+        self.cache.get('cloud-1', 'networks:net-1', self.loader)
+        self.now += 30
+        self.assertIsNone(self.cache.peek('cloud-1', 'networks:net-1'))
+        self.cache.get('cloud-1', 'networks:net-1', self.loader)
+        self.assertEqual(2, self.loader.call_count)
+        self.assertEqual(0, self._refresh())
+
+    def test_get_stale(self):
+        self.cache.get('cloud-1', 'flavors', self.loader)
+        self.loader.return_value = [{'id': 'flavor-2'}]
+        self.now += 300
+        self.assertEqual([{'id': 'flavor-1'}], self.cache.get('cloud-1', 'flavors', self.loader))
+        # A single refresh for the concurrent requests of a stale catalog
+        self.assertEqual([{'id': 'flavor-1'}], self.cache.get('cloud-1', 'flavors', self.loader))
+        self.assertEqual(1, self._refresh())
+        self.assertEqual([{'id': 'flavor-2'}], self.cache.get('cloud-1', 'flavors', self.loader))
+        self.assertEqual(0, self._refresh())
+        stats, = self.cache.stats()
+        self.assertEqual((1, 2, 1), (stats['hits'], stats['stale_hits'], stats['misses']))
+
+    def test_get_stale_refresh_failed(self):
+        self.cache.get('cloud-1', 'flavors', self.loader)
+        self.loader.side_effect = Exception('nova is down')
+        self.now += 300
+        self.cache.get('cloud-1', 'flavors', self.loader)
+        self._refresh()
+        self.assertEqual([{'id': 'flavor-1'}], self.cache.get('cloud-1', 'flavors', self.loader))
+        # The next stale request retries the refresh
+        self.assertEqual(1, self._refresh())
+        self.assertEqual(2, self.cache.stats()[0]['errors'])
+
+    def test_get_expired(self):
+        self.cache.get('cloud-1', 'flavors', self.loader)
+        self.loader.return_value = [{'id': 'flavor-2'}]
+        self.now += 900
+        self.assertEqual([{'id': 'flavor-2'}], self.cache.get('cloud-1', 'flavors', self.loader))
+        self.assertEqual(0, self._refresh())
+
+    def test_get_load_failed(self):
+        self.loader.side_effect = Exception('nova is down')
+        self.assertRaises(Exception, self.cache.get, 'cloud-1', 'flavors', self.loader)
+        self.assertEqual(1, self.cache.stats()[0]['errors'])
+        self.loader.side_effect = None
+        self.assertEqual([{'id': 'flavor-1'}], self.cache.get('cloud-1', 'flavors', self.loader))
+
+    def test_peek(self):
+        self.assertIsNone(self.cache.peek('cloud-1', 'flavors'))
+        flavors = self.cache.get('cloud-1', 'flavors', self.loader)
+        self.assertEqual(flavors.etag, self.cache.peek('cloud-1', 'flavors').etag)
+        self.now += 300
+        self.assertIsNone(self.cache.peek('cloud-1', 'flavors'))
+
+    def test_invalidate(self):
+        for kind in ('flavors', 'networks', 'networks:net-1'):
+            self.cache.get('cloud-1', kind, self.loader)
+            self.cache.get('cloud-2', kind, self.loader)
+        self.cache.invalidate('cloud-1', 'networks')
+        self.assertEqual([('cloud-1', 'flavors'), ('cloud-2', 'flavors'),
+                          ('cloud-2', 'networks'), ('cloud-2', 'networks:net-1')],
+                         [(s['cloud'], s['kind']) for s in self.cache.stats()])
+        self.cache.invalidate('cloud-2')
+        self.assertEqual([('cloud-1', 'flavors')],
+                         [(s['cloud'], s['kind']) for s in self.cache.stats()])
+        self.assertEqual(['cloud-1'], [s['cloud'] for s in self.cache.stats('cloud-1')])
+
+    def test_empty_filtered_catalog_not_kept(self):
+        self.loader.return_value = []
+        self.assertEqual([], self.cache.get('cloud-1', 'networks:unknown', self.loader))
+        self.assertEqual([], self.cache.stats())
+        self.assertEqual([], self.cache.get('cloud-1', 'networks', self.loader))
+        self.assertEqual(['networks'], [s['kind'] for s in self.cache.stats()])
+
+    def test_filtered_catalogs_bounded(self):
+        self.flags(catalog_max_filtered=2)
+        self.cache.get('cloud-1', 'networks', self.loader)
+        self.cache.get('cloud-2', 'networks:net-1', self.loader)
+        for i in range(1, 4):
+            self.now += 1
+            self.cache.get('cloud-1', f'networks:net-{i}', self.loader)
+        self.now += 1
+        self.cache.get('cloud-1', 'networks:net-2', self.loader)
+        self.now += 1
+        # The least recently used one is dropped
+        self.cache.get('cloud-1', 'networks:net-4', self.loader)
+        self.assertEqual([('cloud-1', 'networks'), ('cloud-1', 'networks:net-2'),
+                          ('cloud-1', 'networks:net-4'), ('cloud-2', 'networks:net-1')],
+                         [(s['cloud'], s['kind']) for s in self.cache.stats()])
@@ -0,0 +1,91 @@
+from unittest import mock
+
+from v2v.cloud import inventory
+from v2v.tests import base
+
+CLOUD = {'uuid': 'c1', 'ip': '192.168.5.10', 'user': 'root', 'password': 'pwd',
+         'uri': '/dc/host/10.0.0.1'}
+
+
+def _change(name, val=None, op='assign'):
+    change = mock.Mock(op=op, val=val)
+    # name is an argument of Mock itself
+    change.name = name
+    return change
+
+
+def _object(moid, kind, *changes):
+    return mock.Mock(obj=mock.Mock(_moId=moid), kind=kind, changeSet=list(changes))
+
+
+def _update(*objects):
+    return mock.Mock(filterSet=[mock.Mock(objectSet=list(objects))])
+
+
+class ApplyTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ApplyTestCase, self).setUp()
+        self.syncer = inventory.InventorySync(CLOUD)
+
+    def test_enter(self):
+        vms = {}
+        self.syncer._apply(vms, _update(
+            _object('vm-1', 'enter', _change('name', 'web'), _change('config.uuid', 'u1')),
+            _object('vm-2', 'enter', _change('name', 'db'))))
+        self.assertEqual({'vm-1': {'name': 'web', 'config.uuid': 'u1'},
+                          'vm-2': {'name': 'db'}}, vms)
+
+    def test_modify(self):
+        vms = {'vm-1': {'name': 'web', 'runtime.powerState': 'poweredOn'}}
+        self.syncer._apply(vms, _update(
+            _object('vm-1', 'modify', _change('runtime.powerState', 'poweredOff'),
+                    _change('name', op='remove'))))
+        self.assertEqual({'vm-1': {'runtime.powerState': 'poweredOff'}}, vms)
+
+    def test_leave(self):
+        vms = {'vm-1': {'name': 'web'}, 'vm-2': {'name': 'db'}}
+        self.syncer._apply(vms, _update(_object('vm-1', 'leave'), _object('vm-3', 'leave')))
+        self.assertEqual({'vm-2': {'name': 'db'}}, vms)
+
+    def test_enter_again_resets(self):
+        vms = {'vm-1': {'name': 'web', 'guest.ipAddress': '10.0.0.5'}}
+        self.syncer._apply(vms, _update(_object('vm-1', 'enter', _change('name', 'web'))))
+        self.assertEqual({'vm-1': {'name': 'web'}}, vms)
+
+    def test_servers_snapshot(self):
+        self.syncer._vms = {'vm-1': {'name': 'web'}, 'vm-2': {'name': 'db'}}
+        servers = self.syncer.servers()
+        self.assertEqual([{'name': 'db'}, {'name': 'web'}], list(servers))
+        servers[0]['name'] = 'changed'
+        self.assertEqual('db', self.syncer._vms['vm-2']['name'])
+
+
+class GetSyncerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetSyncerTestCase, self).setUp()
+        self.addCleanup(inventory._SYNCERS.clear)
+        self.start = mock.patch.object(inventory.InventorySync, 'start').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_started_once(self):
+        syncer = inventory.get_syncer(CLOUD)
+        self.assertIs(syncer, inventory.get_syncer(dict(CLOUD)))
+        self.assertEqual(1, self.start.call_count)
+
+    def test_replaced_when_the_cloud_changes(self):
+        syncer = inventory.get_syncer(CLOUD)
+        other = inventory.get_syncer(dict(CLOUD, password='other'))
+        self.assertIsNot(syncer, other)
+        self.assertTrue(syncer._stopped)
+
+    def test_list_servers_not_ready(self):
+        self.flags(inventory_initial_wait=0)
+        self.assertIsNone(inventory.list_servers(CLOUD))
+
+    def test_stop(self):
+        syncer = inventory.get_syncer(CLOUD)
+        inventory.stop('c1')
+        self.assertTrue(syncer._stopped)
+        self.assertNotIn('c1', inventory._SYNCERS)
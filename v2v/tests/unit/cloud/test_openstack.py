@@ -0,0 +1,101 @@
+from unittest import mock
+
+import fixtures
+
+from v2v.cloud import openstack
+from v2v.tests import base
+
+AUTH = {
+    'auth_url': 'http://keystone:5000/v3',
+    'username': 'admin',
+    'password': 'secret',
+    'project_name': 'admin',
+    'project_domain_name': 'Default',
+    'user_domain_name': 'Default',
+}
+
+
+class GetSessionTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetSessionTestCase, self).setUp()
+        self.useFixture(fixtures.MockPatchObject(openstack, '_SESSIONS',
+                                                 openstack.collections.OrderedDict()))
+
+    def test_shared_by_the_same_credentials(self):
+        sess = openstack.get_session(AUTH)
+        self.assertIs(sess, openstack.get_session(dict(AUTH, region_name='r1')))
+        self.assertIsNot(sess, openstack.get_session(dict(AUTH, password='other')))
+
+    def test_bounded(self):
+        self.useFixture(fixtures.MockPatchObject(openstack, 'MAX_SESSIONS', 2))
+        first = openstack.get_session(dict(AUTH, username='u1'))
+        second = openstack.get_session(dict(AUTH, username='u2'))
+        # u1 is used again, so u2 is the least recently used one
+        self.assertIs(first, openstack.get_session(dict(AUTH, username='u1')))
+        openstack.get_session(dict(AUTH, username='u3'))
+        self.assertEqual(2, len(openstack._SESSIONS))
+        self.assertIs(first, openstack.get_session(dict(AUTH, username='u1')))
+        self.assertIsNot(second, openstack.get_session(dict(AUTH, username='u2')))
+
+
+class OpenStackTestCase(base.TestCase):
+
+    def setUp(self):
+        super(OpenStackTestCase, self).setUp()
+        for name in ('Nova', 'Glance', 'Neutron', 'Cinder'):
+            self.useFixture(fixtures.MockPatchObject(openstack, name))
+
+    def test_glance_created_on_first_use(self):
+        cloud = openstack.OpenStack(dict(AUTH, region_name='r1'))
+        self.assertFalse(openstack.Glance.called)
+        self.assertIs(cloud.glance, cloud.glance)
+        openstack.Glance.assert_called_once_with(cloud.session, region_name='r1')
+        openstack.Nova.assert_called_once_with(cloud.session, region_name='r1')
+
+
+class GetOpenStackTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetOpenStackTestCase, self).setUp()
+        self.useFixture(fixtures.MockPatchObject(openstack, '_SESSIONS',
+                                                 openstack.collections.OrderedDict()))
+        self.useFixture(fixtures.MockPatchObject(openstack, '_CLOUDS', {}))
+        self.useFixture(fixtures.MockPatchObject(
+            openstack, 'OpenStack', side_effect=lambda cloud: mock.Mock(
+                session=openstack.get_session(cloud))))
+        self.cloud = dict(AUTH, uuid='c1', region_name='r1')
+
+    def test_cached(self):
+        clients = openstack.get_openstack(self.cloud)
+        self.assertIs(clients, openstack.get_openstack(dict(self.cloud)))
+        self.assertEqual(1, openstack.OpenStack.call_count)
+
+    def test_token_min_life(self):
+        self.flags(openstack_token_min_life=300)
+        clients = openstack.get_openstack(self.cloud)
+        self.assertEqual(300, clients.session.auth.MIN_TOKEN_LIFE_SECONDS)
+
+    def test_other_region(self):
+        clients = openstack.get_openstack(self.cloud)
+        other = openstack.get_openstack(dict(self.cloud, region_name='r2'))
+        self.assertIsNot(clients, other)
+        # The credentials did not change, the session is kept
+        self.assertIs(clients.session, other.session)
+
+    def test_other_credentials(self):
+        clients = openstack.get_openstack(self.cloud)
+        cloud = dict(self.cloud, password='other')
+        other = openstack.get_openstack(cloud)
+        self.assertIsNot(clients.session, other.session)
+        # The session of the former credentials is dropped
+        self.assertEqual([openstack._session_key(openstack._session_auth(cloud))],
+                         list(openstack._SESSIONS))
+
+    def test_invalidate(self):
+        clients = openstack.get_openstack(self.cloud)
+        openstack.invalidate_openstack('c1')
+        self.assertEqual({}, openstack._CLOUDS)
+        self.assertEqual(0, len(openstack._SESSIONS))
+        self.assertIsNot(clients, openstack.get_openstack(self.cloud))
+        openstack.invalidate_openstack('unknown')
@@ -0,0 +1,268 @@
+from unittest import mock
+
+import fixtures
+from pyVmomi import vim
+
+from v2v.cloud import vsphere
+from v2v.tests import base
+
+
+class SessionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SessionPoolTestCase, self).setUp()
+        self.flags(vsphere_max_sessions=2, vsphere_keepalive_interval=60,
+                   vsphere_session_wait_timeout=0)
+        self.connect = self.useFixture(fixtures.MockPatchObject(
+            vsphere.connect, 'SmartConnect', side_effect=lambda **kw: mock.Mock())).mock
+        self.disconnect = self.useFixture(fixtures.MockPatchObject(
+            vsphere.connect, 'Disconnect')).mock
+        self.pool = vsphere.SessionPool()
+        self.useFixture(fixtures.MockPatchObject(self.pool, '_start_keepalive'))
+
+    def test_reuse(self):
+        si = self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.pool.release(si)
+        self.assertIs(si, self.pool.acquire('vc', 443, 'root', 'pwd'))
+        self.assertEqual(1, self.connect.call_count)
+
+    def test_one_borrower_at_a_time(self):
+        first = self.pool.acquire('vc', 443, 'root', 'pwd')
+        second = self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.assertIsNot(first, second)
+        self.assertEqual(2, self.connect.call_count)
+
+    def test_max_sessions(self):
+        self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.assertIsNone(self.pool.acquire('vc', 443, 'root', 'pwd'))
+        # The limit is per vCenter
+        self.assertIsNotNone(self.pool.acquire('vc2', 443, 'root', 'pwd'))
+        self.assertEqual(3, self.connect.call_count)
+
+    def test_evict_idle_session_of_another_user(self):
+        first = self.pool.acquire('vc', 443, 'root', 'pwd')
+        second = self.pool.acquire('vc', 443, 'admin', 'pwd')
+        self.pool.release(first)
+        other = self.pool.acquire('vc', 443, 'admin', 'pwd')
+        self.assertIsNotNone(other)
+        self.assertIsNot(second, other)
+        self.disconnect.assert_called_once_with(first)
+        self.assertEqual(2, self.pool._opened['vc'])
+
+    def test_discard(self):
+        si = self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.pool.release(si, discard=True)
+        self.disconnect.assert_called_once_with(si)
+        self.assertEqual(0, self.pool._opened['vc'])
+        self.assertIsNot(si, self.pool.acquire('vc', 443, 'root', 'pwd'))
+
+    def test_connect_failure_frees_the_slot(self):
+        self.connect.side_effect = vim.fault.InvalidLogin()
+        self.assertIsNone(self.pool.acquire('vc', 443, 'root', 'pwd'))
+        self.assertEqual(0, self.pool._opened['vc'])
+
+    def _idle_since_long(self):
+        si = self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.pool.release(si)
+        self.pool._idle[self.pool._key('vc', 443, 'root', 'pwd')][0] = (si, 0)
+        return si
+
+    def test_relogin_expired_session(self):
+        si = self._idle_since_long()
+        si.content.sessionManager.currentSession = None
+        self.assertIs(si, self.pool.acquire('vc', 443, 'root', 'pwd'))
+        si.content.sessionManager.Login.assert_called_once_with('root', 'pwd')
+
+    def test_replace_dead_session(self):
+        si = self._idle_since_long()
+        si.content.sessionManager.currentSession = None
+        si.content.sessionManager.Login.side_effect = vim.fault.InvalidLogin()
+        other = self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.assertIsNot(si, other)
+        self.disconnect.assert_called_once_with(si)
+        self.assertEqual(1, self.pool._opened['vc'])
+
+    def test_keep_alive_closes_idle_sessions(self):
+        self.flags(vsphere_session_idle_timeout=10)
+        old = self.pool.acquire('vc', 443, 'root', 'pwd')
+        dead = self.pool.acquire('vc', 443, 'root', 'pwd')
+        self.pool.release(old)
+        self.pool.release(dead)
+        key = self.pool._key('vc', 443, 'root', 'pwd')
+        self.pool._idle[key][0] = (old, 0)
+        dead.CurrentTime.side_effect = OSError()
+        self.pool._keep_alive()
+        self.assertEqual([mock.call(old), mock.call(dead)], self.disconnect.call_args_list)
+        self.assertEqual(0, self.pool._opened['vc'])
+
+
+class VMwareDriverTestCase(base.TestCase):
+
+    def setUp(self):
+        super(VMwareDriverTestCase, self).setUp()
+        self.connect = self.useFixture(fixtures.MockPatchObject(
+            vsphere.connect, 'SmartConnect', side_effect=lambda **kw: mock.Mock())).mock
+        self.disconnect = self.useFixture(fixtures.MockPatchObject(
+            vsphere.connect, 'Disconnect')).mock
+        self.pool = self.useFixture(fixtures.MockPatchObject(vsphere, '_POOL')).mock
+
+    def test_pooled(self):
+        with vsphere.VMwareDriver(host='vc', pwd='pwd') as si:
+            self.assertIs(self.pool.acquire.return_value, si)
+        self.pool.release.assert_called_once_with(si, discard=False)
+
+    def test_broken_session_discarded(self):
+        def _list():
+            with vsphere.VMwareDriver(host='vc', pwd='pwd'):
+                raise vim.fault.NotAuthenticated()
+        self.assertRaises(vim.fault.NotAuthenticated, _list)
+        self.pool.release.assert_called_once_with(self.pool.acquire.return_value,
+                                                  discard=True)
+
+    def test_not_pooled(self):
+        with vsphere.VMwareDriver(host='vc', pwd='pwd', pooled=False) as si:
+            self.assertIsNotNone(si)
+        self.pool.acquire.assert_not_called()
+        self.disconnect.assert_called_once_with(si)
+
+
+
+def _objects(*names):
+    objects = []
+    for name in names:
+        prop = mock.Mock(val=name)
+        # name is an argument of Mock itself
+        prop.name = 'name'
+        objects.append(mock.Mock(propSet=[prop]))
+    return objects
+
+
+def _names(*names):
+    return [{'name': name} for name in names]
+
+
+class IterPropertyCollectorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(IterPropertyCollectorTestCase, self).setUp()
+        self.vs = vsphere.vSphere(host='vc')
+        self.vs.si = mock.Mock()
+        self.pc = self.vs.si.content.propertyCollector
+        self.host = vim.HostSystem('host-1')
+        self.props = [(vim.VirtualMachine, ['name'])]
+        self.pc.RetrievePropertiesEx.return_value = mock.Mock(token='t1',
+                                                              objects=_objects('a', 'b'))
+        self.pc.ContinueRetrievePropertiesEx.side_effect = [
+            mock.Mock(token='t2', objects=_objects('c')),
+            mock.Mock(token=None, objects=_objects('d'))]
+
+    def test_pages(self):
+        self.flags(vsphere_max_objects=2)
+        pages = self.vs._iter_property_collector(vsphere.host_vm_spec(self.host), self.props)
+        self.assertEqual([_names('a', 'b'), _names('c'), _names('d')],
+                         [self.vs._to_dicts(objects) for objects in pages])
+        self.assertEqual([mock.call('t1'), mock.call('t2')],
+                         self.pc.ContinueRetrievePropertiesEx.call_args_list)
+        options = self.pc.RetrievePropertiesEx.call_args[0][1]
+        self.assertEqual(2, options.maxObjects)
+        self.pc.CancelRetrievePropertiesEx.assert_not_called()
+
+    def test_close_cancels(self):
+        pages = self.vs._iter_property_collector(vsphere.host_vm_spec(self.host), self.props,
+                                                 max_objects=5)
+        self.assertEqual(_names('a', 'b'), self.vs._to_dicts(next(pages)))
+        pages.close()
+        self.pc.CancelRetrievePropertiesEx.assert_called_once_with('t1')
+        self.pc.ContinueRetrievePropertiesEx.assert_not_called()
+
+    def test_iter_host_vms(self):
+        pages = list(self.vs.iter_host_vms(self.host, ['name'], max_objects=3))
+        self.assertEqual([_names('a', 'b'), _names('c'), _names('d')], pages)
+        filter_spec, options = self.pc.RetrievePropertiesEx.call_args[0]
+        self.assertEqual(3, options.maxObjects)
+        obj_spec = filter_spec[0].objectSet[0]
+        # The VMs are reached from the host, not through a container view
+        self.assertIs(self.host, obj_spec.obj)
+        self.assertEqual('vm', obj_spec.selectSet[0].path)
+        self.assertEqual(vim.VirtualMachine, filter_spec[0].propSet[0].type)
+        self.vs.si.content.viewManager.CreateContainerView.assert_not_called()
+
+    def test_view_destroyed(self):
+        view_manager = self.vs.si.content.viewManager
+        view_manager.CreateContainerView.return_value = vim.view.ContainerView('session[1]view-1')
+        with mock.patch.object(vim.view.ContainerView, 'Destroy', create=True) as destroy:
+            pages = self.vs.iter_property_collector(None, vim.VirtualMachine,
+                                                    {'VirtualMachine': ['name']})
+            self.assertEqual(_names('a', 'b'), next(pages))
+            pages.close()
+        view_manager.CreateContainerView.assert_called_once_with(
+            self.vs.si.content.rootFolder, [vim.VirtualMachine], True)
+        destroy.assert_called_once_with()
+        self.pc.CancelRetrievePropertiesEx.assert_called_once_with('t1')
+
+
+class ListHostsTestCase(base.TestCase):
+
+    def test_list_hosts(self):
+        vs = vsphere.vSphere(host='vc')
+        vs.si = mock.Mock()
+        cluster = vim.ClusterComputeResource('domain-c1')
+        standalone = vim.ComputeResource('domain-s1')
+
+        def _content(obj, **values):
+            props = []
+            for name, val in values.items():
+                prop = mock.Mock(val=val)
+                prop.name = name
+                props.append(prop)
+            return mock.Mock(obj=obj, propSet=props)
+
+        pages = [[_content(vim.HostSystem('host-1'), name='10.0.0.1', parent=cluster),
+                  _content(cluster, name='cluster-1')],
+                 [_content(vim.HostSystem('host-2'), name='10.0.0.2', parent=standalone)]]
+        view_manager = vs.si.content.viewManager
+        view_manager.CreateContainerView.return_value = vim.view.ContainerView('session[1]view-1')
+        with mock.patch.object(vs, '_iter_property_collector', return_value=iter(pages)), \
+                mock.patch.object(vim.view.ContainerView, 'Destroy', create=True) as destroy:
+            hosts = vs.list_hosts(vim.Datacenter('datacenter-1'))
+        self.assertEqual([{'moid': 'host-1', 'name': '10.0.0.1', 'cluster': 'cluster-1'},
+                          {'moid': 'host-2', 'name': '10.0.0.2', 'cluster': None}], hosts)
+        destroy.assert_called_once_with()
+
+
+class FindHostTestCase(base.TestCase):
+
+    def setUp(self):
+        super(FindHostTestCase, self).setUp()
+        self.vs = vsphere.vSphere(host='vc')
+        self.vs.si = mock.Mock()
+        self.entities = {'dc': vim.Datacenter('datacenter-1')}
+        self.search = self.vs.si.content.searchIndex
+        self.search.FindByInventoryPath.side_effect = self.entities.get
+
+    def test_host(self):
+        host = vim.HostSystem('host-1')
+        self.entities['dc/host/cluster/10.0.0.1'] = host
+        self.assertEqual((host, None), self.vs.find_host('/dc/cluster/10.0.0.1/'))
+        self.search.FindByInventoryPath.assert_called_once_with('dc/host/cluster/10.0.0.1')
+
+    def test_standalone_host(self):
+        host = vim.HostSystem('host-1')
+        compute = mock.Mock(spec=vim.ComputeResource, host=[host])
+        self.entities['dc/host/10.0.0.1'] = compute
+        self.assertEqual((host, None), self.vs.find_host('dc/10.0.0.1'))
+
+    def test_cluster_is_not_a_host(self):
+        self.entities['dc/host/cluster'] = mock.Mock(spec=vim.ClusterComputeResource,
+                                                     host=[vim.HostSystem('host-1')])
+        self.assertEqual((None, 'Could not find specified esxi cluster.'),
+                         self.vs.find_host('dc/cluster'))
+
+    def test_no_host(self):
+        self.assertEqual((None, 'Could not find specified esxi 10.0.0.1.'),
+                         self.vs.find_host('dc/10.0.0.1'))
+
+    def test_no_datacenter(self):
+        self.assertEqual((None, 'Could not find specified datacenter dc2.'),
+                         self.vs.find_host('dc2/10.0.0.1'))
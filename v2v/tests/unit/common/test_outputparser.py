@@ -0,0 +1,57 @@
+import io
+
+from v2v.common.outputparser import DiskProgress, ImportProgress
+from v2v.common.outputparser import OutputParser, OutputParserError
+from v2v.tests import base
+
+
+class OutputParserTestCase(base.TestCase):
+
+    def setUp(self):
+        super(OutputParserTestCase, self).setUp()
+        self.parser = OutputParser()
+
+    def test_parse(self):
+        stream = io.BytesIO(
+            b'[   1.0] Opening the source\n'
+            b'[  10.0] Copying disk 1/2 to /var/tmp/v2v-sda (raw)\n'
+            b'    (0.00/100%)\r'
+            b'    (50.00/100%)\r'
+            b'    (100.00/100%)\n'
+            b'[  90.0] Copying disk 2/2 to /var/tmp/v2v-sdb (raw)\n'
+            b'    (100.00/100%)\n'
+            b'[ 100.0] Finishing off\n')
+        events = list(self.parser.parse(stream))
+        self.assertEqual([
+            ImportProgress(1, 2, 'Copying disk 1/2'),
+            DiskProgress(0),
+            DiskProgress(50),
+            DiskProgress(100),
+            ImportProgress(2, 2, 'Copying disk 2/2'),
+            DiskProgress(100),
+        ], events)
+
+    def test_parse_stream_closed(self):
+        stream = io.BytesIO(b'Copying disk 1/1 to /var/tmp/v2v-sda (raw)\n'
+                            b'    (10.00/100%)\r')
+        self.assertRaises(OutputParserError, list, self.parser.parse(stream))
+
+    def test_feed(self):
+        self.assertIsNone(self.parser.feed(b'    (10.00/100%)\r'))
+        self.assertEqual(ImportProgress(1, 1, 'Copying disk 1/1'),
+                         self.parser.feed(b'Copying disk 1/1 to /var/tmp/v2v-sda (raw)\n'))
+        self.assertTrue(self.parser.copying)
+        self.assertIsNone(self.parser.feed(b'libguestfs: trace: ...\n'))
+        self.assertEqual(DiskProgress(42), self.parser.feed(b'    (42.00/100%)\r'))
+        self.assertEqual(DiskProgress(100), self.parser.feed(b'    (100.00/100%)\n'))
+        self.assertFalse(self.parser.copying)
+        self.assertIsNone(self.parser.feed(b'    (10.00/100%)\r'))
+
+    def test_feed_progress_bar(self):
+        self.parser.feed(b'Copying disk 1/1 to /var/tmp/v2v-sda (raw)\n')
+        self.assertEqual(DiskProgress(37),
+                         self.parser.feed(b'\xe2\x96\x88 37% [****------]\r'))
+
+    def test_feed_unexpected_format(self):
+        self.assertRaises(OutputParserError, self.parser.feed,
+                          b'echo Copying disk\n')
@@ -0,0 +1,29 @@
+from v2v.common import sources
+from v2v.tests import base
+
+
+class SourcesTestCase(base.TestCase):
+
+    def test_source_keys(self):
+        self.assertEqual((('vcenter', '192.168.5.10'), ('host', '192.168.5.10/10.0.0.1')),
+                         sources.source_keys({'ip': '192.168.5.10',
+                                              'uri': '/dc/cluster/10.0.0.1/'}))
+        self.assertEqual((('vcenter', '192.168.5.10'), ('host', '192.168.5.10/')),
+                         sources.source_keys({'ip': '192.168.5.10', 'uri': None}))
+
+    def test_source_name(self):
+        self.assertEqual('host:192.168.5.10/10.0.0.1',
+                         sources.source_name('host', '192.168.5.10/10.0.0.1'))
+
+    def test_source_limit(self):
+        self.flags(max_concurrent_tasks_per_vcenter=4, max_concurrent_tasks_per_host=2,
+                   source_concurrency_limits=['vcenter:192.168.5.12:1',
+                                              'host:192.168.5.10/10.0.0.1:0',
+                                              '192.168.5.13:3'])
+        self.assertEqual(4, sources.source_limit('vcenter', '192.168.5.10'))
+        self.assertEqual(1, sources.source_limit('vcenter', '192.168.5.12'))
+        self.assertEqual(2, sources.source_limit('host', '192.168.5.10/10.0.0.2'))
+        self.assertEqual(0, sources.source_limit('host', '192.168.5.10/10.0.0.1'))
+        # The names without a kind match no source
+        self.assertEqual(4, sources.source_limit('vcenter', '192.168.5.13'))
+        self.assertEqual(2, sources.source_limit('host', '192.168.5.12/10.0.0.1'))
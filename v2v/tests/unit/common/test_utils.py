@@ -0,0 +1,47 @@
+import fixtures
+import flask
+
+from v2v.cloud import catalog
+from v2v.common import utils
+from v2v.tests import base
+
+
+class RespCatalogTestCase(base.TestCase):
+
+    def setUp(self):
+        super(RespCatalogTestCase, self).setUp()
+        self.app = flask.Flask(__name__)
+        self.catalog = catalog.Catalog([{'id': 'flavor-1'}], 'abc')
+
+    def test_etag(self):
+        with self.app.test_request_context('/flavors'):
+            resp, code, headers = utils.resp_catalog(self.catalog)
+        self.assertEqual(200, code)
+        self.assertEqual({'ETag': '"abc"'}, headers)
+        self.assertEqual([{'id': 'flavor-1'}], resp['data'])
+
+    def test_not_modified(self):
+        with self.app.test_request_context('/flavors', headers={'If-None-Match': '"abc"'}):
+            self.assertEqual((None, 304, {'ETag': '"abc"'}), utils.resp_catalog(self.catalog))
+        with self.app.test_request_context('/flavors', headers={'If-None-Match': '"other"'}):
+            self.assertEqual(200, utils.resp_catalog(self.catalog)[1])
+
+
+class GetHostUuidTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetHostUuidTestCase, self).setUp()
+        self.useFixture(fixtures.MonkeyPatch('v2v.common.utils._HOST_UUID', None))
+        self.cmd = self.useFixture(fixtures.MockPatchObject(utils, 'check_cmd_output')).mock
+
+    def test_read_once(self):
+        self.cmd.return_value = b'serial\n'
+        self.assertEqual('serial', utils.get_host_uuid())
+        self.assertEqual('serial', utils.get_host_uuid())
+        self.cmd.assert_called_once_with(['dmidecode', '-s', 'system-serial-number'])
+
+    def test_failure_read_again(self):
+        self.cmd.side_effect = [None, b'serial\n']
+        self.assertIsNone(utils.get_host_uuid())
+        self.assertEqual('serial', utils.get_host_uuid())
+        self.assertEqual(2, self.cmd.call_count)
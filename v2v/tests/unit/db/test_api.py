@@ -0,0 +1,384 @@
+import datetime
+from unittest import mock
+
+from migrate.versioning import api as versioning_api
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+from sqlalchemy import event
+from sqlalchemy import inspect
+
+from v2v.db import api as db_api
+from v2v.db import models
+from v2v.tests import base
+
+# The task table of the first release
+BASELINE_TASK = '''
+CREATE TABLE task (
+    id INTEGER NOT NULL PRIMARY KEY,
+    uuid VARCHAR(36),
+    created_at DATETIME,
+    updated_at DATETIME,
+    src_cloud VARCHAR(36) NOT NULL,
+    src_server VARCHAR(255) NOT NULL,
+    dest_cloud VARCHAR(36) NOT NULL,
+    dest_server VARCHAR(255) NOT NULL,
+    state VARCHAR(36),
+    percent INTEGER
+)'''
+
+
+class DBSyncTestCase(base.DBTestCase):
+    SYNC = False
+
+    def _columns(self, table):
+        return {c['name'] for c in inspect(db_api.get_engine()).get_columns(table)}
+
+    def _indexes(self, table):
+        return {i['name'] for i in inspect(db_api.get_engine()).get_indexes(table)}
+
+    def test_new_database(self):
+        db_api.db_sync()
+        engine = db_api.get_engine()
+        self.assertEqual(versioning_api.version(db_api.MIGRATE_REPO),
+                         versioning_api.db_version(engine, db_api.MIGRATE_REPO))
+        self.assertEqual(set(models.Task.__table__.columns.keys()),
+                         self._columns('task'))
+        # A second sync is a noop
+        db_api.db_sync()
+
+    def test_baseline_database(self):
+        engine = db_api.get_engine()
+        engine.execute(BASELINE_TASK)
+        engine.execute("INSERT INTO task (uuid, src_cloud, src_server, dest_cloud, dest_server) "
+                       "VALUES ('u1', 's', '{}', 'd', '{}')")
+        engine.execute("INSERT INTO task (uuid, src_cloud, src_server, dest_cloud, dest_server) "
+                       "VALUES ('u2', 's', '{\"name\": \"web\"}', 'd', '{\"name\": \"web-2\"}')")
+        engine.execute("INSERT INTO task (uuid, src_cloud, src_server, dest_cloud, dest_server) "
+                       "VALUES ('u3', 's', '{\"name\": \"db\"}', 'd', 'invalid')")
+        db_api.db_sync()
+        self.assertEqual(versioning_api.version(db_api.MIGRATE_REPO),
+                         versioning_api.db_version(engine, db_api.MIGRATE_REPO))
+        self.assertEqual(set(models.Task.__table__.columns.keys()),
+                         self._columns('task'))
+        self.assertTrue({'task_state_idx', 'task_src_cloud_state_idx',
+                         'task_dest_cloud_state_idx', 'ix_task_name'} <= self._indexes('task'))
+        # The tasks created before are named by the migration
+        self.assertEqual([('u1', None), ('u2', 'web-2'), ('u3', 'db')],
+                         engine.execute('SELECT uuid, name FROM task ORDER BY id').fetchall())
+
+    def test_mysql_lock_timeout(self):
+        engine = mock.MagicMock()
+        engine.dialect.name = 'mysql'
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.return_value.scalar.return_value = 0
+        with mock.patch.object(db_api, 'get_engine', return_value=engine), \
+                mock.patch.object(db_api, 'versioning_api') as versioning:
+            self.assertRaises(Exception, db_api.db_sync)
+        self.assertFalse(versioning.upgrade.called)
+        conn.execute.assert_called_once_with(mock.ANY, name=db_api.DB_SYNC_LOCK,
+                                             timeout=db_api.DB_SYNC_LOCK_TIMEOUT)
+
+    def test_mysql_lock(self):
+        engine = mock.MagicMock()
+        engine.dialect.name = 'mysql'
+        conn = engine.connect.return_value.__enter__.return_value
+        conn.execute.return_value.scalar.return_value = 1
+        with mock.patch.object(db_api, 'get_engine', return_value=engine), \
+                mock.patch.object(db_api, 'versioning_api') as versioning:
+            db_api.db_sync()
+        self.assertTrue(versioning.upgrade.called)
+        conn.execute.assert_called_with(mock.ANY, name=db_api.DB_SYNC_LOCK)
+
+
+class TaskTestCase(base.DBTestCase):
+
+    def test_task_update_by_uuid(self):
+        task = db_api.create(models.Task(src_cloud='s', src_server='{}',
+                                         dest_cloud='d', dest_server='{}'))
+        db_api.task_update_by_uuid(task.uuid, current_disk=1, disk_count=2,
+                                   copied_bytes=2 ** 40, throughput=12.5)
+        task = db_api.get_by_uuid(models.Task, task.uuid, to_dict=False)
+        self.assertEqual((1, 2, 2 ** 40, 12.5),
+                         (task.current_disk, task.disk_count, task.copied_bytes,
+                          task.throughput))
+
+
+
+    def test_create_all(self):
+        tasks = [models.Task(uuid=uuidutils.generate_uuid(), name=name, src_cloud='s',
+                             src_server='{}', dest_cloud='d', dest_server='{}')
+                 for name in ('web', 'db')]
+        db_api.create_all(tasks)
+        self.assertEqual(2, db_api.task_count_by_filter({}))
+        self.assertEqual('db', db_api.get_by_uuid(models.Task, tasks[1].uuid)['name'])
+
+class LicenseTestCase(base.DBTestCase):
+
+    def test_license_get_latest(self):
+        self.assertIsNone(db_api.license_get_latest())
+        for data in ('first', 'second'):
+            db_api.create(models.License(uuid=uuidutils.generate_uuid(), license=data))
+        self.assertEqual('second', db_api.license_get_latest().license)
+
+class TaskPageTestCase(base.DBTestCase):
+
+    def setUp(self):
+        super(TaskPageTestCase, self).setUp()
+        self.uuids = []
+        for i, (name, state, src_cloud) in enumerate([('web-1', 'init', 's1'),
+                                                      ('web_2', 'running', 's1'),
+                                                      ('db-1', 'error', 's2'),
+                                                      ('web-3', 'finished', 's2'),
+                                                      ('web%4', 'running', 's1')]):
+            task = models.Task(uuid=uuidutils.generate_uuid(), name=name, state=state,
+                               src_cloud=src_cloud, src_server='{}', dest_cloud='d',
+                               dest_server='{}', percent=i * 10)
+            self.uuids.append(db_api.create(task).uuid)
+
+    def _names(self, tasks):
+        return [t['name'] for t in tasks]
+
+    def test_all_newest_first(self):
+        tasks, total, marker = db_api.task_get_page()
+        self.assertEqual(['web%4', 'web-3', 'db-1', 'web_2', 'web-1'], self._names(tasks))
+        self.assertEqual(5, total)
+        self.assertIsNone(marker)
+
+    def test_pages(self):
+        tasks, total, marker = db_api.task_get_page(limit=2)
+        self.assertEqual(['web%4', 'web-3'], self._names(tasks))
+        self.assertEqual((5, self.uuids[3]), (total, marker))
+        tasks, total, marker = db_api.task_get_page(limit=2, marker=marker)
+        self.assertEqual(['db-1', 'web_2'], self._names(tasks))
+        tasks, total, marker = db_api.task_get_page(limit=2, marker=marker)
+        self.assertEqual(['web-1'], self._names(tasks))
+        self.assertIsNone(marker)
+
+    def test_sort(self):
+        tasks, _, marker = db_api.task_get_page(limit=3, sort_key='name', sort_dir='asc')
+        self.assertEqual(['db-1', 'web%4', 'web-1'], self._names(tasks))
+        tasks, _, _ = db_api.task_get_page(limit=3, marker=marker, sort_key='name',
+                                           sort_dir='asc')
+        self.assertEqual(['web-3', 'web_2'], self._names(tasks))
+
+    def test_filters(self):
+        tasks, total, _ = db_api.task_get_page({'state': ['running', 'init'], 'src_cloud': 's1'},
+                                               limit=1)
+        self.assertEqual(['web%4'], self._names(tasks))
+        self.assertEqual(3, total)
+        tasks, total, _ = db_api.task_get_page({'dest_cloud': 'd', 'name': 'db'})
+        self.assertEqual((['db-1'], 1), (self._names(tasks), total))
+
+    def test_name_is_a_substring(self):
+        # The wildcards of LIKE match themselves only
+        tasks, _, _ = db_api.task_get_page({'name': '_'})
+        self.assertEqual(['web_2'], self._names(tasks))
+        tasks, _, _ = db_api.task_get_page({'name': '%'})
+        self.assertEqual(['web%4'], self._names(tasks))
+
+    def test_unknown_marker(self):
+        self.assertRaises(Exception, db_api.task_get_page, limit=1, marker='missing')
+
+    def test_count(self):
+        self.assertEqual(5, db_api.task_count_by_filter({}))
+        self.assertEqual(3, db_api.task_count_by_filter({'state': ['running', 'init']}))
+        self.assertEqual(1, db_api.task_count_by_filter({'state': ['running'],
+                                                         'src_cloud': 's1',
+                                                         'name': '%'}))
+        self.assertEqual(0, db_api.task_count_by_filter({'dest_cloud': 'other'}))
+
+    def test_exists(self):
+        self.assertEqual(self.uuids[2], db_api.task_exists_by_filter({'src_cloud': 's2',
+                                                                      'state': ['error']}))
+        self.assertIn(db_api.task_exists_by_filter({'dest_cloud': 'd'}), self.uuids)
+        self.assertIsNone(db_api.task_exists_by_filter({'src_cloud': 'other'}))
+
+
+class GetByUuidsTestCase(base.DBTestCase):
+
+    def test_get_by_uuids(self):
+        clouds = [db_api.create(models.VMware(uuid=uuidutils.generate_uuid(), name=f'vc-{i}'))
+                  for i in range(5)]
+        uuids = [c.uuid for c in clouds] + ['missing', clouds[0].uuid]
+        statements = []
+        event.listen(db_api.get_engine(), 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        with mock.patch.object(db_api, 'IN_QUERY_BATCH', 2):
+            by_uuid = db_api.get_by_uuids(models.VMware, uuids)
+        # 6 distinct uuids in batches of 2
+        self.assertEqual(3, len([s for s in statements if 'FROM vmware' in s]))
+        self.assertEqual(set(uuids), set(by_uuid))
+        self.assertEqual(['vc-0', 'vc-4'], [by_uuid[clouds[i].uuid]['name'] for i in (0, 4)])
+        self.assertEqual(db_api.data_to_dict(models.VMware, None), by_uuid['missing'])
+
+    def test_get_by_uuids_rows(self):
+        cloud = db_api.create(models.VMware(uuid=uuidutils.generate_uuid(), name='vc'))
+        by_uuid = db_api.get_by_uuids(models.VMware, [cloud.uuid, 'missing'], to_dict=False)
+        self.assertEqual('vc', by_uuid[cloud.uuid].name)
+        self.assertIsNone(by_uuid['missing'])
+        self.assertEqual({}, db_api.get_by_uuids(models.VMware, []))
+
+
+class TaskLeaseTestCase(base.DBTestCase):
+
+    def setUp(self):
+        super(TaskLeaseTestCase, self).setUp()
+        timeutils.set_time_override(datetime.datetime(2024, 1, 1))
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _task(self, **values):
+        task = models.Task(src_cloud='s', src_server='{}', dest_cloud='d', dest_server='{}',
+                           state='init', uuid=uuidutils.generate_uuid(), **values)
+        return db_api.create(task).uuid
+
+    def _get(self, uuid):
+        return db_api.get_by_uuid(models.Task, uuid)
+
+    def test_claim_once(self):
+        uuid = self._task()
+        self.assertTrue(db_api.task_claim(uuid, 'agent-1', 60))
+        self.assertFalse(db_api.task_claim(uuid, 'agent-2', 60))
+        task = self._get(uuid)
+        self.assertEqual('agent-1', task['lease_owner'])
+        self.assertEqual(1, task['attempts'])
+
+    def test_claimable(self):
+        uuids = [self._task() for i in range(5)]
+        db_api.task_claim(uuids[1], 'agent-1', 60)
+        first = db_api.task_get_claimable(2, 'agent-1')
+        self.assertEqual([uuids[0], uuids[2]], [t['uuid'] for t in first])
+        rest = db_api.task_get_claimable(2, 'agent-1', after_id=first[-1]['id'])
+        self.assertEqual(uuids[3:], [t['uuid'] for t in rest])
+
+    def test_claimable_placed(self):
+        mine = self._task(agent='agent-1')
+        anyone = self._task()
+        self._task(agent='agent-2')
+        self.assertEqual([mine, anyone],
+                         [t['uuid'] for t in db_api.task_get_claimable(10, 'agent-1')])
+
+    def test_renew_and_expire(self):
+        uuid = self._task()
+        other = self._task()
+        db_api.task_claim(uuid, 'agent-1', 60)
+        db_api.task_claim(other, 'agent-2', 60)
+        timeutils.advance_time_seconds(50)
+        self.assertEqual([uuid], db_api.task_renew_leases([uuid, other], 'agent-1', 60))
+        # Only the lease of agent-2 expired
+        timeutils.advance_time_seconds(50)
+        self.assertEqual((1, 0), db_api.task_reclaim_expired(3))
+        self.assertEqual('agent-1', self._get(uuid)['lease_owner'])
+        task = self._get(other)
+        self.assertIsNone(task['lease_owner'])
+        self.assertEqual('init', task['state'])
+        self.assertEqual([], db_api.task_renew_leases([other], 'agent-2', 60))
+
+    def test_reclaim_exhausted_attempts(self):
+        uuid = self._task()
+        for attempt in range(2):
+            db_api.task_claim(uuid, 'agent-1', 60)
+            db_api.task_expire_leases('agent-1')
+            timeutils.advance_time_seconds(1)
+            self.assertEqual((1, 0), db_api.task_reclaim_expired(3))
+        db_api.task_claim(uuid, 'agent-1', 60)
+        timeutils.advance_time_seconds(61)
+        self.assertEqual((0, 1), db_api.task_reclaim_expired(3))
+        task = self._get(uuid)
+        self.assertEqual('failed', task['state'])
+        self.assertIsNone(task['lease_owner'])
+
+    def test_reclaim_skips_finished_tasks(self):
+        uuid = self._task()
+        db_api.task_claim(uuid, 'agent-1', 60)
+        db_api.task_update_by_uuid(uuid, state='succeed')
+        timeutils.advance_time_seconds(61)
+        self.assertEqual((0, 0), db_api.task_reclaim_expired(3))
+
+    def test_update_by_owner(self):
+        uuid = self._task()
+        db_api.task_claim(uuid, 'agent-1', 60)
+        self.assertFalse(db_api.task_update_by_owner(uuid, 'agent-2', state='succeed'))
+        self.assertTrue(db_api.task_update_by_owner(uuid, 'agent-1', state='succeed'))
+        self.assertEqual('succeed', self._get(uuid)['state'])
+
+    def test_requeue(self):
+        uuid = self._task()
+        db_api.task_claim(uuid, 'agent-1', 60)
+        db_api.task_update_by_uuid(uuid, state='failed', percent=40)
+        db_api.task_release_lease(uuid, 'agent-1')
+        db_api.task_requeue(uuid, agent='agent-2')
+        task = self._get(uuid)
+        self.assertEqual(('init', 0, 0, None, 'agent-2'),
+                         (task['state'], task['percent'], task['attempts'], task['lease_owner'],
+                          task['agent']))
+        self.assertEqual([], db_api.task_get_claimable(10, 'agent-1'))
+        self.assertEqual([uuid], [t['uuid'] for t in db_api.task_get_claimable(10, 'agent-2')])
+
+    def test_queue(self):
+        running = self._task()
+        waiting = self._task(reason='waiting for a free slot')
+        db_api.task_claim(running, 'agent-1', 60)
+        self.assertEqual({
+            'running': [{'task_id': running, 'state': 'init', 'agent': 'agent-1',
+                         'attempts': 1}],
+            'waiting': [{'task_id': waiting, 'agent': None,
+                         'reason': 'waiting for a free slot'}],
+        }, db_api.task_get_queue())
+
+
+class AgentTestCase(base.DBTestCase):
+
+    def setUp(self):
+        super(AgentTestCase, self).setUp()
+        timeutils.set_time_override(datetime.datetime(2024, 1, 1))
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _task(self, **values):
+        task = models.Task(src_cloud='s', src_server='{}', dest_cloud='d', dest_server='{}',
+                           state='init', uuid=uuidutils.generate_uuid(), **values)
+        return db_api.create(task).uuid
+
+    def test_heartbeat(self):
+        db_api.agent_heartbeat('agent-1', running=1, free_slots=3, affinity='')
+        timeutils.advance_time_seconds(60)
+        db_api.agent_heartbeat('agent-2', running=0, free_slots=4, affinity='')
+        db_api.agent_heartbeat('agent-1', running=2, free_slots=2)
+        agents = db_api.agent_get_all()
+        self.assertEqual([('agent-1', 2, 2), ('agent-2', 0, 4)],
+                         [(a['host'], a['running'], a['free_slots']) for a in agents])
+        timeutils.advance_time_seconds(30)
+        alive_since = timeutils.utcnow() - datetime.timedelta(seconds=60)
+        db_api.agent_heartbeat('agent-1')
+        self.assertEqual(['agent-1', 'agent-2'],
+                         [a['host'] for a in db_api.agent_get_all(alive_since=alive_since)])
+        timeutils.advance_time_seconds(31)
+        alive_since = timeutils.utcnow() - datetime.timedelta(seconds=60)
+        self.assertEqual(['agent-1'],
+                         [a['host'] for a in db_api.agent_get_all(alive_since=alive_since)])
+
+    def test_unplace_lost(self):
+        db_api.agent_heartbeat('agent-1')
+        timeutils.advance_time_seconds(100)
+        db_api.agent_heartbeat('agent-2')
+        lost = self._task(agent='agent-1')
+        alive = self._task(agent='agent-2')
+        unknown = self._task(agent='agent-3')
+        running = self._task(agent='agent-1')
+        db_api.task_claim(running, 'agent-1', 60)
+        alive_since = timeutils.utcnow() - datetime.timedelta(seconds=90)
+        self.assertEqual(2, db_api.task_unplace_lost(alive_since))
+        agents = {uuid: db_api.get_by_uuid(models.Task, uuid)['agent']
+                  for uuid in (lost, alive, unknown, running)}
+        self.assertEqual({lost: None, alive: 'agent-2', unknown: None, running: 'agent-1'},
+                         agents)
+
+    def test_count_queued_and_throughput(self):
+        self._task(agent='agent-1')
+        self._task(agent='agent-1')
+        self._task()
+        running = self._task(agent='agent-2', throughput=12.5)
+        db_api.task_claim(running, 'agent-2', 60)
+        db_api.task_update_by_uuid(running, state='running')
+        self.assertEqual({'agent-1': 2}, db_api.task_count_queued_by_agent())
+        self.assertEqual(12.5, db_api.task_sum_throughput('agent-2'))
+        self.assertEqual(0.0, db_api.task_sum_throughput('agent-1'))